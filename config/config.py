@@ -6,6 +6,18 @@ class parameters:
     source_data_path = os.path.join(os.path.abspath(os.getcwd()), "data")    # 原始数据路径
     sql_db_path = os.path.join(os.path.abspath(os.getcwd()), "data_handle", "dataset") # 数据库路径
     sql_data_name = "data1"    # 数据库名称
+    sql_manifest_table_name = "data1_manifest"    # 源文件清单表名称，记录文件大小、修改时间与内容hash，用于增量处理
+    sql_change_log_table_name = "chunk_change_log"    # 切分表的变更日志表名称，向量库据此增量同步
+    parse_workers = 4    # 并行解析文件的进程数，1为在当前进程中顺序解析
+    pdf_stream_min_pages = 200    # 页数不少于该值的PDF按页流式读取，并按页范围多进程解析
+    pdf_pages_per_task = 50    # PDF按页范围解析时每个任务的页数
+    insert_batch_size = 2000    # 切分结果每积累多少条写入一次数据库
+    fts_tokenizer = "trigram"    # 切分表全文索引（FTS5）的分词器，trigram 按三字组匹配，适合中文
+    fts_max_terms = 64    # 全文检索时问题最多拆成的匹配项数
+    near_dedup_enable = True    # 切分后用 MinHash/LSH 消除句子表中的近似重复 chunk，只保留一个代表，其余记录到 {表名}_duplicates
+    near_dedup_threshold = 0.85    # 估计的 Jaccard 相似度（字符三元组）不低于该值时视为近似重复
+    minhash_num_perm = 64    # MinHash 签名长度，写入数据库后修改需要删除签名表重建
+    minhash_bands = 16    # LSH 分段数，每段 minhash_num_perm/minhash_bands 个值
 
 
 
@@ -14,6 +26,8 @@ class parameters:
     split_mode = "sentence"  # 分割方法：sentence or paragraph
     split_chunk_size = 100   # 句子长度
     split_chunk_overlap = 20  # 句子重叠长度
+    spacy_batch_size = 64   # 英文分句时 nlp.pipe 每批的文本数
+    spacy_n_process = 1   # 英文分句时 nlp.pipe 的进程数，英文语料很多时可以调大
 
     sql_paragraph_table_name = "data1_paragraph"    # 段落表名称
     is_split_paragraph = True   # 是否分割段落
@@ -27,20 +41,78 @@ class parameters:
     use_embedding_model = "bge-m3"   # embedding_model: "all-MiniLM-L6-v2" or "bge-m3"
     LanceDB_path = os.path.join(os.path.abspath(os.getcwd()), "knowledge", "dataset", "lancedb")
     LanceDB_table_name = "data1"
+    LanceDB_paragraph_table_name = LanceDB_table_name + "_paragraph"   # 段落向量表，分层检索时先检索段落
+    lancedb_refresh_interval = 5   # 已打开的表检查是否有新提交版本的间隔（秒），0表示每次读取都检查
+    lancedb_cache_budget_mb = 2048   # 表句柄缓存的内存预算（MB），超出后淘汰最久未使用的表
+    ann_index_min_rows = 100000   # 行数达到该值后自动建立向量索引，之前使用暴力搜索
+    ann_index_type = "IVF_PQ"   # 向量索引类型："IVF_PQ" or "IVF_HNSW_SQ"
+    ann_index_metric = "L2"   # 向量索引的距离度量，需与检索时一致："L2" or "cosine" or "dot"
+    ann_stale_ratio = 0.2   # 未建索引的行数超过总行数的该比例时重建索引
+    embedding_batch_size = 64   # 批量编码时每个batch的句子数
+    embedding_cache_enable = True   # 是否使用磁盘向量缓存，只编码从未见过的文本
+    embedding_cache_path = os.path.join(os.path.abspath(os.getcwd()), "knowledge", "dataset", "embedding_cache")
+    embedding_cache_max_items = 200000   # 向量缓存的最大条数，超出后按最近最少使用淘汰
+    query_cache_size = 10000   # 查询向量的进程内 LRU 缓存条数
+    query_cache_ttl = 3600   # 查询向量缓存的过期时间（秒），None为不过期
+    query_cache_disk = False   # 查询向量是否同时写入磁盘缓存，重启后仍可命中
+    query_cache_path = os.path.join(os.path.abspath(os.getcwd()), "knowledge", "dataset", "query_cache")   # 查询向量的磁盘缓存目录，与chunk的向量缓存分开
 
 
     # 3\检索器
-    seach_type = "simple" #搜索方法：simple or layering
+    seach_type = "simple" #搜索方法：simple or layering or hybrid
     search_topk = 10
     search_table = "data1"
+    search_nprobes = 20   # 有向量索引时每次检索探查的分区数，越大召回越高、越慢
+    search_refine_factor = 5   # 先取 topk*refine_factor 条候选再用原始向量精排，None为不精排
+    search_lexical_table = "data1_sentence"   # hybrid 检索时做全文检索的切分表，与 search_table 的向量来自同一张表
+    hybrid_candidates = 3   # hybrid 检索时向量与全文各取 topk*hybrid_candidates 条候选再融合
+    rrf_k = 60   # 倒数排名融合的平滑常数，得分为 Σ 1/(rrf_k + 排名)
+    batch_search_size = 256   # 批量检索时每个多向量查询包含的向量数
+    batch_search_workers = 4   # 批量检索时并行执行的批次数
+    layering_paragraph_topk = 5   # layering 检索时先取的段落数，只在这些段落的句子中检索
+    search_backend = "lancedb"   # 向量检索后端："lancedb" or "mmap"（内存映射矩阵精确检索，适合200万条以内的知识库）
+    mmap_index_path = os.path.join(os.path.abspath(os.getcwd()), "knowledge", "dataset", "mmap_index")   # mmap 后端的导出目录，每个表一个子目录
+    mmap_block_rows = 262144   # mmap 后端每次矩阵乘法参与的行数
+    quantization = "none"   # mmap 后端的量化编码："none" or "int8" or "binary"，先在编码上筛选候选再精排
+    quant_rescore_factor = 10   # 量化检索时保留 topk*quant_rescore_factor 个候选精排
+    quant_keep_full = True   # 是否保留 float32 原始向量用于精确精排，False 时只保留编码，用 int8 近似精排
+    quant_block_rows = 32768   # 量化检索每次计算的行数
+    quant_report_queries = 200   # 评估量化 recall 时抽样的查询数
+    shard_num = 1   # 句子向量表的分片数，大于1时按分区器写入 {LanceDB_table_name}_shard{i}，检索时并行查询所有分片
+    shard_paths = []   # 分片所在的 LanceDB 目录，第 i 个分片放在 shard_paths[i % len(shard_paths)]，为空时都在 LanceDB_path
+    shard_partitioner = "hash"   # 分区器："hash"（按 chunk id 的 hash）or "column"（按 shard_partition_column 的取值，例如来源文档）
+    shard_partition_column = "doc_id"   # column 分区器使用的切分表列
+    shard_timeout = 2.0   # 每个分片的检索超时（秒），超时的分片本次被跳过
+    shard_workers = 2   # 每个分片独立的检索线程数，一个分片变慢不会占用其他分片的线程
+    rerank_enable = False   # 是否在检索与生成之间用 cross-encoder 重排序
+    rerank_model_path = "D:/DL/rag/RAG-ppline/model/bge-reranker-base"   # cross-encoder 模型路径
+    rerank_candidates = 30   # 开启重排序时检索的候选数
+    rerank_topn = 4   # 重排序后交给 LLM 的 chunk 数
+    rerank_budget_ms = 150   # 重排序的时间预算（毫秒），按实测的单条打分耗时限制需要打分的候选数，None 为不限制
+    rerank_max_length = 256   # 问题与 chunk 拼接后的最大 token 数
+    rerank_cache_size = 10000   # 重排序分数缓存的条数，键为 (问题, chunk id)
 
     # 4\生成器
     use_type= "ollama"
     host_port = "http://127.0.0.1:11434"
     llm_model= "qwen2.5:0.5b"
     temperature= 0.95
+    llm_num_ctx = 4096   # 上下文长度
+    llm_keep_alive = "30m"   # 模型在两次请求之间保持加载的时间
+    answer_cache_size = 1000   # 语义回答缓存的最大条数
+    answer_cache_threshold = 0.95   # 问题向量的余弦相似度不低于该值、且检索到的chunk相同时，直接返回缓存的回答
+    context_token_budget = 1500   # 交给 LLM 的知识片段的 token 总数上限，按切分时写入的 token_count 计算
+    context_dedup_threshold = 0.8   # 片段的字符三元组有不少于该比例已出现在选中的片段中时视为近似重复，不再加入
 
 
     # 5\输出
     output_path= "./output"
-    
\ No newline at end of file
+    
+    # 6\并发查询
+    engine_workers = 4   # 向量化与检索使用的线程数
+    llm_max_concurrency = 2   # 同时进行的 LLM 生成数，超出的请求排队等待
+    query_timeout = 120   # 单个请求从向量化到生成结束的超时时间（秒）
+    search_filter = "_distance < 0.9"   # 检索时的过滤条件
+    server_host = "127.0.0.1"   # web-ui/server.py 监听的地址
+    server_port = 8000
+    server_queue_size = 32   # 同时接纳的查询数（含排队），超出时返回 429
@@ -0,0 +1,67 @@
+# 切分基准：对比两阶段切分（spaCy 分句后由 LangChain 重新切分）与基于偏移量的单遍切分的速度和结果
+# 用法：python -m data_handle.benchmark_chunker [文本文件或目录 ...]，默认使用原始数据目录中的 txt 文件
+import os
+import sys
+import time
+from config.config import parameters
+from .split_data import split_sentences, split_paragraphs
+from .chunker import chunk_text
+
+
+def _normalize(chunk: str) -> str:
+    # 两阶段切分把句子以 "\n" 重新连接，比较时忽略空白的差异
+    return "".join(chunk.split())
+
+
+def _timed(func, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def compare(text: str, mode: str = "sentence", repeat: int = 3) -> dict:
+    """
+    用两种方式切分同一段文本，各重复 repeat 次取最短耗时。
+    :param mode: "sentence" 或 "paragraph"
+    :return: 统计结果，same 为单遍切分的 chunk 中与两阶段切分完全相同（忽略空白）的比例
+    """
+    if mode == "sentence":
+        chunk_size, chunk_overlap, two_stage = parameters.split_chunk_size, parameters.split_chunk_overlap, split_sentences
+    else:
+        chunk_size, chunk_overlap, two_stage = parameters.paragraph_chunk_size, parameters.paragraph_chunk_overlap, split_paragraphs
+    old_seconds, old_chunks = _timed(lambda: two_stage(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap), repeat)
+    new_seconds, new_spans = _timed(lambda: list(chunk_text(text, chunk_size, chunk_overlap, mode=mode)), repeat)
+    new_chunks = [text[start:end] for start, end in new_spans]
+    old_set = {_normalize(chunk) for chunk in old_chunks}
+    same = sum(1 for chunk in new_chunks if _normalize(chunk) in old_set)
+    return {"mode": mode, "chars": len(text),
+            "old_seconds": old_seconds, "new_seconds": new_seconds,
+            "old_chunks": len(old_chunks), "new_chunks": len(new_chunks),
+            "old_max_len": max(map(len, old_chunks), default=0), "new_max_len": max(map(len, new_chunks), default=0),
+            "same": same / len(new_chunks) if new_chunks else 1.0}
+
+
+def _text_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".txt"):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    for file_path in _text_files(sys.argv[1:] or [parameters.source_data_path]):
+        with open(file_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        for mode in ("sentence", "paragraph"):
+            result = compare(text, mode)
+            print(f"{os.path.basename(file_path)} [{mode}] {result['chars']}字符")
+            print(f"  两阶段切分：{result['old_seconds'] * 1000:.1f}ms，{result['chars'] / max(result['old_seconds'], 1e-9):.0f} 字符/s，"
+                  f"{result['old_chunks']}个chunk，最长{result['old_max_len']}")
+            print(f"  单遍切分：  {result['new_seconds'] * 1000:.1f}ms，{result['chars'] / max(result['new_seconds'], 1e-9):.0f} 字符/s，"
+                  f"{result['new_chunks']}个chunk，最长{result['new_max_len']}，与两阶段切分相同的chunk占{result['same']:.1%}")
@@ -0,0 +1,74 @@
+# 切分表的变更日志：通过触发器记录每个 chunk 的新增与删除，供向量库按 chunk id 增量同步
+from config.config import parameters
+
+
+class ChunkChangeLog:
+    def __init__(self, db, log_table: str = parameters.sql_change_log_table_name):
+        """
+        :param db: DatabaseManager 实例
+        :param log_table: 变更日志表名
+        """
+        self.db = db
+        self.log_table = log_table
+        self.cursor_table = f"{log_table}_cursor"
+        self.db.create_table(log_table, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                                         "table_name": "TEXT NOT NULL",
+                                         "chunk_id": "INTEGER NOT NULL",
+                                         "op": "TEXT NOT NULL"})
+        # 每个消费者（如某个lancedb表）各自记录已经同步到的日志位置
+        self.db.create_table(self.cursor_table, {"consumer": "TEXT PRIMARY KEY",
+                                                 "last_id": "INTEGER NOT NULL"})
+
+    def install(self, table_name: str):
+        """
+        在切分表上创建触发器，新增与删除 chunk 时自动写入变更日志。
+        :param table_name: 切分表名
+        """
+        for event, op, row in (("INSERT", "add", "NEW"), ("DELETE", "delete", "OLD")):
+            self.db.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table_name}_{op} AFTER {event} ON {table_name} "
+                                   f"BEGIN INSERT INTO {self.log_table} (table_name, chunk_id, op) VALUES ('{table_name}', {row}.id, '{op}'); END")
+        self.db.conn.commit()
+
+    def last_id(self):
+        """
+        当前日志的最大 id。
+        """
+        self.db.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.log_table}")
+        return self.db.cursor.fetchone()[0]
+
+    def get_cursor(self, consumer: str):
+        """
+        消费者已经同步到的日志 id，没有记录时返回 None。
+        """
+        self.db.cursor.execute(f"SELECT last_id FROM {self.cursor_table} WHERE consumer = ?", (consumer,))
+        row = self.db.cursor.fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, consumer: str, last_id: int):
+        """
+        记录消费者同步到的日志位置，并清理所有消费者都已同步过的日志。
+        """
+        self.db.cursor.execute(f"INSERT INTO {self.cursor_table} (consumer, last_id) VALUES (?, ?) "
+                               f"ON CONFLICT(consumer) DO UPDATE SET last_id = excluded.last_id", (consumer, last_id))
+        self.db.cursor.execute(f"DELETE FROM {self.log_table} WHERE id <= (SELECT MIN(last_id) FROM {self.cursor_table})")
+        self.db.conn.commit()
+
+    def fetch_changes(self, table_name: str, consumer: str):
+        """
+        读取消费者尚未同步的变更，并合并为最终状态。
+        同一个 chunk 先增后删视为删除，删除后又新增视为新增。
+        :param table_name: 切分表名
+        :param consumer: 消费者名称
+        :return: (added_ids, deleted_ids, last_id)
+        """
+        after_id = self.get_cursor(consumer) or 0
+        self.db.cursor.execute(f"SELECT id, chunk_id, op FROM {self.log_table} WHERE table_name = ? AND id > ? ORDER BY id",
+                               (table_name, after_id))
+        final_op = {}
+        last_id = after_id
+        for log_id, chunk_id, op in self.db.cursor.fetchall():
+            final_op[chunk_id] = op
+            last_id = log_id
+        added_ids = [chunk_id for chunk_id, op in final_op.items() if op == "add"]
+        deleted_ids = [chunk_id for chunk_id, op in final_op.items() if op == "delete"]
+        return added_ids, deleted_ids, max(last_id, after_id)
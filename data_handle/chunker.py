@@ -0,0 +1,138 @@
+# 基于偏移量的切分：一次线性扫描完成分句、按长度合并与重叠，只产生 (start, end) 偏移量，不复制文本
+# 合并规则与 LangChain 的 RecursiveCharacterTextSplitter 一致：整句合并到不超过 chunk_size，下一个 chunk 以不超过 chunk_overlap 的末尾整句开头
+# 偏移量是字符在文档文本（各页文本以 "\n" 连接）中的位置，切分表记录 start_offset 与 end_offset
+import re
+from collections import deque
+from config.config import parameters
+from .split_data import segment_spans, strip_span
+
+PARAGRAPH_PATTERN = re.compile(r"(?:(?!\n\n).)+", re.S)
+
+
+def sentence_spans(text: str, start: int = 0, end: int = None):
+    """
+    text[start:end] 中每个句子的区间。中文按标点分句；英文用只启用分句组件的 spaCy 管道。
+    :return: 列表，每个元素为 (start, end)
+    """
+    end = len(text) if end is None else end
+    piece = text if (start, end) == (0, len(text)) else text[start:end]
+    return [(start + s, start + e) for s, e in segment_spans([piece])[0]]
+
+
+def paragraph_spans(text: str, start: int = 0, end: int = None):
+    """
+    text[start:end] 中以空行分隔的段落的区间。
+    :return: 生成器，每个元素为 (start, end)
+    """
+    end = len(text) if end is None else end
+    for match in PARAGRAPH_PATTERN.finditer(text, start, end):
+        span = strip_span(text, match.start(), match.end())
+        if span:
+            yield span
+
+
+def chunk_spans(pieces, chunk_size: int, chunk_overlap: int):
+    """
+    把按顺序排列的片段区间合并为 chunk 区间。
+    chunk 由连续的整片段组成，长度（首片段开头到末片段结尾）不超过 chunk_size；
+    下一个 chunk 从上一个 chunk 末尾总长不超过 chunk_overlap 的片段开始。超过 chunk_size 的单个片段按 chunk_size 截成多段，相邻两段重叠 chunk_overlap 个字符。
+    :param pieces: 片段区间的可迭代对象，如 sentence_spans 的结果
+    :return: 生成器，每个元素为 (start, end)
+    """
+    window = deque()  # 当前 chunk 中的片段
+    for start, end in pieces:
+        parts = [(start, end)]
+        if end - start > chunk_size:
+            step = max(chunk_size - chunk_overlap, 1)
+            parts = [(s, min(s + chunk_size, end)) for s in range(start, end - chunk_overlap, step)]
+        for part in parts:
+            if window and part[1] - window[0][0] > chunk_size:
+                yield window[0][0], window[-1][1]
+                # 保留末尾不超过 chunk_overlap 的片段作为重叠，且保证加入新片段后不超过 chunk_size
+                while window and (window[-1][1] - window[0][0] > chunk_overlap or part[1] - window[0][0] > chunk_size):
+                    window.popleft()
+            window.append(part)
+    if window:
+        yield window[0][0], window[-1][1]
+
+
+class OffsetChunker:
+    def __init__(self, chunk_size: int = parameters.split_chunk_size, chunk_overlap: int = parameters.split_chunk_overlap,
+                 mode: str = "sentence"):
+        """
+        按页增量切分文档，只保留最后一个可能被分页截断的 chunk 开始的文本，内存占用与文档大小无关。
+        :param chunk_size: 每个 chunk 的最大长度
+        :param chunk_overlap: 相邻 chunk 的最大重叠长度
+        :param mode: "sentence"（整句合并）或 "paragraph"（整段合并）
+        """
+        if mode not in ("sentence", "paragraph"):
+            raise ValueError("Unsupported mode. Please choose 'sentence' or 'paragraph'.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.spans = sentence_spans if mode == "sentence" else paragraph_spans
+        self.buffer = ""        # 尚未确定的文本
+        self.offset = 0         # buffer[0] 在文档中的偏移量
+        self.pages = deque()    # buffer 中各页的 (起始偏移量, 页码)
+        self.mid_piece = False  # buffer 从超长片段的某个截断位置开始
+        self.started = False
+
+    def _page_of(self, position: int):
+        page = None
+        for start, page_no in self.pages:
+            if start > position:
+                break
+            page = page_no
+        return page
+
+    def _emit(self, final: bool):
+        pieces = list(self.spans(self.buffer))
+        piece_starts = {start for start, _ in pieces}
+        if self.mid_piece and pieces:
+            # 截断位置在整篇切分的截断网格上，剩余部分从 0 开始重新截断（不去掉开头的空白）即得到相同的截断位置
+            piece_starts.discard(pieces[0][0])
+            pieces[0] = (0, pieces[0][1])
+        spans = list(chunk_spans(pieces, self.chunk_size, self.chunk_overlap))
+        if not final:
+            # 最后一个 chunk 可能被分页截断，从它的开头起留到下一页重新切分
+            keep_from = spans.pop()[0] if spans else len(self.buffer)
+        results = [(self.offset + start, self.offset + end, self._page_of(self.offset + start), self.buffer[start:end])
+                   for start, end in spans]
+        if not final:
+            self.mid_piece = keep_from < len(self.buffer) and keep_from not in piece_starts
+            self.buffer = self.buffer[keep_from:]
+            self.offset += keep_from
+            while len(self.pages) > 1 and self.pages[1][0] <= self.offset:
+                self.pages.popleft()
+        return results
+
+    def feed(self, page_no, text: str):
+        """
+        加入一页文本，返回已经确定的 chunk。
+        :param page_no: 页码，非分页文档为 None
+        :param text: 该页文本
+        :return: 列表，每个元素为 (start, end, 起始页码, chunk 文本)
+        """
+        if self.started:
+            self.buffer += "\n"
+        self.started = True
+        self.pages.append((self.offset + len(self.buffer), page_no))
+        self.buffer += text or ""
+        return self._emit(final=False)
+
+    def flush(self):
+        """
+        文档结束，返回剩余的 chunk。
+        """
+        results = self._emit(final=True)
+        self.buffer, self.offset, self.pages, self.mid_piece, self.started = "", 0, deque(), False, False
+        return results
+
+
+def chunk_text(text: str, chunk_size: int = parameters.split_chunk_size, chunk_overlap: int = parameters.split_chunk_overlap,
+               mode: str = "sentence", start: int = 0, end: int = None):
+    """
+    切分一段文本（或其中的 [start, end) 区间），返回 chunk 的区间。
+    :return: 生成器，每个元素为 (start, end)
+    """
+    spans = sentence_spans if mode == "sentence" else paragraph_spans
+    return chunk_spans(spans(text, start, end), chunk_size, chunk_overlap)
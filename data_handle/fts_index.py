@@ -0,0 +1,136 @@
+# 切分表的全文索引：FTS5 外部内容表 + trigram 分词，中文不需要分词器也能按子串匹配药名、型号等精确词
+# 触发器随切分表的增删同步维护索引，不需要重建
+import re
+from config.config import parameters
+
+_TERM_PATTERN = re.compile(r"[㐀-鿿豈-﫿]+|[0-9A-Za-z][0-9A-Za-z._\-]*")
+
+
+def split_terms(question: str, max_terms: int = parameters.fts_max_terms):
+    """
+    把问题拆成匹配项：中文连续片段拆成相邻的三字组，英文与数字词整体作为一项。
+    trigram 分词无法匹配少于3个字符的词，其中的中文词与含数字的型号（如“仔猪”、“b1”）另外返回，由 LIKE 子串匹配补充；
+    不足3个字母的英文词多为虚词，直接忽略。
+    :param question: 用户问题
+    :param max_terms: 每类最多使用的匹配项数，限制长问题的查询开销
+    :return: (三字组及以上的匹配项, 少于3个字符的匹配项)
+    """
+    terms, short_terms = [], []
+    for piece in _TERM_PATTERN.findall(question.lower()):
+        if len(piece) < 3:
+            if not piece.isascii() or any(c.isdigit() for c in piece):
+                short_terms.append(piece)
+        elif piece.isascii():
+            terms.append(piece)
+        else:
+            terms.extend(piece[i:i + 3] for i in range(len(piece) - 2))
+    return list(dict.fromkeys(terms))[:max_terms], list(dict.fromkeys(short_terms))[:max_terms]
+
+
+def build_match_query(question: str, max_terms: int = parameters.fts_max_terms):
+    """
+    把问题转换为 FTS5 的 MATCH 表达式：各匹配项作为短语，之间用 OR 连接，命中的三字组越多 bm25 得分越高。
+    少于3个字符的词不在表达式中，见 split_terms。
+    :param question: 用户问题
+    :param max_terms: 最多使用的匹配项数，限制长问题的查询开销
+    :return: MATCH 表达式，没有可用的匹配项时返回 None
+    """
+    terms, _ = split_terms(question, max_terms)
+    return match_expression(terms)
+
+
+def match_expression(terms):
+    """
+    匹配项转换为用 OR 连接的短语，没有匹配项时返回 None。
+    """
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def like_pattern(term: str) -> str:
+    """
+    子串匹配的 LIKE 模式，转义 %、_ 与转义符本身。
+    """
+    return "%" + re.sub(r"([%_\\])", r"\\\1", term) + "%"
+
+
+class ChunkFTSIndex:
+    def __init__(self, db, table_name: str, tokenizer: str = parameters.fts_tokenizer):
+        """
+        :param db: DatabaseManager 实例
+        :param table_name: 切分表名，需有 id 与 content 列
+        :param tokenizer: FTS5 分词器，中文使用 trigram
+        """
+        self.db = db
+        self.table_name = table_name
+        self.fts_table = f"{table_name}_fts"
+        self.tokenizer = tokenizer
+
+    def exists(self) -> bool:
+        self.db.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.fts_table,))
+        return self.db.cursor.fetchone() is not None
+
+    def install(self):
+        """
+        创建全文索引与维护触发器；索引是新建的而切分表中已有数据时，从切分表重建一次。
+        """
+        created = not self.exists()
+        self.db.cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+                               f"content, content='{self.table_name}', content_rowid='id', tokenize='{self.tokenizer}')")
+        t, f = self.table_name, self.fts_table
+        self.db.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_add AFTER INSERT ON {t} "
+                               f"BEGIN INSERT INTO {f} (rowid, content) VALUES (NEW.id, NEW.content); END")
+        self.db.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_delete AFTER DELETE ON {t} "
+                               f"BEGIN INSERT INTO {f} ({f}, rowid, content) VALUES ('delete', OLD.id, OLD.content); END")
+        self.db.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{t}_fts_update AFTER UPDATE OF content ON {t} "
+                               f"BEGIN INSERT INTO {f} ({f}, rowid, content) VALUES ('delete', OLD.id, OLD.content); "
+                               f"INSERT INTO {f} (rowid, content) VALUES (NEW.id, NEW.content); END")
+        self.db.conn.commit()
+        if created and self.db.count_rows(self.table_name):
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        从切分表重建整个全文索引。
+        """
+        self.db.cursor.execute(f"INSERT INTO {self.fts_table} ({self.fts_table}) VALUES ('rebuild')")
+        self.db.conn.commit()
+        print(f"全文索引 '{self.fts_table}' 重建完成✅")
+
+    def search(self, question: str, limit: int = parameters.search_topk):
+        """
+        全文检索。问题中有少于3个字符的词且全文索引命中不足 limit 条时，再在切分表上用 LIKE 子串匹配补足，
+        补充的结果按命中的短词数从多到少排在全文索引结果之后，bm25 记为 0。
+        :param question: 用户问题
+        :param limit: 返回的条数
+        :return: [(chunk_id, content, bm25)]，按相关度从高到低排列（bm25 越小越相关）
+        """
+        terms, short_terms = split_terms(question)
+        hits = []
+        if terms:
+            match_query = match_expression(terms)
+            query = (f"SELECT rowid, content, bm25({self.fts_table}) AS score FROM {self.fts_table} "
+                     f"WHERE {self.fts_table} MATCH ? ORDER BY score LIMIT ?")
+            self.db.cursor.execute(query, (match_query, limit))
+            hits = self.db.cursor.fetchall()
+        if short_terms and len(hits) < limit:
+            hits += self.search_short_terms(short_terms, limit - len(hits), exclude=[hit[0] for hit in hits])
+        return hits
+
+    def search_short_terms(self, short_terms, limit: int, exclude=()):
+        """
+        trigram 无法索引的短词在切分表上逐行 LIKE 匹配，只在全文索引结果不足时使用。
+        :param short_terms: 少于3个字符的匹配项
+        :param limit: 返回的条数
+        :param exclude: 已经由全文索引返回的 chunk id
+        :return: [(chunk_id, content, 0.0)]，命中的短词越多越靠前
+        """
+        patterns = [like_pattern(term) for term in short_terms]
+        condition = " OR ".join("content LIKE ? ESCAPE '\\'" for _ in patterns)
+        matched = " + ".join("(content LIKE ? ESCAPE '\\')" for _ in patterns)
+        exclude_clause = f" AND id NOT IN ({', '.join(str(int(i)) for i in exclude)})" if exclude else ""
+        query = (f"SELECT id, content, 0.0 FROM {self.table_name} WHERE ({condition}){exclude_clause} "
+                 f"ORDER BY {matched} DESC, id LIMIT ?")
+        self.db.cursor.execute(query, (*patterns, *patterns, limit))
+        return self.db.cursor.fetchall()
@@ -1,99 +1,278 @@
 # 数据处理流程的总函数,包含数据处理的各个部分.将原始数据存储进关系型数据库中
 import os, yaml, json
+import itertools
 from tqdm import tqdm
 from .read_data import DataReader
-from .split_data import SentenceSplitter, split_sentences, split_paragraphs
+from .parallel_read import parse_files, stream_pdf_pages
+from .split_data import segment_spans, segment_stats
+from .chunker import OffsetChunker, chunk_spans
 from .text_dataset import DatabaseManager
+from .manifest import SourceManifest
+from .change_log import ChunkChangeLog
+from .fts_index import ChunkFTSIndex
+from .token_count import count_tokens
+from .near_dedup import NearDuplicateIndex
 from config.config import parameters
 
 
+def create_chunk_table(db, change_log, table_name, extra_columns=None):
+    """
+    创建切分表，chunk 按 (doc_id, content) 去重，并安装变更日志与全文索引的触发器。
+    token_count 列在切分时写入，旧版本的表补充该列后为已有的 chunk 计算一次；start_offset/end_offset 为 chunk 在文档中的偏移量，旧数据为空。
+    :param db: DatabaseManager 实例
+    :param change_log: ChunkChangeLog 实例
+    :param table_name: 切分表名
+    :param extra_columns: 额外的列，例如句子表的 {"paragraph_id": "INTEGER"}，这些列同时建立索引
+    """
+    extra_columns = extra_columns or {}
+    db.create_table(table_name, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "doc_id": "INTEGER", "content": "TEXT NOT NULL", "page": "INTEGER", "token_count": "INTEGER",
+                                 "start_offset": "INTEGER", "end_offset": "INTEGER", **extra_columns})
+    db.add_columns(table_name, {"doc_id": "INTEGER", "page": "INTEGER", "token_count": "INTEGER",
+                                "start_offset": "INTEGER", "end_offset": "INTEGER", **extra_columns})
+    db.conn.create_function("count_tokens", 1, count_tokens, deterministic=True)
+    db.cursor.execute(f"UPDATE {table_name} SET token_count = count_tokens(content) WHERE token_count IS NULL")
+    db.conn.commit()
+    db.create_index(table_name, ["doc_id", "content"], unique=True)
+    db.create_index(table_name, ["doc_id", "start_offset"])
+    for column in extra_columns:
+        db.create_index(table_name, column)
+    change_log.install(table_name)
+    ChunkFTSIndex(db, table_name).install()
+
+
+def is_large_pdf(file_path):
+    """
+    页数不少于 pdf_stream_min_pages 的PDF按页流式处理。
+    """
+    if not file_path.endswith(".pdf"):
+        return False
+    try:
+        return DataReader().pdf_page_count(file_path) >= parameters.pdf_stream_min_pages
+    except Exception:
+        return False
+
+
+def chunk_document(doc_id, pages, paragraph_ids=None):
+    """
+    按页切分一个文档，每个chunk记录它起始的页码与在文档文本（各页以 "\n" 连接）中的偏移量 [start_offset, end_offset)。
+    分割段落时，句子在所在段落的区间内切分，句子的区间包含在段落的区间中，据此记录父段落的 id，供分层检索先检索段落、再在段落内检索句子。
+    :param doc_id: 文档在清单中的 id
+    :param pages: 可迭代对象，每个元素为(页码, 文本)
+    :param paragraph_ids: 段落 id 分配器（如 itertools.count），分割段落时必须提供，id 在切分时即确定
+    :return: 生成器，每个元素为(表名, 行数据)
+    """
+    if not parameters.is_split_paragraph:
+        chunker = OffsetChunker(parameters.split_chunk_size, parameters.split_chunk_overlap)
+
+        def sentence_rows(chunks):
+            for start, end, page, chunk in chunks:
+                yield parameters.sql_table_name, {"doc_id": doc_id, "content": chunk, "page": page, "start_offset": start, "end_offset": end,
+                                                  "token_count": count_tokens(chunk), "paragraph_id": None}
+
+        for page_no, text in pages:
+            yield from sentence_rows(chunker.feed(page_no, text))
+        yield from sentence_rows(chunker.flush())
+        return
+
+    chunker = OffsetChunker(parameters.paragraph_chunk_size, parameters.paragraph_chunk_overlap, mode="paragraph")
+    seen = set()  # 同一文档中重复的段落只写入一次
+
+    def paragraph_rows(paragraphs):
+        new_paragraphs = []
+        for start, end, page, paragraph in paragraphs:
+            if paragraph not in seen:
+                seen.add(paragraph)
+                new_paragraphs.append((next(paragraph_ids), start, end, page, paragraph))
+        # 一批段落的分句在一次 nlp.pipe 中完成，句子区间换算为文档中的偏移量
+        spans_list = segment_spans([paragraph for *_, paragraph in new_paragraphs])
+        for (paragraph_id, start, end, page, paragraph), spans in zip(new_paragraphs, spans_list):
+            yield parameters.sql_paragraph_table_name, {"id": paragraph_id, "doc_id": doc_id, "content": paragraph, "page": page,
+                                                        "start_offset": start, "end_offset": end, "token_count": count_tokens(paragraph)}
+            for sentence_start, sentence_end in chunk_spans(spans, parameters.split_chunk_size, parameters.split_chunk_overlap):
+                sentence = paragraph[sentence_start:sentence_end]
+                yield parameters.sql_table_name, {"doc_id": doc_id, "content": sentence, "page": page,
+                                                  "start_offset": start + sentence_start, "end_offset": start + sentence_end,
+                                                  "token_count": count_tokens(sentence), "paragraph_id": paragraph_id}
+
+    for page_no, text in pages:
+        yield from paragraph_rows(chunker.feed(page_no, text))
+    yield from paragraph_rows(chunker.flush())
+
 
 def mainDataHandle(data_path:str=None):
     """
     数据处理流程的总函数,包含数据处理的各个部分.将原始数据存储进关系型数据库中
+    只处理新增或修改过的文件，删除或修改过的文件对应的 chunk 会先被清除，变更记录在变更日志中供向量库同步
     :param data_path: 数据文件路径
     :param config: 配置文件
     :return: 无
     """
     db = DatabaseManager()
+    db.set_bulk_pragmas()
     db.create_table(table_name=parameters.sql_data_name, schema={"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "is_analysis":"TEXT NOT NULL UNIQUE", "file_path":"TEXT NOT NULL UNIQUE", "content": "TEXT"})
     # 如果data_path为空，则使用配置文件中的data_path
     if data_path is None:
         data_path = parameters.source_data_path
 
+    chunk_tables = [parameters.sql_table_name]
+    if parameters.is_split_paragraph:
+        chunk_tables.append(parameters.sql_paragraph_table_name)
+    change_log = ChunkChangeLog(db)
+    for table_name in chunk_tables:
+        extra_columns = {"paragraph_id": "INTEGER"} if table_name == parameters.sql_table_name else None
+        create_chunk_table(db, change_log, table_name, extra_columns)
+    # 段落 id 在切分时分配，句子据此记录父段落
+    paragraph_ids = itertools.count(db.max_id(parameters.sql_paragraph_table_name) + 1) if parameters.is_split_paragraph else None
+    # 近似重复消除：句子的 id 在去重时分配，重复的句子映射到代表句子的 id
+    dedup = None
+    if parameters.near_dedup_enable:
+        dedup = NearDuplicateIndex(db, parameters.sql_table_name)
+        dedup.install()
+        sentence_ids = itertools.count(db.max_id(parameters.sql_table_name) + 1)
+
+    # 0、对比源文件清单，找出需要处理的文件
+    manifest = SourceManifest(db)
+    changes = manifest.scan(data_path)
+    print(f"{data_path}路径下新增文件{len(changes['added'])}个，修改文件{len(changes['modified'])}个，"
+          f"删除文件{len(changes['deleted'])}个，未变化文件{changes['unchanged']}个")
+
+    # 修改与删除的文件，先清除旧的 chunk
+    retired_ids = [doc_id for doc_id, _ in changes["modified"] + changes["deleted"]]
+    if retired_ids:
+        for table_name in chunk_tables:
+            deleted_count = db.delete_where_in(table_name, "doc_id", retired_ids)
+            print(f"{table_name}中清除{deleted_count}个旧chunk")
+        manifest.remove([doc_id for doc_id, _ in changes["deleted"]])
+        if dedup is not None:
+            dedup.forget_docs(retired_ids)
+    # 代表所在的文档被清除后，映射到它的重复句子重新写入
+    orphans = dedup.release_orphans() if dedup is not None else []
+
     origin_data = []
-    data_reader = DataReader()
-    # 1.获取文件夹下的所有文件，并读取文件内容
-    file_list = os.listdir(data_path)
-    print(f"{data_path}路径下的文件有：", file_list)
-    for file in file_list:
-        input_format = file.split('.')[-1]
-        file_path = os.path.join(data_path, file)
-        try:
-            data_text = data_reader.read_data(file_path, input_format)
-            origin_data.append({"text":data_text,
-                                "file_name":file
+    # 1.多进程并行读取新增与修改的文件内容，按完成顺序处理；页数很多的PDF留到切分时按页流式读取
+    file_list = changes["added"] + [file_path for _, file_path in changes["modified"]]
+    print("需要解析的文件有：", [os.path.basename(file_path) for file_path in file_list])
+    stream_list = [file_path for file_path in file_list if is_large_pdf(file_path)]
+    timings = []
+    for result in parse_files([file_path for file_path in file_list if file_path not in stream_list], workers=parameters.parse_workers):
+        file_path = result["file_path"]
+        file = os.path.basename(file_path)
+        timings.append((result["elapsed"], file))
+        if result["ok"]:
+            print(f"{file}解析完成，耗时{result['elapsed']:.2f}s")
+            doc_id = manifest.reserve(file_path)
+            origin_data.append({"pages":result["pages"],
+                                "file_name":file,
+                                "file_path":file_path,
+                                "doc_id":doc_id,
+                                "stream":False
                                 })
+            data_text = "\n".join(text for _, text in result["pages"])
             db.insert(table_name=parameters.sql_data_name, data={"is_analysis":"yes", "file_path":file_path, "content":data_text})
-            
-        except:
-            print(f"{file}当前文件解析错误❌")
+        else:
+            print(f"{file}当前文件解析错误❌ {result['error']}")
             db.insert(table_name=parameters.sql_data_name, data={"is_analysis":"no", "file_path":file_path, "content":"当前文件解析错误❌"})
+    if timings:
+        timings.sort(reverse=True)
+        print("解析耗时最长的文件：", [f"{file}: {elapsed:.2f}s" for elapsed, file in timings[:5]])
+    for file_path in stream_list:
+        origin_data.append({"pages":stream_pdf_pages(file_path, workers=parameters.parse_workers),
+                            "file_name":os.path.basename(file_path),
+                            "file_path":file_path,
+                            "doc_id":manifest.reserve(file_path),
+                            "stream":True
+                            })
 
     # 2、对读取到的文本进行清洗，当前没有做
 
-    # 3、对清洗后的数据进行分割
-    # ss_data = []
-    # SS = SentenceSplitter(language=parameters.split_language, 
-    #                       mode=parameters.split_mode, 
-    #                       chunk_size=parameters.split_chunk_size, 
-    #                       chunk_overlap=parameters.split_chunk_overlap,)
-    # for i in tqdm(range(len(origin_data))):
-    #     ss_data.extend(SS.process(origin_data[i]))
-    # if ss_data:
-    #     print(f"共分割出{len(ss_data)}个句子")
-    #     print("第一个句子", ss_data[0])
-    #     print("分割完成✅")
-    #     # print(ss_data)
-    #     # return ss_data
-    # else:
-    #     print("没有分割到句子")
-    #     return
-    sentence_list = []
-    paragraph_list = []
+    # 3、对清洗后的数据按页进行分割，4、分批写入数据库
+    counts = {table_name: 0 for table_name in chunk_tables}
+    written = {table_name: [0, 0] for table_name in chunk_tables}  # [写入条数, 重复跳过条数]
+    first_chunks = {}
+    buffers = {table_name: [] for table_name in chunk_tables}
+
+    def flush(table_name):
+        if buffers[table_name]:
+            inserted_count, skipped_count = db.bulk_insert(table_name, buffers[table_name], on_conflict="ignore")
+            written[table_name][0] += inserted_count
+            written[table_name][1] += skipped_count
+            buffers[table_name] = []
+
+    def add_row(table_name, row):
+        if dedup is not None and table_name == parameters.sql_table_name:
+            row = dedup.process(row, sentence_ids)
+            if row is None:
+                return
+        buffers[table_name].append(row)
+        counts[table_name] += 1
+        first_chunks.setdefault(table_name, row["content"])
+        if len(buffers[table_name]) >= parameters.insert_batch_size:
+            flush(table_name)
+
+    if orphans:
+        print(f"代表chunk已被清除的重复chunk{len(orphans)}个，重新去重写入")
+        for row in orphans:
+            add_row(parameters.sql_table_name, row)
+
     for i in tqdm(range(len(origin_data))):
-        sentence_list.extend(split_sentences(text=origin_data[i]["text"],
-                                             chunk_size=parameters.split_chunk_size,
-                                             chunk_overlap=parameters.split_chunk_overlap))
-        if parameters.is_split_paragraph:
-            paragraph_list.extend(split_paragraphs(text=origin_data[i]["text"],
-                                                   chunk_size=parameters.paragraph_chunk_size,
-                                                   chunk_overlap=parameters.paragraph_chunk_overlap))
-        
-    if sentence_list:
-        print(f"共分割出{len(sentence_list)}个句子")
-        print("第一个句子", sentence_list[0])
-        print("分割完成✅")
+        doc = origin_data[i]
+        try:
+            for table_name, row in chunk_document(doc["doc_id"], doc["pages"], paragraph_ids):
+                add_row(table_name, row)
+        except Exception as e:
+            # 切分或流式读取中途出错，清除该文件已经写入的chunk，下次运行时重新处理
+            print(f"{doc['file_name']}当前文件解析错误❌ {type(e).__name__}: {e}")
+            if dedup is not None:
+                # 该文件已经去重的句子（缓冲中与已写入的）不再作为代表
+                failed_ids = [row["id"] for row in buffers[parameters.sql_table_name] if row["doc_id"] == doc["doc_id"]]
+                failed_ids += [row[0] for row in db.fetch_by_id(parameters.sql_table_name, [doc["doc_id"]], id_column="doc_id", columns="id")]
+            for table_name in chunk_tables:
+                buffers[table_name] = [row for row in buffers[table_name] if row["doc_id"] != doc["doc_id"]]
+                db.delete_where_in(table_name, "doc_id", [doc["doc_id"]])
+            if dedup is not None:
+                dedup.forget_docs([doc["doc_id"]])
+                # 其他文件中映射到这些句子的重复句子重新去重写入
+                for row in dedup.forget_chunks(failed_ids):
+                    add_row(parameters.sql_table_name, row)
+            manifest.remove([doc["doc_id"]])
+            # 解析成功时已经写入了该文件的状态，改为解析错误
+            db.delete_where_in(parameters.sql_data_name, "file_path", [doc["file_path"]])
+            db.insert(table_name=parameters.sql_data_name, data={"is_analysis":"no", "file_path":doc["file_path"], "content":"当前文件解析错误❌"})
+            continue
+        if doc["stream"]:
+            db.insert(table_name=parameters.sql_data_name, data={"is_analysis":"yes", "file_path":doc["file_path"], "content":"按页流式解析"})
+        # 该文件的 chunk 全部写入并提交后才记入清单，中途退出时下次运行重新处理
+        for table_name in chunk_tables:
+            flush(table_name)
+        manifest.record(doc["file_path"])
+    for table_name in chunk_tables:
+        flush(table_name)
+    if dedup is not None:
+        dedup.prune()
+        # 代表因唯一约束等原因没有写入时，映射到它的重复句子重新去重写入
+        orphans = dedup.release_orphans()
+        for row in orphans:
+            add_row(parameters.sql_table_name, row)
+        if orphans:
+            flush(parameters.sql_table_name)
+            dedup.prune()
+        print(f"近似重复消除✅ 检查{dedup.stats['checked']}个句子，其中{dedup.stats['duplicates']}个映射到已有的代表句子")
+
+    stats = segment_stats()
+    if stats["chars"]:
+        print(f"分句吞吐量：{stats['chars']}字符，耗时{stats['seconds']:.2f}s，{stats['chars_per_sec']:.0f} 字符/s")
+    if counts[parameters.sql_table_name]:
+        print(f"共分割出{counts[parameters.sql_table_name]}个句子")
+        print("第一个句子", first_chunks[parameters.sql_table_name])
+        print(f"分割句子写入数据库完成✅，写入{written[parameters.sql_table_name][0]}条，重复跳过{written[parameters.sql_table_name][1]}条")
     else:
-        print("没有分割到句子")
+        print("没有需要更新的句子")
         return
 
-
-    # 4、将分割后的数据写入数据库
-    
-    db.create_table(parameters.sql_table_name, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "content": "TEXT NOT NULL UNIQUE"})
-    insert_data = [{"content": i} for i in sentence_list]
-    db.insert_many(parameters.sql_table_name, insert_data)
-    print("分割句子写入数据库完成✅")
-
-    if paragraph_list:
-        print(f"共分割出{len(paragraph_list)}个段落")
-        print("第一个段落", paragraph_list[0])
-        print("分割完成✅")
-        db.create_table(parameters.sql_paragraph_table_name, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "content": "TEXT NOT NULL UNIQUE"})
-        insert_data = [{"content": i} for i in paragraph_list]
-        db.insert_many(parameters.sql_paragraph_table_name, insert_data)
-        print("分割段落写入数据库完成✅")
+    if counts.get(parameters.sql_paragraph_table_name):
+        print(f"共分割出{counts[parameters.sql_paragraph_table_name]}个段落")
+        print("第一个段落", first_chunks[parameters.sql_paragraph_table_name])
+        print(f"分割段落写入数据库完成✅，写入{written[parameters.sql_paragraph_table_name][0]}条，重复跳过{written[parameters.sql_paragraph_table_name][1]}条")
 
 if __name__ == "__main__":
     mainDataHandle(data_path=None, config=None)
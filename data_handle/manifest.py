@@ -0,0 +1,116 @@
+# 源文件清单：记录每个源文件的路径、大小、修改时间与内容hash，用于增量处理
+import os
+import hashlib
+from config.config import parameters
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    计算文件内容的sha256。
+    :param file_path: 文件路径
+    :param block_size: 每次读取的字节数
+    :return: 十六进制的hash字符串
+    """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class SourceManifest:
+    def __init__(self, db, table_name: str = parameters.sql_manifest_table_name):
+        """
+        源文件清单，保存在关系型数据库中。
+        :param db: DatabaseManager 实例
+        :param table_name: 清单表名
+        """
+        self.db = db
+        self.table_name = table_name
+        self.db.create_table(table_name, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                                          "file_path": "TEXT NOT NULL UNIQUE",
+                                          "size": "INTEGER",
+                                          "mtime": "REAL",
+                                          "content_hash": "TEXT"})
+        self._pending = {}  # 本次扫描得到的文件信息，解析成功后再写入清单
+
+    def scan(self, data_path: str):
+        """
+        对比目录中的文件与清单，找出新增、修改、删除的文件。
+        大小与修改时间都没变的文件直接跳过，不读取内容；变了的文件再比较内容hash。
+        :param data_path: 源数据目录
+        :return: 字典，added为新增文件路径列表，modified与deleted为(doc_id, 文件路径)列表，unchanged为未变化的文件数
+        """
+        self.db.cursor.execute(f"SELECT id, file_path, size, mtime, content_hash FROM {self.table_name}")
+        known = {row[1]: row for row in self.db.cursor.fetchall()}
+
+        changes = {"added": [], "modified": [], "deleted": [], "unchanged": 0}
+        seen = set()
+        for file in sorted(os.listdir(data_path)):
+            file_path = os.path.join(data_path, file)
+            if not os.path.isfile(file_path):
+                continue
+            seen.add(file_path)
+            stat = os.stat(file_path)
+            record = known.get(file_path)
+            if record is not None and record[2] == stat.st_size and record[3] == stat.st_mtime:
+                changes["unchanged"] += 1
+                continue
+
+            content_hash = file_hash(file_path)
+            if record is None:
+                changes["added"].append(file_path)
+            elif record[4] == content_hash:
+                # 只是修改时间变了，内容没变，更新清单即可
+                self.db.cursor.execute(f"UPDATE {self.table_name} SET size = ?, mtime = ? WHERE id = ?",
+                                       (stat.st_size, stat.st_mtime, record[0]))
+                changes["unchanged"] += 1
+                continue
+            else:
+                changes["modified"].append((record[0], file_path))
+            self._pending[file_path] = (stat.st_size, stat.st_mtime, content_hash)
+        self.db.conn.commit()
+
+        for file_path, record in known.items():
+            if file_path not in seen:
+                changes["deleted"].append((record[0], file_path))
+        return changes
+
+    def reserve(self, file_path: str):
+        """
+        文件开始切分前分配 doc_id。大小、修改时间与 hash 先置空，chunk 写入后再由 record 补全，
+        中途退出时下次运行会把该文件视为修改过的文件，清除写了一半的 chunk 后重新处理。
+        :param file_path: 文件路径
+        :return: 文件在清单中的 doc_id
+        """
+        self.db.cursor.execute(f"INSERT INTO {self.table_name} (file_path) VALUES (?) "
+                               f"ON CONFLICT(file_path) DO UPDATE SET size = NULL, mtime = NULL, content_hash = NULL",
+                               (file_path,))
+        self.db.conn.commit()
+        self.db.cursor.execute(f"SELECT id FROM {self.table_name} WHERE file_path = ?", (file_path,))
+        return self.db.cursor.fetchone()[0]
+
+    def record(self, file_path: str):
+        """
+        文件的 chunk 全部写入并提交后，写入（或更新）清单。
+        :param file_path: 文件路径
+        :return: 文件在清单中的 doc_id
+        """
+        if file_path in self._pending:
+            size, mtime, content_hash = self._pending.pop(file_path)
+        else:
+            stat = os.stat(file_path)
+            size, mtime, content_hash = stat.st_size, stat.st_mtime, file_hash(file_path)
+        self.db.cursor.execute(f"INSERT INTO {self.table_name} (file_path, size, mtime, content_hash) VALUES (?, ?, ?, ?) "
+                               f"ON CONFLICT(file_path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, content_hash = excluded.content_hash",
+                               (file_path, size, mtime, content_hash))
+        self.db.conn.commit()
+        self.db.cursor.execute(f"SELECT id FROM {self.table_name} WHERE file_path = ?", (file_path,))
+        return self.db.cursor.fetchone()[0]
+
+    def remove(self, doc_ids):
+        """
+        从清单中删除文件记录。
+        :param doc_ids: doc_id 列表
+        """
+        self.db.delete_where_in(self.table_name, "id", doc_ids)
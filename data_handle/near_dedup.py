@@ -0,0 +1,240 @@
+# 近似重复消除：同一手册的多个修订版切出的句子大多只差几个字，只保留一个代表 chunk，其余记录到映射表，不再向量化与入库
+# MinHash 签名估计两个 chunk 字符三元组的 Jaccard 相似度，LSH 按签名分段建桶，只与同桶的 chunk 比较；签名与桶都存在 sqlite 中，增量更新
+import json
+import zlib
+import hashlib
+import numpy as np
+from config.config import parameters
+
+_PRIME = np.uint64((1 << 61) - 1)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = parameters.minhash_num_perm, shingle_size: int = 3, seed: int = 1):
+        """
+        :param num_perm: 签名长度（哈希函数个数），越长相似度估计越准
+        :param shingle_size: 字符 n 元组的长度
+        :param seed: 哈希函数参数的随机种子，写入数据库后不能修改
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, text: str) -> np.ndarray:
+        """
+        去掉空白后的字符 n 元组的 32 位哈希。
+        """
+        text = "".join(text.split())
+        size = self.shingle_size
+        pieces = {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+        return np.fromiter((zlib.crc32(piece.encode("utf-8")) for piece in pieces), dtype=np.uint64, count=len(pieces))
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        :return: 长度为 num_perm 的 uint32 签名
+        """
+        hashes = self.shingle_hashes(text)
+        # a、h 都小于 2^32，a*h + b 不会超出 uint64
+        values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % _PRIME
+        return (values.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    def __init__(self, db, table_name: str,
+                 threshold: float = parameters.near_dedup_threshold,
+                 num_perm: int = parameters.minhash_num_perm,
+                 bands: int = parameters.minhash_bands):
+        """
+        :param db: DatabaseManager 实例
+        :param table_name: 切分表名
+        :param threshold: 估计的 Jaccard 相似度不低于该值时视为近似重复
+        :param num_perm: MinHash 签名长度
+        :param bands: LSH 的分段数，num_perm 需能被整除；段数越多、每段越短，找到的候选越多
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.db = db
+        self.table_name = table_name
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.signature_table = f"{table_name}_minhash"
+        self.bucket_table = f"{table_name}_lsh"
+        self.duplicate_table = f"{table_name}_duplicates"
+        self.stats = {"checked": 0, "duplicates": 0}
+
+    def install(self):
+        """
+        创建签名表、LSH 桶表与重复映射表，以及切分表删除 chunk 时同步删除签名与桶的触发器；
+        为还没有签名的已有 chunk 补充签名（已有的 chunk 之间不去重）。
+        """
+        self.db.create_table(self.signature_table, {"chunk_id": "INTEGER PRIMARY KEY", "signature": "BLOB NOT NULL"})
+        self.db.create_table(self.bucket_table, {"bucket": "INTEGER NOT NULL", "chunk_id": "INTEGER NOT NULL"})
+        self.db.create_index(self.bucket_table, "bucket")
+        self.db.create_index(self.bucket_table, "chunk_id")
+        self.db.create_table(self.duplicate_table, {"id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                                                    "representative_id": "INTEGER NOT NULL",
+                                                    "doc_id": "INTEGER",
+                                                    "page": "INTEGER",
+                                                    "similarity": "REAL",
+                                                    "paragraph_id": "INTEGER",
+                                                    "row": "TEXT NOT NULL"})
+        # 重复句子所在的段落：段落的句子都是重复时，分层检索经由映射找到代表句子
+        self.db.add_columns(self.duplicate_table, {"paragraph_id": "INTEGER"})
+        self.db.cursor.execute(f"UPDATE {self.duplicate_table} SET paragraph_id = json_extract(row, '$.paragraph_id') WHERE paragraph_id IS NULL")
+        self.db.create_index(self.duplicate_table, "representative_id")
+        self.db.create_index(self.duplicate_table, "doc_id")
+        self.db.create_index(self.duplicate_table, "paragraph_id")
+        t = self.table_name
+        self.db.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{t}_minhash_delete AFTER DELETE ON {t} "
+                               f"BEGIN DELETE FROM {self.signature_table} WHERE chunk_id = OLD.id; "
+                               f"DELETE FROM {self.bucket_table} WHERE chunk_id = OLD.id; END")
+        self.db.conn.commit()
+
+        self.db.cursor.execute(f"SELECT id, content FROM {t} WHERE id NOT IN (SELECT chunk_id FROM {self.signature_table})")
+        missing = self.db.cursor.fetchall()
+        for chunk_id, content in missing:
+            self._add(chunk_id, self.hasher.signature(content))
+        self.db.conn.commit()
+        if missing:
+            print(f"{t} 补充 MinHash 签名{len(missing)}个✅")
+
+    def _buckets(self, signature: np.ndarray):
+        """
+        每一段签名（连同段号）哈希为一个 64 位有符号整数作为桶号。
+        """
+        buckets = []
+        for band in range(self.bands):
+            part = signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            digest = hashlib.blake2b(band.to_bytes(2, "little") + part.tobytes(), digest_size=8).digest()
+            buckets.append(int.from_bytes(digest, "little", signed=True))
+        return buckets
+
+    def _add(self, chunk_id: int, signature: np.ndarray):
+        self.db.cursor.execute(f"INSERT OR REPLACE INTO {self.signature_table} (chunk_id, signature) VALUES (?, ?)",
+                               (chunk_id, signature.tobytes()))
+        self.db.cursor.executemany(f"INSERT INTO {self.bucket_table} (bucket, chunk_id) VALUES (?, ?)",
+                                   [(bucket, chunk_id) for bucket in self._buckets(signature)])
+
+    def find(self, signature: np.ndarray):
+        """
+        在 LSH 中查找与签名最相似的代表 chunk。
+        :return: (chunk_id, 估计的相似度)，没有达到阈值的候选时返回 (None, 0.0)
+        """
+        buckets = self._buckets(signature)
+        self.db.cursor.execute(f"SELECT DISTINCT chunk_id FROM {self.bucket_table} WHERE bucket IN ({', '.join('?' * len(buckets))})", buckets)
+        candidates = [row[0] for row in self.db.cursor.fetchall()]
+        if not candidates:
+            return None, 0.0
+        self.db.cursor.execute(f"SELECT chunk_id, signature FROM {self.signature_table} WHERE chunk_id IN ({', '.join('?' * len(candidates))})", candidates)
+        best_id, best_similarity = None, 0.0
+        for chunk_id, blob in self.db.cursor.fetchall():
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity > best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        if best_similarity < self.threshold:
+            return None, 0.0
+        return best_id, best_similarity
+
+    def process(self, row: dict, chunk_ids):
+        """
+        去重阶段：近似重复的 chunk 记录到映射表并返回 None，否则作为新的代表加入 LSH。
+        签名与映射和切分表的下一批数据在同一个事务中提交。
+        :param row: 切分得到的行数据
+        :param chunk_ids: id 分配器（如 itertools.count），作为代表写入时从中取 id
+        :return: 需要写入切分表的行（带 id），近似重复时为 None
+        """
+        self.stats["checked"] += 1
+        signature = self.hasher.signature(row["content"])
+        representative_id, similarity = self.find(signature)
+        if representative_id is not None:
+            self.stats["duplicates"] += 1
+            self.db.cursor.execute(f"INSERT INTO {self.duplicate_table} (representative_id, doc_id, page, similarity, paragraph_id, row) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (representative_id, row.get("doc_id"), row.get("page"), similarity, row.get("paragraph_id"),
+                                    json.dumps(row, ensure_ascii=False)))
+            return None
+        chunk_id = next(chunk_ids)
+        self._add(chunk_id, signature)
+        return {"id": chunk_id, **row}
+
+    def forget_docs(self, doc_ids):
+        """
+        删除这些文档的重复映射，文档被删除、修改或解析失败时调用。
+        """
+        deleted_count = self.db.delete_where_in(self.duplicate_table, "doc_id", doc_ids)
+        return deleted_count
+
+    def forget_chunks(self, chunk_ids, batch_size: int = 500):
+        """
+        删除没有写入切分表的代表 chunk 的签名与桶，例如文件中途解析失败时已经去重、但从写入缓冲中丢弃的句子；
+        映射到这些代表的重复 chunk 从映射表中取出，需要重新经过去重阶段写入。
+        :param chunk_ids: 代表 chunk 的 id
+        :return: 行数据列表
+        """
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids]
+        if not chunk_ids:
+            return []
+        self.db.delete_where_in(self.signature_table, "chunk_id", chunk_ids, batch_size)
+        self.db.delete_where_in(self.bucket_table, "chunk_id", chunk_ids, batch_size)
+        duplicates = []
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            self.db.cursor.execute(f"SELECT id, row FROM {self.duplicate_table} WHERE representative_id IN ({', '.join('?' * len(batch))})", batch)
+            duplicates.extend(self.db.cursor.fetchall())
+        duplicates.sort()
+        if duplicates:
+            self.db.delete_where_in(self.duplicate_table, "id", [duplicate_id for duplicate_id, _ in duplicates], batch_size)
+        return [json.loads(row) for _, row in duplicates]
+
+    def release_orphans(self):
+        """
+        代表 chunk 所在的文档被删除后，映射到它的重复 chunk 失去了代表，从映射表中取出，需要重新经过去重阶段写入。
+        :return: 行数据列表
+        """
+        self.db.cursor.execute(f"SELECT id, row FROM {self.duplicate_table} WHERE representative_id NOT IN (SELECT id FROM {self.table_name}) ORDER BY id")
+        orphans = self.db.cursor.fetchall()
+        if orphans:
+            self.db.delete_where_in(self.duplicate_table, "id", [orphan_id for orphan_id, _ in orphans])
+        return [json.loads(row) for _, row in orphans]
+
+    def prune(self):
+        """
+        删除没有对应 chunk 的签名与桶，例如写入时因唯一约束被跳过的行。
+        """
+        for table in (self.signature_table, self.bucket_table):
+            self.db.cursor.execute(f"DELETE FROM {table} WHERE chunk_id NOT IN (SELECT id FROM {self.table_name})")
+        self.db.conn.commit()
+
+    def ready(self) -> bool:
+        """
+        映射表已由 install 创建并带有 paragraph_id 列，检索端只读取、不创建表。
+        """
+        self.db.cursor.execute(f"PRAGMA table_info({self.duplicate_table})")
+        return "paragraph_id" in {row[1] for row in self.db.cursor.fetchall()}
+
+    def representatives(self, paragraph_ids, batch_size: int = 500):
+        """
+        段落中被映射掉的重复句子对应的代表句子。
+        :param paragraph_ids: 段落 id 列表
+        :return: [(代表句子 id, 重复句子所在的段落 id)]
+        """
+        paragraph_ids = [int(paragraph_id) for paragraph_id in paragraph_ids]
+        results = []
+        for start in range(0, len(paragraph_ids), batch_size):
+            batch = paragraph_ids[start:start + batch_size]
+            self.db.cursor.execute(f"SELECT DISTINCT representative_id, paragraph_id FROM {self.duplicate_table} "
+                                   f"WHERE paragraph_id IN ({', '.join('?' * len(batch))})", batch)
+            results.extend(self.db.cursor.fetchall())
+        return results
+
+    def sources(self, chunk_id: int):
+        """
+        chunk 的所有来源：代表自身与映射到它的重复 chunk 所在的文档与页码。
+        :return: [(doc_id, page)]
+        """
+        self.db.cursor.execute(f"SELECT doc_id, page FROM {self.table_name} WHERE id = ? "
+                               f"UNION ALL SELECT doc_id, page FROM {self.duplicate_table} WHERE representative_id = ?", (chunk_id, chunk_id))
+        return self.db.cursor.fetchall()
@@ -0,0 +1,92 @@
+# 多进程并行解析源文件，每个文件解析完成后立即返回结果
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .read_data import DataReader
+from config.config import parameters
+
+
+def parse_file(file_path: str):
+    """
+    解析单个文件，在子进程中执行。
+    PDF按页返回，其他格式整体作为一页，页码为None。
+    :param file_path: 文件路径
+    :return: 字典，包含 file_path、pages（(页码, 文本)列表）、ok、elapsed、error
+    """
+    start_time = time.time()
+    input_format = os.path.basename(file_path).split('.')[-1]
+    pages, error = None, None
+    try:
+        if input_format == "pdf":
+            pages = DataReader().read_pdf_pages(file_path)
+        else:
+            text = DataReader().read_data(file_path, input_format)
+            if text is not None:
+                pages = [(None, text)]
+        if pages is None:
+            error = "没有读取到内容"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"file_path": file_path,
+            "pages": pages,
+            "ok": error is None,
+            "elapsed": time.time() - start_time,
+            "error": error}
+
+
+def parse_files(file_list, workers: int = parameters.parse_workers):
+    """
+    并行解析文件，按完成顺序逐个返回结果，单个文件失败不影响其他文件。
+    :param file_list: 文件路径列表
+    :param workers: 进程数，小于等于1时在当前进程中顺序解析
+    :return: 生成器，每个元素为 parse_file 的返回结果
+    """
+    if workers <= 1 or len(file_list) <= 1:
+        for file_path in file_list:
+            yield parse_file(file_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_list))) as executor:
+        futures = {executor.submit(parse_file, file_path): (file_path, time.time()) for file_path in file_list}
+        for future in as_completed(futures):
+            file_path, submit_time = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                # 子进程异常退出等情况
+                yield {"file_path": file_path,
+                       "pages": None,
+                       "ok": False,
+                       "elapsed": time.time() - submit_time,
+                       "error": f"{type(e).__name__}: {e}"}
+
+
+def stream_pdf_pages(file_path: str, workers: int = parameters.parse_workers, pages_per_task: int = parameters.pdf_pages_per_task):
+    """
+    按页流式读取PDF，页数较多时按页范围分给多个进程解析，结果仍按页码顺序返回。
+    同时在途的任务数不超过进程数的两倍，内存中只保留少量页面。
+    :param file_path: 文件路径
+    :param workers: 进程数
+    :param pages_per_task: 每个任务解析的页数
+    :return: 生成器，每个元素为(页码, 文本)
+    """
+    reader = DataReader()
+    page_count = reader.pdf_page_count(file_path)
+    if workers <= 1 or page_count <= pages_per_task:
+        yield from reader.iter_pdf_pages(file_path)
+        return
+
+    page_ranges = iter([(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in page_ranges:
+            pending.append(executor.submit(reader.read_pdf_pages, file_path, start, end))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(page_ranges, None)
+            if next_range is not None:
+                pending.append(executor.submit(reader.read_pdf_pages, file_path, *next_range))
+            yield from pages
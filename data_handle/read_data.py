@@ -44,6 +44,36 @@ class DataReader:
             logging.error(f"Error reading PDF file {file_path}: {e}")
             return None
 
+    def pdf_page_count(self, file_path):
+        """
+        获取PDF文件的页数。
+        """
+        with open(file_path, "rb") as f:
+            return len(PyPDF2.PdfReader(f).pages)
+
+    def iter_pdf_pages(self, file_path, start=0, end=None):
+        """
+        按页读取PDF文件，逐页返回，不把整个文档拼接在内存中。
+        :param file_path: 文件路径
+        :param start: 起始页下标（从0开始）
+        :param end: 结束页下标（不包含），默认读到最后一页
+        :return: 生成器，每个元素为(页码, 文本)，页码从1开始
+        """
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            end = len(reader.pages) if end is None else min(end, len(reader.pages))
+            for i in range(start, end):
+                yield i + 1, reader.pages[i].extract_text() or ""
+
+    def read_pdf_pages(self, file_path, start=0, end=None):
+        """
+        读取PDF文件指定页范围的文本。
+        :return: 列表，每个元素为(页码, 文本)
+        """
+        pages = list(self.iter_pdf_pages(file_path, start, end))
+        logging.info(f"Successfully read PDF pages {start + 1}-{start + len(pages)}: {file_path}")
+        return pages
+
     def read_json(self, file_path, key="content"):
         """
         读取JSON文件，并提取指定字段的内容。
@@ -2,15 +2,16 @@ import sqlite3
 import os
 from config.config import parameters
 class DatabaseManager:
-    def __init__(self, db_path:str=parameters.sql_db_path):
+    def __init__(self, db_path:str=parameters.sql_db_path, check_same_thread:bool=True):
         """
         数据库管理类，支持动态创建表、插入数据、查询数据等基本功能。
+        :param check_same_thread: 为 False 时连接可以在其他线程中使用，调用方需自行保证同一时间只有一个线程使用
         """
         if not os.path.exists(db_path):  # 仅创建目录
             os.makedirs(db_path)
         print("db_path",db_path)
         db_path = os.path.join(db_path, "source_data.db")
-        self.conn = sqlite3.connect(db_path)
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
         self.cursor = self.conn.cursor()
 
     def create_table(self, table_name, schema):
@@ -25,6 +26,38 @@ class DatabaseManager:
         self.cursor.execute(query)
         self.conn.commit()
 
+    def add_columns(self, table_name, schema):
+        """
+        为已存在的表补充缺少的列，兼容旧版本创建的表。
+
+        :param table_name: 表名
+        :param schema: 字典形式的列定义，例如：{"doc_id": "INTEGER"}
+        """
+        self.cursor.execute(f"PRAGMA table_info({table_name})")
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for col, dtype in schema.items():
+            if col not in existing:
+                self.cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {dtype}")
+        self.conn.commit()
+
+    def create_index(self, table_name, columns, unique=False, index_name=None):
+        """
+        创建索引（如果不存在）。
+
+        :param table_name: 表名
+        :param columns: 列名或列名列表
+        :param unique: 是否为唯一索引
+        :param index_name: 索引名，默认为 idx_表名_列名
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        if index_name is None:
+            index_name = f"idx_{table_name}_{'_'.join(columns)}"
+        unique_clause = "UNIQUE " if unique else ""
+        query = f"CREATE {unique_clause}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})"
+        self.cursor.execute(query)
+        self.conn.commit()
+
     def exists(self, table_name, column_name, value):
         """
         检查某个值是否已存在于表的指定列中。
@@ -59,20 +92,62 @@ class DatabaseManager:
     def insert_many(self, table_name, data_list):
         """
         批量插入数据（自动去重）。
+        依赖表上的 UNIQUE 约束去重，所有数据在一个事务中写入。
         
         :param table_name: 表名
         :param data_list: 字典列表，每个字典是一行数据
         :return: 插入的条数
         """
-        if not data_list:
-            return 0
+        inserted_count, _ = self.bulk_insert(table_name, data_list, on_conflict="ignore")
+        return inserted_count
 
-        inserted_count = 0
-        for data in data_list:
-            if self.insert(table_name, data):  # 逐条插入，避免重复
-                inserted_count += 1
+    def set_bulk_pragmas(self, wal=True, synchronous="NORMAL", cache_size_mb=64):
+        """
+        设置适合批量写入的 PRAGMA。
 
-        return inserted_count
+        :param wal: 是否使用 WAL 日志模式，写入时不阻塞读取，且提交时的 fsync 更少
+        :param synchronous: 同步级别，WAL 模式下 NORMAL 只在检查点时 fsync；OFF 最快但断电可能损坏数据库
+        :param cache_size_mb: 页缓存大小（MB）
+        """
+        if wal:
+            self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute(f"PRAGMA synchronous = {synchronous}")
+        self.cursor.execute(f"PRAGMA cache_size = {-cache_size_mb * 1024}")
+        self.cursor.execute("PRAGMA temp_store = MEMORY")
+
+    def bulk_insert(self, table_name, data_list, on_conflict="ignore"):
+        """
+        在一个事务中用 executemany 批量插入数据。
+
+        :param table_name: 表名
+        :param data_list: 字典列表，每个字典是一行数据，所有字典的键相同
+        :param on_conflict: 违反唯一约束时的处理方式："ignore"（跳过）、"replace"（替换旧行）、"fail"（回滚并抛出异常）
+        :return: (插入的条数, 跳过的条数)
+        """
+        if not data_list:
+            return 0, 0
+        insert_clause = {"ignore": "INSERT OR IGNORE", "replace": "INSERT OR REPLACE", "fail": "INSERT"}.get(on_conflict)
+        if insert_clause is None:
+            raise ValueError("Unsupported on_conflict. Please choose 'ignore', 'replace' or 'fail'.")
+
+        columns = list(data_list[0].keys())
+        placeholders = ", ".join(["?" for _ in columns])
+        query = f"{insert_clause} INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        values = [tuple(data[col] for col in columns) for data in data_list]
+        if on_conflict == "replace":
+            # REPLACE 删除旧行时默认不触发 DELETE 触发器，打开后变更日志才能记录被替换的行
+            self.cursor.execute("PRAGMA recursive_triggers = ON")
+        try:
+            self.cursor.executemany(query, values)
+            inserted_count = self.cursor.rowcount
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            if on_conflict == "replace":
+                self.cursor.execute("PRAGMA recursive_triggers = OFF")
+        return inserted_count, len(values) - inserted_count
 
     def insert_any(self, table_name, data, ignore_duplicate=True):
         """
@@ -109,7 +184,7 @@ class DatabaseManager:
         self.cursor.execute(query)
         return self.cursor.fetchall()
 
-    def fetch_by_id(self, table_name, ids, id_column="id", columns="*"):
+    def fetch_by_id(self, table_name, ids, id_column="id", columns="*", batch_size=500):
         """
         根据 ID 查询数据。
         
@@ -117,15 +192,21 @@ class DatabaseManager:
         :param ids: 单个 ID 或 ID 列表
         :param id_column: ID 列的名称（默认 "id"）
         :param columns: 查询的列（默认 "*"）
+        :param batch_size: 每条 SELECT 语句携带的 ID 个数，避免超过 SQLite 的参数上限
         :return: 结果列表
         """
         if isinstance(ids, int):
             ids = [ids]
 
-        placeholders = ", ".join(["?"] * len(ids))
-        query = f"SELECT {columns} FROM {table_name} WHERE {id_column} IN ({placeholders})"
-        self.cursor.execute(query, ids)
-        return self.cursor.fetchall()
+        ids = list(ids)
+        results = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            placeholders = ", ".join(["?"] * len(batch))
+            query = f"SELECT {columns} FROM {table_name} WHERE {id_column} IN ({placeholders})"
+            self.cursor.execute(query, batch)
+            results.extend(self.cursor.fetchall())
+        return results
 
     def fetch_column(self, table_name, column_name):
         """
@@ -150,6 +231,25 @@ class DatabaseManager:
         self.cursor.execute(query)
         return self.cursor.fetchone()[0]
 
+    def max_id(self, table_name, id_column="id"):
+        """
+        获取表中已经使用过的最大 ID，AUTOINCREMENT 表同时参考 sqlite_sequence，已删除行的 ID 不会被重复分配。
+
+        :param table_name: 表名
+        :param id_column: ID 列的名称（默认 "id"）
+        :return: 最大 ID，空表返回 0
+        """
+        self.cursor.execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {table_name}")
+        max_id = self.cursor.fetchone()[0]
+        try:
+            self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table_name,))
+            row = self.cursor.fetchone()
+            if row is not None:
+                max_id = max(max_id, row[0])
+        except sqlite3.OperationalError:
+            pass  # 数据库中没有 AUTOINCREMENT 表时不存在 sqlite_sequence
+        return max_id
+
     def delete_by_id(self, table_name, record_id, id_column="id"):
         """
         根据 ID 删除数据。
@@ -162,6 +262,27 @@ class DatabaseManager:
         self.cursor.execute(query, (record_id,))
         self.conn.commit()
 
+    def delete_where_in(self, table_name, column_name, values, batch_size=500):
+        """
+        删除指定列的值在给定列表中的所有数据。
+
+        :param table_name: 表名
+        :param column_name: 列名
+        :param values: 值列表
+        :param batch_size: 每条 DELETE 语句携带的值个数，避免超过 SQLite 的参数上限
+        :return: 删除的条数
+        """
+        values = list(values)
+        deleted_count = 0
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            placeholders = ", ".join(["?"] * len(batch))
+            query = f"DELETE FROM {table_name} WHERE {column_name} IN ({placeholders})"
+            self.cursor.execute(query, batch)
+            deleted_count += self.cursor.rowcount
+        self.conn.commit()
+        return deleted_count
+
     def close(self):
         """关闭数据库连接。"""
         self.conn.close()
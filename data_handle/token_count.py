@@ -0,0 +1,17 @@
+# chunk 的 token 数估计：切分时写入切分表的 token_count 列，生成时按 token 预算挑选知识，不需要在查询时再分词
+# 本地没有 LLM 的分词器（模型在 ollama 中），按 Qwen 等中文模型的分词习惯估计：汉字与标点各算 1 个，英文与数字每 4 个字符算 1 个
+import re
+
+_TOKEN_PATTERN = re.compile(r"[0-9A-Za-z]+|\S")
+
+
+def count_tokens(text: str) -> int:
+    """
+    估计文本的 token 数，宁多勿少，按预算拼接的提示词不会超出上下文长度。
+    :param text: 文本
+    :return: token 数
+    """
+    if not text:
+        return 0
+    return sum((len(piece) + 3) // 4 if piece.isascii() and piece.isalnum() else 1
+               for piece in _TOKEN_PATTERN.findall(text))
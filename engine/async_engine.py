@@ -0,0 +1,238 @@
+# 异步查询引擎：多个问题同时处理，向量化与检索放在线程池中执行，LLM 生成通过信号量限制并发数
+import asyncio
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config.config import parameters
+
+from knowledge.embedding import EmbeddingSourceDate
+from retrieval.searce_similar_text import SearchSimilarText
+from retrieval.rerank import CrossEncoderReranker
+from generation.stream_generator import OllamaGenerator
+from generation.answer_cache import SemanticAnswerCache
+from generation.context_builder import ContextBuilder
+
+
+class AsyncQueryEngine:
+    def __init__(self, embedding=None, searcher=None, generator=None, answer_cache=None, reranker=None, context_builder=None,
+                 table_name: str = parameters.search_table,
+                 filter_expression: str = parameters.search_filter,
+                 workers: int = parameters.engine_workers,
+                 llm_concurrency: int = parameters.llm_max_concurrency,
+                 timeout: float = parameters.query_timeout):
+        """
+        向量化模型、LanceDB 连接与 LLM 客户端只加载一次，所有请求共用。
+        :param embedding: EmbeddingSourceDate 实例，None 时新建
+        :param searcher: SearchSimilarText 实例，None 时新建
+        :param generator: OllamaGenerator 实例，None 时新建
+        :param answer_cache: SemanticAnswerCache 实例，None 时新建
+        :param reranker: CrossEncoderReranker 实例，None 时按 rerank_enable 决定是否新建
+        :param context_builder: ContextBuilder 实例，None 时新建
+        :param table_name: 检索的表名
+        :param filter_expression: 检索时的过滤条件
+        :param workers: 向量化与检索的线程数
+        :param llm_concurrency: 同时进行的 LLM 生成数
+        :param timeout: 单个请求的默认超时时间（秒），None 表示不限制
+        """
+        self.embedding = embedding if embedding is not None else EmbeddingSourceDate()
+        self.searcher = searcher if searcher is not None else SearchSimilarText()
+        self.generator = generator if generator is not None else OllamaGenerator()
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache()
+        if reranker is None and parameters.rerank_enable:
+            reranker = CrossEncoderReranker()
+        self.reranker = reranker
+        self.context_builder = context_builder if context_builder is not None else ContextBuilder()
+        self.table_name = table_name
+        self.filter_expression = filter_expression
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.llm_semaphore = asyncio.Semaphore(llm_concurrency)
+        self.llm_concurrency = llm_concurrency
+        self.tasks = {}  # request_id -> asyncio.Task，用于按 id 取消
+        self.request_ids = itertools.count(1)
+        self.active = 0        # 正在处理的请求数
+        self.llm_waiting = 0   # 等待 LLM 信号量的请求数
+        self.completed = 0
+        self.failed = 0
+
+    async def _run(self, deadline, func, *args, **kwargs):
+        """
+        在线程池中执行同步函数，超过 deadline 时抛出 TimeoutError；线程中的计算无法中断，结果会被丢弃。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        return await asyncio.wait_for(future, self._remaining(deadline))
+
+    @staticmethod
+    def _remaining(deadline):
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("query timeout")
+        return remaining
+
+    def _search(self, question_v, question):
+        find_knowledge = self.searcher.search(query_vector=question_v,
+                                              table_name=self.table_name,
+                                              question=question,
+                                              topk=parameters.rerank_candidates if self.reranker is not None else None,
+                                              filter_expression=self.filter_expression)
+        kb_version = (self.table_name, self.searcher.table_version(self.table_name))
+        return find_knowledge, kb_version
+
+    async def stream(self, question: str, info: dict = None, timeout: float = -1):
+        """
+        处理一个问题并逐个返回回答的 token。
+        :param question: 用户问题
+        :param info: 传入字典时写入本次请求的 chunk_ids、knowledge、cached 与各阶段耗时 timings
+        :param timeout: 超时时间（秒），-1 使用默认值，None 表示不限制；超时抛出 TimeoutError
+        :return: 异步生成器，逐个返回 token 文本；命中回答缓存时一次返回整个回答
+        """
+        if info is None:
+            info = {}
+        if timeout == -1:
+            timeout = self.timeout
+        start_time = time.time()
+        deadline = start_time + timeout if timeout is not None else None
+        timings = info.setdefault("timings", {})
+        self.active += 1
+        try:
+            # 向量化与检索
+            question_v = await self._run(deadline, self.embedding.embedding_query, question)
+            embedding_time = time.time()
+            timings["embedding"] = embedding_time - start_time
+            find_knowledge, kb_version = await self._run(deadline, self._search, question_v, question)
+            search_time = time.time()
+            timings["search"] = search_time - embedding_time
+            if self.reranker is not None:
+                find_knowledge = await self._run(deadline, self.reranker.rerank, question, find_knowledge)
+                timings["rerank"] = time.time() - search_time
+                search_time = time.time()
+            chunk_ids = find_knowledge["id"].to_list()
+            knowledge = await self._run(deadline, self.context_builder.build, find_knowledge)
+            timings["context"] = time.time() - search_time
+            search_time = time.time()
+            info.update(chunk_ids=chunk_ids, knowledge="\n".join(knowledge))
+
+            # 相近的问题检索到相同的知识时直接使用缓存的回答
+            answer = self.answer_cache.get(question_v, chunk_ids, kb_version)
+            info["cached"] = answer is not None
+            if answer is not None:
+                timings["generate"] = 0.0
+                yield answer
+            else:
+                self.llm_waiting += 1
+                try:
+                    await asyncio.wait_for(self.llm_semaphore.acquire(), self._remaining(deadline))
+                finally:
+                    self.llm_waiting -= 1
+                try:
+                    generate_start = time.time()
+                    timings["queue"] = generate_start - search_time
+                    llm_stats = {}
+                    tokens = []
+                    token_stream = self.generator.astream(question, knowledge, stats=llm_stats)
+                    try:
+                        while True:
+                            try:
+                                token = await asyncio.wait_for(token_stream.__anext__(), self._remaining(deadline))
+                            except StopAsyncIteration:
+                                break
+                            if not tokens:
+                                timings["ttft"] = time.time() - generate_start
+                            tokens.append(token)
+                            yield token
+                    finally:
+                        await token_stream.aclose()
+                    timings["tokens_per_sec"] = llm_stats.get("tokens_per_sec")
+                    timings["generate"] = time.time() - generate_start
+                finally:
+                    self.llm_semaphore.release()
+                self.answer_cache.put(question_v, chunk_ids, kb_version, "".join(tokens))
+            self.completed += 1
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            timings["total"] = time.time() - start_time
+
+    async def query(self, question: str, timeout: float = -1) -> dict:
+        """
+        处理一个问题，返回完整回答。
+        :param question: 用户问题
+        :param timeout: 超时时间（秒），-1 使用默认值
+        :return: {"question", "answer", "chunk_ids", "cached", "timings"}
+        """
+        info = {}
+        tokens = [token async for token in self.stream(question, info, timeout)]
+        return {"question": question,
+                "answer": "".join(tokens),
+                "chunk_ids": info.get("chunk_ids", []),
+                "cached": info.get("cached", False),
+                "timings": info["timings"]}
+
+    def submit(self, question: str, timeout: float = -1):
+        """
+        以任务的方式提交问题，需在事件循环中调用。
+        :return: (request_id, asyncio.Task)
+        """
+        request_id = next(self.request_ids)
+        task = asyncio.create_task(self.query(question, timeout))
+        self.tasks[request_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(request_id, None))
+        return request_id, task
+
+    def cancel(self, request_id: int) -> bool:
+        """
+        取消尚未完成的请求；正在生成时会关闭与 ollama 的连接。
+        :return: 找到并取消返回 True
+        """
+        task = self.tasks.get(request_id)
+        if task is None or task.done():
+            return False
+        return task.cancel()
+
+    async def run_many(self, questions, timeout: float = -1):
+        """
+        并发处理多个问题并打印吞吐量。
+        :return: 与 questions 顺序一致的结果列表，失败的请求为对应的异常
+        """
+        start_time = time.time()
+        tasks = [self.submit(question, timeout)[1] for question in questions]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.time() - start_time
+        ok = sum(1 for result in results if isinstance(result, dict))
+        print(f"并发处理{len(questions)}个问题，成功{ok}个，耗时{elapsed:.2f}s，"
+              f"吞吐量{len(questions) / elapsed if elapsed > 0 else 0:.2f} 问题/s")
+        return results
+
+    def stats(self) -> dict:
+        return {"active": self.active,
+                "llm_waiting": self.llm_waiting,
+                "llm_concurrency": self.llm_concurrency,
+                "completed": self.completed,
+                "failed": self.failed,
+                "query_cache": self.embedding.query_cache.stats(),
+                "answer_cache": self.answer_cache.stats()}
+
+    def close(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    async def demo():
+        engine = AsyncQueryEngine()
+        results = await engine.run_many(["顺产母猪的保健有哪些方法?", "母猪产后不吃食怎么办?", "仔猪腹泻如何防治?"])
+        for result in results:
+            if isinstance(result, dict):
+                print(result["question"], result["timings"], "\nAI：" + result["answer"])
+            else:
+                print("❌", type(result).__name__, result)
+        engine.close()
+
+    asyncio.run(demo())
@@ -1,10 +1,37 @@
+import threading
 import ollama
 from config.config import parameters
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    获取进程内共享的 ollama 客户端，底层 HTTP 连接在多次请求之间复用，不必每次提问都重新建立连接。
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                _client = ollama.Client(parameters.host_port)
+            except Exception as e:
+                print("Exception occurred: ", type(e).__name__)
+                print("Exception message: ", str(e))
+                _client = ollama.Client("http://localhost:11434")
+        return _client
+
 
 def generate_prompt(question, retrieved_data):
-    # 将所有知识片段拼接
-    knowledge_text = "\n\n".join([f"- {data[0]}" for data in retrieved_data])
+    """
+    :param question: 用户问题
+    :param retrieved_data: 知识片段列表（ContextBuilder.build 的结果），也可以是一整段文本
+    :return: 提示词
+    """
+    if isinstance(retrieved_data, str):
+        retrieved_data = [retrieved_data]
+    # 将所有知识片段拼接，每个片段一行
+    knowledge_text = "\n\n".join([f"- {data}" for data in retrieved_data or []])
 
     # 插入到 Prompt 模板中
     prompt = f"""你是一个专业的 AI 助手，帮助用户回答问题。请根据以下提供的知识来回答用户的问题。
@@ -21,12 +48,7 @@ def generate_prompt(question, retrieved_data):
 
 def generate_ollama(question, knowledge=None):
 
-    try:
-        client = ollama.Client(parameters.host_port)
-    except Exception as e:
-        print("Exception occurred: ", type(e).__name__)
-        print("Exception message: ", str(e))
-        client = ollama.Client("http://localhost:11434")
+    client = get_client()
 
     promapt = f"问题：{question}\n知识：{knowledge}\n回答："
     promapt = {"system": "你是一个AI助手，擅长基于知识库回答问题。",
@@ -37,7 +59,9 @@ def generate_ollama(question, knowledge=None):
 
 
     # request = client.chat(model='qwwen2.5:0.5b', messages={'role': 'user', 'content': f"{promapt}"})
-    request = client.chat(model=parameters.llm_model, messages=[{'role': 'user', 'content': f"{promapt}"}])
+    request = client.chat(model=parameters.llm_model, messages=[{'role': 'user', 'content': f"{promapt}"}],
+                          options={"temperature": parameters.temperature, "num_ctx": parameters.llm_num_ctx},
+                          keep_alive=parameters.llm_keep_alive)
     request_text = request['message']['content']
     return request_text
 
@@ -0,0 +1,103 @@
+# 语义回答缓存：问题向量足够相近、检索到的 chunk 相同、知识库版本相同时，直接返回之前生成的回答
+import threading
+import numpy as np
+from config.config import parameters
+
+
+class SemanticAnswerCache:
+    def __init__(self, max_size: int = parameters.answer_cache_size, threshold: float = parameters.answer_cache_threshold):
+        """
+        :param max_size: 最多缓存的回答条数，超出后淘汰最久未使用的
+        :param threshold: 余弦相似度阈值，不低于该值的问题视为同一个问题
+        """
+        self.max_size = max_size
+        self.threshold = threshold
+        self.vectors = None  # (max_size, dim) 的归一化问题向量，第一次写入时分配
+        self.valid = np.zeros(max_size, dtype=bool)
+        self.ticks = np.zeros(max_size, dtype=np.int64)
+        self.entries = [None] * max_size  # (chunk_ids, kb_version, answer)
+        self.tick = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _invalidate_versions(self, kb_version):
+        """
+        知识库（同一张表）版本变化后，该表的旧回答全部失效。
+        """
+        table_name = kb_version[0]
+        for slot in np.flatnonzero(self.valid):
+            entry_version = self.entries[slot][1]
+            if entry_version[0] == table_name and entry_version != kb_version:
+                self.valid[slot] = False
+                self.entries[slot] = None
+                self.invalidations += 1
+
+    def get(self, query_vector, chunk_ids, kb_version):
+        """
+        查找相近问题的回答。
+        :param query_vector: 问题向量
+        :param chunk_ids: 本次检索到的 chunk id 列表
+        :param kb_version: (表名, 表版本号)
+        :return: 命中时返回回答，否则返回 None
+        """
+        chunk_key = frozenset(chunk_ids)
+        with self.lock:
+            self._invalidate_versions(kb_version)
+            slots = np.flatnonzero(self.valid)
+            if self.vectors is None or len(slots) == 0:
+                self.misses += 1
+                return None
+            sims = self.vectors[slots] @ self._normalize(query_vector)
+            for i in np.argsort(-sims):
+                if sims[i] < self.threshold:
+                    break
+                slot = slots[i]
+                entry_chunks, entry_version, answer = self.entries[slot]
+                if entry_chunks == chunk_key and entry_version == kb_version:
+                    self.tick += 1
+                    self.ticks[slot] = self.tick
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def put(self, query_vector, chunk_ids, kb_version, answer):
+        """
+        写入回答，缓存已满时淘汰最久未使用的条目。
+        """
+        vector = self._normalize(query_vector)
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            free_slots = np.flatnonzero(~self.valid)
+            if len(free_slots):
+                slot = free_slots[0]
+            else:
+                slot = int(np.argmin(self.ticks))
+                self.evictions += 1
+            self.tick += 1
+            self.vectors[slot] = vector
+            self.valid[slot] = True
+            self.ticks[slot] = self.tick
+            self.entries[slot] = (frozenset(chunk_ids), kb_version, answer)
+
+    def stats(self) -> dict:
+        """
+        缓存的命中统计。
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": int(self.valid.sum()),
+                "max_size": self.max_size}
@@ -0,0 +1,151 @@
+# 上下文构建：把检索结果整理成交给 LLM 的知识片段
+# 同一文档中相邻的 chunk 合并并去掉重叠部分，近似重复的片段只保留一个，再按相关度在 token 预算内挑选
+import re
+import threading
+import pandas as pd
+from config.config import parameters
+from data_handle.text_dataset import DatabaseManager
+from data_handle.token_count import count_tokens
+
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def merge_overlap(left: str, right: str, min_overlap: int = 3):
+    """
+    拼接两个相邻的 chunk，left 的结尾与 right 的开头重叠时只保留一份。
+    :param min_overlap: 重叠少于该长度时视为巧合，直接拼接
+    :return: (拼接后的文本, 重叠部分)
+    """
+    for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:], right[:size]
+    return left + right, ""
+
+
+def shingles(text: str, size: int = 3) -> set:
+    """
+    去掉空白后的字符三元组集合，用于比较两段文本的重合程度。
+    """
+    text = _SPACE_PATTERN.sub("", text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = parameters.context_token_budget,
+                       dedup_threshold: float = parameters.context_dedup_threshold):
+        """
+        :param token_budget: 知识片段的 token 总数上限
+        :param dedup_threshold: 一个片段的三元组有不少于该比例出现在已选片段中时视为近似重复
+        """
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.db = None  # 第一次构建时打开，多个线程通过锁轮流使用
+        self.lock = threading.Lock()
+        self.last_stats = {}
+
+    def _chunk_info(self, table_name: str, ids) -> dict:
+        """
+        从切分表读取 chunk 所在的文档、切分时计算的 token 数与在文档中的偏移量（旧数据的偏移量为空）。
+        :return: {chunk_id: (doc_id, token_count, start_offset, end_offset)}
+        """
+        if not ids:
+            return {}
+        with self.lock:
+            if self.db is None:
+                self.db = DatabaseManager(check_same_thread=False)
+            rows = self.db.fetch_by_id(table_name, [int(i) for i in ids], columns="id, doc_id, token_count, start_offset, end_offset")
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    @staticmethod
+    def _units(results: pd.DataFrame):
+        """
+        检索结果中的知识单元：分层检索为句子所在的段落，其他方式为 chunk 本身；按相关度排列并去掉重复的 id。
+        :return: (切分表名, [(rank, id, text)])
+        """
+        if "paragraph_text" in results.columns:
+            table_name, id_column, text_column = parameters.sql_paragraph_table_name, "paragraph_id", "paragraph_text"
+        else:
+            table_name, id_column, text_column = parameters.sql_table_name, "id", "text"
+        units, seen = [], set()
+        for chunk_id, text in zip(results[id_column], results[text_column]):
+            if pd.isna(chunk_id) or not isinstance(text, str) or int(chunk_id) in seen:
+                continue
+            seen.add(int(chunk_id))
+            units.append((len(units), int(chunk_id), text))
+        return table_name, units
+
+    def _merge_adjacent(self, units, info):
+        """
+        同一文档中前后相邻或重叠的 chunk 合并为一段：有偏移量时按偏移量判断，重叠部分由偏移量直接得出；
+        没有偏移量的旧数据以 id 连续判断，按文本匹配去掉重叠。
+        :return: 片段组列表，每组记录合并后的 text、tokens 与 rank（组内最相关的 chunk 的排名），按 rank 排列
+        """
+        def order(unit):
+            doc_id, _, start, _ = info.get(unit[1], (None, None, None, None))
+            return doc_id is None, doc_id or 0, start is None, start or 0, unit[1]
+
+        groups = []
+        for rank, chunk_id, text in sorted(units, key=order):
+            doc_id, tokens, start, end = info.get(chunk_id, (None, None, None, None))
+            tokens = tokens if tokens is not None else count_tokens(text)
+            last = groups[-1] if groups else None
+            overlap = None
+            if last is not None and doc_id is not None and last["doc_id"] == doc_id:
+                if start is not None and last["end"] is not None:
+                    # chunk 之间只隔着换行等空白时也视为相邻，偏移量之差即重叠的字符数
+                    if end <= last["end"]:
+                        overlap = text  # 包含在已合并的片段中
+                    elif start <= last["end"]:
+                        overlap = text[:last["end"] - start]
+                        last["text"] += text[len(overlap):]
+                    elif start == last["end"] + 1:
+                        overlap = ""
+                        last["text"] += "\n" + text
+                elif start is None and last["end"] is None and last["last_id"] + 1 == chunk_id:
+                    last["text"], overlap = merge_overlap(last["text"], text)
+            if overlap is not None:
+                last["tokens"] += tokens - count_tokens(overlap)
+                last["rank"] = min(last["rank"], rank)
+                last["last_id"] = chunk_id
+                last["end"] = max(last["end"], end) if end is not None else None
+                last["size"] += 1
+            else:
+                groups.append({"rank": rank, "doc_id": doc_id, "last_id": chunk_id, "end": end, "text": text, "tokens": tokens, "size": 1})
+        groups.sort(key=lambda g: g["rank"])
+        return groups
+
+    def build(self, results: pd.DataFrame, token_budget: int = None):
+        """
+        :param results: SearchSimilarText.search 或重排序的结果，按相关度从高到低排列
+        :param token_budget: token 预算，None 使用初始化时的值
+        :return: 知识片段列表，按相关度从高到低排列
+        """
+        if token_budget is None:
+            token_budget = self.token_budget
+        table_name, units = self._units(results)
+        info = self._chunk_info(table_name, [chunk_id for _, chunk_id, _ in units])
+        groups = self._merge_adjacent(units, info)
+
+        selected, selected_shingles = [], set()
+        used_tokens = duplicates = over_budget = 0
+        for group in groups:
+            group_shingles = shingles(group["text"])
+            if len(group_shingles & selected_shingles) >= self.dedup_threshold * len(group_shingles):
+                duplicates += 1
+                continue
+            if used_tokens + group["tokens"] > token_budget:
+                if selected:
+                    over_budget += 1
+                    continue
+                # 最相关的片段本身超出预算时按比例截断，保证至少有一段知识
+                group["text"] = group["text"][:max(1, len(group["text"]) * token_budget // group["tokens"])]
+                group["tokens"] = count_tokens(group["text"])
+            selected.append(group["text"])
+            selected_shingles |= group_shingles
+            used_tokens += group["tokens"]
+        self.last_stats = {"chunks": len(units), "merged": len(units) - len(groups), "duplicates": duplicates,
+                           "over_budget": over_budget, "selected": len(selected), "tokens": used_tokens,
+                           "token_budget": token_budget}
+        return selected
@@ -0,0 +1,111 @@
+# 流式生成：整个进程共用一个 ollama 客户端，逐个 token 返回回答，并分别统计首 token 延迟与生成速度
+import time
+import ollama
+from config.config import parameters
+from .LLM import generate_prompt, get_client
+
+
+def generation_stats(start_time, first_token_time, end_time, token_count, final=None) -> dict:
+    """
+    汇总一次流式生成的耗时统计。
+    :param start_time: 发出请求的时间
+    :param first_token_time: 收到第一个 token 的时间，没有收到时为 None
+    :param end_time: 流结束的时间
+    :param token_count: 客户端收到的非空片段数
+    :param final: done=True 的最后一个响应，优先使用其中 ollama 给出的 eval_count/eval_duration（单位纳秒）
+    :return: {"ttft", "tokens", "tokens_per_sec", "total_time"}
+    """
+    if final is not None and final.get('eval_count') and final.get('eval_duration'):
+        eval_count = final['eval_count']
+        tokens_per_sec = eval_count / (final['eval_duration'] / 1e9)
+    else:
+        eval_count = token_count
+        decode_time = end_time - (first_token_time or end_time)
+        tokens_per_sec = token_count / decode_time if decode_time > 0 else 0.0
+    return {"ttft": (first_token_time or end_time) - start_time,
+            "tokens": eval_count,
+            "tokens_per_sec": tokens_per_sec,
+            "total_time": end_time - start_time}
+
+
+class OllamaGenerator:
+    def __init__(self, model: str = parameters.llm_model):
+        """
+        :param model: ollama 中的模型名称
+        """
+        self.model = model
+        self.client = get_client()
+        self.async_client = None  # 异步客户端绑定事件循环，第一次 astream 时创建
+        self.options = {"temperature": parameters.temperature, "num_ctx": parameters.llm_num_ctx}
+        self.last_stats = {}
+
+    def _messages(self, question, knowledge):
+        return [{'role': 'user', 'content': generate_prompt(question, knowledge)}]
+
+    def stream(self, question, knowledge=None):
+        """
+        流式生成回答。
+        :param question: 用户问题
+        :param knowledge: 检索到的知识
+        :return: 生成器，逐个返回 token 文本；结束后 last_stats 中记录 ttft（首 token 延迟）与 tokens_per_sec（生成速度）
+        """
+        messages = self._messages(question, knowledge)
+        start_time = time.time()
+        first_token_time = None
+        token_count = 0
+        final = None
+        response = self.client.chat(model=self.model,
+                                    messages=messages,
+                                    stream=True,
+                                    options=self.options,
+                                    keep_alive=parameters.llm_keep_alive)
+        for chunk in response:
+            content = chunk['message']['content']
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                token_count += 1
+                yield content
+            if chunk.get('done'):
+                final = chunk
+        self.last_stats = generation_stats(start_time, first_token_time, time.time(), token_count, final)
+
+    async def astream(self, question, knowledge=None, stats: dict = None):
+        """
+        stream 的异步版本，等待 token 时不阻塞事件循环；任务被取消时关闭与 ollama 的连接，停止生成。
+        :param question: 用户问题
+        :param knowledge: 检索到的知识
+        :param stats: 并发调用时 last_stats 会被相互覆盖，传入字典则把本次的统计写入其中
+        :return: 异步生成器，逐个返回 token 文本
+        """
+        if self.async_client is None:
+            self.async_client = ollama.AsyncClient(parameters.host_port)
+        messages = self._messages(question, knowledge)
+        start_time = time.time()
+        first_token_time = None
+        token_count = 0
+        final = None
+        response = await self.async_client.chat(model=self.model,
+                                                messages=messages,
+                                                stream=True,
+                                                options=self.options,
+                                                keep_alive=parameters.llm_keep_alive)
+        async for chunk in response:
+            content = chunk['message']['content']
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                token_count += 1
+                yield content
+            if chunk.get('done'):
+                final = chunk
+        result = generation_stats(start_time, first_token_time, time.time(), token_count, final)
+        self.last_stats = result
+        if stats is not None:
+            stats.update(result)
+
+    def generate(self, question, knowledge=None):
+        """
+        非流式接口，返回完整回答。
+        """
+        return "".join(self.stream(question, knowledge))
@@ -1,34 +1,132 @@
 # 使用预训练模型讲文本或者是其他的知识表达形式转换为向量
+import time
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
 from config.config import parameters
+from .embedding_cache import EmbeddingCache
+from .query_cache import LRUCache, normalize_query
 
 class EmbeddingSourceDate:
-    def __init__(self, embedding_model=parameters.use_embedding_model):
+    def __init__(self, embedding_model=parameters.use_embedding_model, use_cache: bool = parameters.embedding_cache_enable):
         """
         :param embedding_model: "all-MiniLM-L6-v2" or "bge-m3"
+        :param use_cache: 是否使用磁盘向量缓存
         """
+        self.model_name = embedding_model
         if embedding_model == "all-MiniLM-L6-v2":
             self.model = SentenceTransformer(parameters.MiniLM_path)
         elif embedding_model == "bge-m3":
             self.model = SentenceTransformer(parameters.bge_m3_path)
         else:
             print("Have an error!!! Please input the correct embedding model")
-    def embedding(self, sentences_list):
-        """Return the embeddings of the sentences."""
-        embedding_list = []
-        print(len(sentences_list))
-        print(len(sentences_list[0]))
-        # for i in tqdm(range(len(sentences_list)),leave=False, desc="Embedding sentences"):
-        #     embedding_list.append(self.model.encode(sentences_list[i], convert_to_numpy=True))
-        for i in range(len(sentences_list)):
-            embedding_list.append(self.model.encode(sentences_list[i], convert_to_numpy=True))
-        print(len(embedding_list))
-        print(embedding_list[0].shape)
-        print(type(embedding_list[0]))
-        return embedding_list
+        self.cache = None
+        if use_cache:
+            self.cache = EmbeddingCache(cache_path=parameters.embedding_cache_path,
+                                        model_name=embedding_model,
+                                        dim=self.model.get_sentence_embedding_dimension(),
+                                        max_items=parameters.embedding_cache_max_items)
+        self.query_cache = LRUCache(max_size=parameters.query_cache_size, ttl=parameters.query_cache_ttl)
+        # 查询向量的磁盘缓存单独存放，按实际编码的原文计算键，不与chunk文本的向量混在一起
+        self.query_disk_cache = None
+        if parameters.query_cache_disk:
+            self.query_disk_cache = EmbeddingCache(cache_path=parameters.query_cache_path,
+                                                   model_name=embedding_model,
+                                                   dim=self.model.get_sentence_embedding_dimension(),
+                                                   max_items=parameters.query_cache_size,
+                                                   normalize=False)
+
+    def token_lengths(self, sentences_list):
+        """
+        计算每个句子的token长度，用于按长度分桶。
+        没有tokenizer时退化为字符长度。
+        :param sentences_list: 句子列表
+        :return: 每个句子的长度列表
+        """
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return [len(s) for s in sentences_list]
+        encoded = tokenizer(list(sentences_list), add_special_tokens=False, truncation=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def embedding(self, sentences_list, batch_size: int = None, show_progress: bool = True):
+        """
+        批量编码句子，返回与输入顺序一致的向量矩阵。
+        开启缓存时只编码缓存中没有的句子。
+        :param sentences_list: 句子列表
+        :param batch_size: 每个batch的句子数，默认使用配置文件中的embedding_batch_size
+        :param show_progress: 是否显示进度条
+        :return: np.ndarray，形状为(len(sentences_list), dim)，dtype为float32
+        """
+        if batch_size is None:
+            batch_size = parameters.embedding_batch_size
+        if self.cache is None:
+            return self.encode_batches(sentences_list, batch_size, show_progress)
+
+        embeddings, miss_index = self.cache.get_many(sentences_list)
+        if miss_index:
+            miss_texts = [sentences_list[i] for i in miss_index]
+            miss_embeddings = self.encode_batches(miss_texts, batch_size, show_progress)
+            embeddings[miss_index] = miss_embeddings
+            self.cache.put_many(miss_texts, miss_embeddings)
+            self.cache.flush()
+        print("向量缓存统计：", self.cache.stats())
+        return embeddings
+
+    def encode_batches(self, sentences_list, batch_size: int, show_progress: bool = True):
+        """
+        按长度分桶批量编码。
+        先按token长度排序，再按batch_size切成长度相近的桶，每个桶只做一次前向计算，减少padding的浪费。
+        :param sentences_list: 句子列表
+        :param batch_size: 每个batch的句子数
+        :param show_progress: 是否显示进度条
+        :return: np.ndarray，形状为(len(sentences_list), dim)，dtype为float32
+        """
+        dim = self.model.get_sentence_embedding_dimension()
+        if len(sentences_list) == 0:
+            return np.empty((0, dim), dtype=np.float32)
+
+        start_time = time.time()
+        # 1、按token长度排序，长度相近的句子放在同一个桶中
+        lengths = self.token_lengths(sentences_list)
+        order = np.argsort(lengths, kind="stable")
+
+        # 2、逐桶编码，结果按原始顺序写回连续的矩阵
+        embeddings = np.empty((len(sentences_list), dim), dtype=np.float32)
+        for start in tqdm(range(0, len(order), batch_size), leave=False, desc="Embedding sentences", disable=not show_progress):
+            bucket = order[start:start + batch_size]
+            batch = [sentences_list[i] for i in bucket]
+            embeddings[bucket] = self.model.encode(batch, batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+
+        cost_time = time.time() - start_time
+        print(f"共编码{len(sentences_list)}条文本，耗时{cost_time:.2f}s，吞吐{len(sentences_list) / max(cost_time, 1e-9):.1f} chunks/s")
+        return embeddings
+
+    def embedding_query(self, question):
+        """
+        编码用户问题，相同（归一化后）的问题直接返回进程内缓存的向量，不再做前向计算。
+        开启query_cache_disk时再查询磁盘缓存，磁盘缓存以实际编码的原文为键。
+        :param question: 问题文本
+        :return: 问题的向量
+        """
+        key = (self.model_name, normalize_query(question))
+        vector = self.query_cache.get(key)
+        if vector is not None:
+            return vector
+        if self.query_disk_cache is not None:
+            vectors, miss_index = self.query_disk_cache.get_many([question])
+            if not miss_index:
+                self.query_cache.put(key, vectors[0])
+                return vectors[0]
+        vector = self.embedding_single(question)
+        self.query_cache.put(key, vector)
+        if self.query_disk_cache is not None:
+            self.query_disk_cache.put_many([question], vector[None, :])
+            self.query_disk_cache.flush()
+        return vector
+
     def embedding_single(self, sentence):
         """Return the embedding of the sentence."""
         # 使用模型对句子进行编码，返回句子的嵌入表示
-        return self.model.encode(sentence)
\ No newline at end of file
+        return self.model.encode(sentence)
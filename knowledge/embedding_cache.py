@@ -0,0 +1,178 @@
+# 基于内容寻址的向量缓存：以（模型名，归一化文本的hash）为键，向量存放在内存映射的float32文件中
+# 重建知识库时只需要编码从未见过的文本，其余直接从缓存中读取
+import os
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    文本归一化：全角半角统一（NFKC），并合并连续的空白字符。
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    KEY_SIZE = 8   # hash键的字节数，以uint64存储，0表示空槽位
+
+    def __init__(self, cache_path: str, model_name: str, dim: int, max_items: int = 200000, normalize: bool = True):
+        """
+        磁盘向量缓存，可以在多个线程中共用。
+        目录下包含三个文件：vectors.f32（内存映射的向量矩阵）、index.npy（每个槽位的hash键与最近使用时间）、meta.json。
+        :param cache_path: 缓存根目录，不同模型使用不同的子目录
+        :param model_name: embedding模型名称，参与hash键的计算
+        :param dim: 向量维度
+        :param max_items: 最多缓存的向量条数，超出后按最近最少使用淘汰
+        :param normalize: 是否对文本归一化后再计算hash键，False时按原文计算
+        """
+        self.model_name = model_name
+        self.dim = dim
+        self.capacity = max_items
+        self.normalize = normalize
+        self.lock = threading.Lock()  # 保护内存映射矩阵、槽位表与统计
+        self.cache_dir = os.path.join(cache_path, re.sub(r"[^0-9A-Za-z_.-]", "_", model_name))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.vector_file = os.path.join(self.cache_dir, "vectors.f32")
+        self.index_file = os.path.join(self.cache_dir, "index.npy")
+        self.meta_file = os.path.join(self.cache_dir, "meta.json")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        """
+        读取已有的缓存，维度不一致时重建，容量变大时扩展文件，容量变小时重建。
+        """
+        meta = None
+        if os.path.exists(self.meta_file) and os.path.exists(self.index_file) and os.path.exists(self.vector_file):
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != self.dim or meta.get("capacity", 0) > self.capacity:
+                print(f"向量缓存参数变化，重建缓存：{self.cache_dir}")
+                meta = None
+
+        if meta is None:
+            self.keys = np.zeros(self.capacity, dtype=np.uint64)
+            self.ticks = np.zeros(self.capacity, dtype=np.int64)
+            self.vectors = np.memmap(self.vector_file, dtype=np.float32, mode="w+", shape=(self.capacity, self.dim))
+        else:
+            index = np.load(self.index_file)
+            old_capacity = meta["capacity"]
+            self.keys = np.zeros(self.capacity, dtype=np.uint64)
+            self.ticks = np.zeros(self.capacity, dtype=np.int64)
+            self.keys[:old_capacity] = index["key"]
+            self.ticks[:old_capacity] = index["tick"]
+            if old_capacity < self.capacity:
+                with open(self.vector_file, "r+b") as f:
+                    f.truncate(self.capacity * self.dim * 4)
+            self.vectors = np.memmap(self.vector_file, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+
+        self.slot_of = {key: slot for slot, key in enumerate(self.keys.tolist()) if key}
+        self.free_slots = np.flatnonzero(self.keys == 0)[::-1].tolist()
+        self.tick = int(self.ticks.max()) if self.capacity else 0
+
+    def make_key(self, text: str) -> int:
+        """
+        计算（模型名，归一化文本）的hash键，normalize为False时使用原文。
+        """
+        raw = (self.model_name + "\x00" + (normalize_text(text) if self.normalize else text)).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=self.KEY_SIZE).digest(), "little") or 1
+
+    def get_many(self, texts):
+        """
+        批量查询缓存。
+        :param texts: 文本列表
+        :return: (vectors, miss_index)，vectors中命中的行已填好，miss_index为未命中的下标列表
+        """
+        with self.lock:
+            self.tick += 1
+            vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+            hit_index, hit_slots, miss_index = [], [], []
+            for i, text in enumerate(texts):
+                slot = self.slot_of.get(self.make_key(text))
+                if slot is None:
+                    miss_index.append(i)
+                else:
+                    hit_index.append(i)
+                    hit_slots.append(slot)
+            if hit_slots:
+                vectors[hit_index] = self.vectors[hit_slots]
+                self.ticks[hit_slots] = self.tick
+            self.hits += len(hit_index)
+            self.misses += len(miss_index)
+            return vectors, miss_index
+
+    def put_many(self, texts, vectors):
+        """
+        批量写入缓存，已存在的键会跳过。
+        :param texts: 文本列表
+        :param vectors: 与texts一一对应的向量矩阵
+        """
+        with self.lock:
+            self.tick += 1
+            keys = {}
+            for i, text in enumerate(texts):
+                key = self.make_key(text)
+                if key in self.slot_of or key in keys:
+                    continue
+                keys[key] = i
+            keys, rows = list(keys), list(keys.values())
+            # 只保留最后capacity条，避免一次写入超过缓存容量
+            keys, rows = keys[-self.capacity:], rows[-self.capacity:]
+            if not keys:
+                return
+
+            if len(keys) > len(self.free_slots):
+                self._evict(len(keys) - len(self.free_slots))
+            slots = [self.free_slots.pop() for _ in keys]
+            self.vectors[slots] = np.asarray(vectors, dtype=np.float32)[rows]
+            self.keys[slots] = keys
+            self.ticks[slots] = self.tick
+            for key, slot in zip(keys, slots):
+                self.slot_of[key] = slot
+
+    def _evict(self, n: int):
+        """
+        淘汰最近最少使用的n个槽位。
+        """
+        used = np.flatnonzero(self.keys != 0)
+        victims = used[np.argpartition(self.ticks[used], n - 1)[:n]] if n < len(used) else used
+        for slot in victims.tolist():
+            del self.slot_of[int(self.keys[slot])]
+            self.keys[slot] = 0
+            self.ticks[slot] = 0
+            self.free_slots.append(slot)
+        self.evictions += len(victims)
+
+    def flush(self):
+        """
+        将向量与索引写回磁盘。
+        """
+        with self.lock:
+            self.vectors.flush()
+            index = np.zeros(self.capacity, dtype=[("key", np.uint64), ("tick", np.int64)])
+            index["key"] = self.keys
+            index["tick"] = self.ticks
+            np.save(self.index_file, index)
+            with open(self.meta_file, "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "dim": self.dim, "capacity": self.capacity}, f)
+
+    def stats(self) -> dict:
+        """
+        缓存的命中统计。
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.slot_of),
+                "capacity": self.capacity}
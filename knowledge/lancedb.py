@@ -1,11 +1,144 @@
 # 通过将知识数据库中的文本进行行量化，完成向量数据局的建立，第一个版本使用的faiss数据库，感觉不是很好，这个版本使用lancedb
 # lancedb也可以实现GPU的加速搜索，并且lancedb可以在同一行中存储文本、图片、向量等多种数据类型，非常方便，最主要的是开源
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import lancedb
 import pandas as pd
 from typing import List, Dict
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from config.config import parameters
 
+def add_content_hash(df: pd.DataFrame, hash_column: str = "content_hash", vector_column: str = "vector") -> pd.DataFrame:
+    """
+    基于所有非向量字段计算每行的64位内容hash，字符串先去除首尾空格并统一小写。
+    :param df: 数据。
+    :param hash_column: hash列名。
+    :param vector_column: 向量列名，不参与hash。
+    :return: 增加了hash列的 DataFrame。
+    """
+    columns = [col for col in df.columns if col not in (vector_column, hash_column)]
+
+    def standardize_value(value):
+        if isinstance(value, str):
+            return value.strip().lower()  # 统一大小写并去除空格
+        return value
+
+    df = df.copy()
+    # 使用64位整数保存hash，标量索引更紧凑
+    df[hash_column] = np.array([int.from_bytes(hashlib.blake2b(repr(tuple(standardize_value(v) for v in row)).encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+                                for row in df[columns].itertuples(index=False, name=None)], dtype=np.int64)
+    return df
+
+_DISTANCE_TERM = re.compile(r"^\(?\s*_distance\s*(<=|<|>=|>)\s*([0-9.eE+-]+)\s*\)?$")
+
+
+def split_distance_filter(filter_expression: str):
+    """
+    把过滤条件中以 AND 连接的 _distance 比较拆出来。_distance 不是表中的列，不能作为预过滤条件，
+    改用 distance_range 限定距离范围，其余条件仍在向量检索之前过滤。
+    :param filter_expression: 过滤条件，例如 "_distance < 0.9 AND paragraph_id IN (1, 2)"
+    :return: (lower_bound, upper_bound, 其余条件)，没有的部分为 None
+    """
+    if not filter_expression:
+        return None, None, None
+    lower_bound, upper_bound, remaining = None, None, []
+    for term in re.split(r"\s+AND\s+", filter_expression.strip(), flags=re.IGNORECASE):
+        match = _DISTANCE_TERM.match(term.strip())
+        if match is None:
+            remaining.append(term)
+        elif match.group(1).startswith("<"):
+            upper_bound = float(match.group(2))
+        else:
+            lower_bound = float(match.group(2))
+    return lower_bound, upper_bound, " AND ".join(remaining) or None
+
+
+def estimate_table_bytes(table, vector_column: str = "vector") -> int:
+    """
+    估算一个表在检索时常驻内存的大小：行数 ×（向量字节数 + 其他字段的粗略估计）。
+    """
+    try:
+        dim = table.schema.field(vector_column).type.list_size
+    except KeyError:
+        dim = 0
+    return table.count_rows() * (max(dim, 0) * 4 + 256)
+
+
+class TableHandleCache:
+    def __init__(self, budget_bytes: int):
+        """
+        已打开表句柄的 LRU 缓存，同一进程内的多个知识库共享。
+        表句柄会按 read_consistency_interval 自动检查并加载新提交的版本，所以可以放心复用；
+        所有表估算的内存之和超过预算时，淘汰最久未使用的表。
+        :param budget_bytes: 内存预算（字节）
+        """
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()  # (db_path, table_name) -> (table, 估算字节数)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, db_path: str, table_name: str, open_func):
+        """
+        获取表句柄，没有缓存时调用 open_func 打开。
+        """
+        key = (db_path, table_name)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+        table = open_func()
+        self.put(db_path, table_name, table)
+        with self.lock:
+            self.misses += 1
+        return table
+
+    def put(self, db_path: str, table_name: str, table):
+        """
+        放入表句柄，并按内存预算淘汰最久未使用的表（至少保留刚放入的表）。
+        """
+        key = (db_path, table_name)
+        size = estimate_table_bytes(table)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (table, size)
+            self.total_bytes += size
+            while self.total_bytes > self.budget_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, db_path: str, table_name: str):
+        """
+        删除表时移除对应的句柄。
+        """
+        with self.lock:
+            entry = self.entries.pop((db_path, table_name), None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"tables": [f"{db_path}/{table_name}" for db_path, table_name in self.entries],
+                    "total_mb": self.total_bytes / 1024 / 1024,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+table_cache = TableHandleCache(parameters.lancedb_cache_budget_mb * 1024 * 1024)
+
+
 class LanceDBManager:
     def __init__(self, db_path: str=parameters.LanceDB_path):
         """
@@ -13,14 +146,27 @@ class LanceDBManager:
         :param db_path: 数据库存储路径。
         """
         self.db_path = db_path
-        self.db = lancedb.connect(db_path)
+        self.db = lancedb.connect(db_path, read_consistency_interval=timedelta(seconds=parameters.lancedb_refresh_interval))
+
+    def open_table(self, table_name: str):
+        """
+        获取表句柄，优先复用缓存中已打开的表。
+        """
+        return table_cache.get(self.db_path, table_name, lambda: self.db.open_table(table_name))
+
+    def table_version(self, table_name: str) -> int:
+        """
+        表当前的版本号，每次写入都会产生新版本。
+        """
+        return self.open_table(table_name).version
 
-    def create_table(self, table_name: str, data, vector_column: str = "vector"):
+    def create_table(self, table_name: str, data, vector_column: str = "vector", hash_column: str = "content_hash"):
         """
         创建一个新的表并插入初始数据。
         :param table_name: 表名。
         :param data: 包含数据的列表，每个元素是一个字典。
         :param vector_column: 存储向量的列名，默认为 "vector"。
+        :param hash_column: 内容hash列名，用于插入时去重，数据中没有时自动计算。
         """
         # 检查表是否已经存在
         if table_name in self.db.table_names():
@@ -36,67 +182,79 @@ class LanceDBManager:
         # 检查是否包含向量列
         if vector_column not in df.columns:
             raise ValueError(f"数据中缺少向量列：{vector_column}")
+        if hash_column not in df.columns:
+            df = add_content_hash(df, hash_column=hash_column, vector_column=vector_column)
         
-        # 创建表
-        self.db.create_table(table_name, data=df)
+        # 创建表，并在hash列上建立标量索引
+        table = self.db.create_table(table_name, data=df)
+        self.ensure_scalar_index(table, hash_column)
+        table_cache.put(self.db_path, table_name, table)
         return False
 
-    def insert_data(self, table_name: str, data: List[Dict], unique_key: str = None):
+    def ensure_scalar_index(self, table, column: str):
+        """
+        确保列上存在标量索引，已存在时不重建。
+        :param table: lancedb 表。
+        :param column: 列名。
+        """
+        try:
+            if any(column in index.columns for index in table.list_indices()):
+                return
+        except AttributeError:
+            pass
+        try:
+            table.create_scalar_index(column, replace=False)
+        except Exception as e:
+            print(f"列 '{column}' 的标量索引未创建：{e}")
+
+    def insert_data(self, table_name: str, data: List[Dict], unique_key: str = None, vector_column: str = "vector"):
         """
         向现有表中插入新数据，并确保数据不重复。
+        通过唯一键上的标量索引做 merge insert，只有新数据的规模影响耗时，不需要读出整张表。
         :param table_name: 表名。
         :param data: 包含数据的列表，每个元素是一个字典。
-        :param unique_key: 唯一标识符字段名（如 'id'）。如果为 None，则基于所有字段去重。
+        :param unique_key: 唯一标识符字段名（如 'id'）。如果为 None，则基于所有非向量字段的内容hash去重。
+        :param vector_column: 存储向量的列名，默认为 "vector"。
         """
         # 打开表
-        table = self.db.open_table(table_name)
-        
-        # 获取当前表中的所有数据
-        existing_data = table.to_pandas()
+        table = self.open_table(table_name)
         
         # 转换为 Pandas DataFrame
         new_df = pd.DataFrame(data)
         
+        # 表中有内容hash列时总是计算，按 id 等其他唯一键写入的行也不会留下空的hash
+        hash_column = "content_hash"
+        if hash_column in table.schema.names and hash_column not in new_df.columns:
+            new_df = add_content_hash(new_df, hash_column=hash_column, vector_column=vector_column)
+
         # 根据 unique_key 去重
         if unique_key:
             # 确保 unique_key 存在于新数据中
             if unique_key not in new_df.columns:
                 raise ValueError(f"新数据中缺少唯一标识符字段：{unique_key}")
-            
-            # 过滤掉已经存在的数据
-            existing_keys = existing_data[unique_key].tolist()
-            filtered_data = new_df[~new_df[unique_key].isin(existing_keys)]
         else:
-            # 如果没有 unique_key，则基于所有字段去重
-            # 1. 排除不可哈希列（如向量列）
-            hashable_columns = [col for col in new_df.columns if not isinstance(new_df[col].iloc[0], (list, np.ndarray))]
-            
-            # 2. 标准化数据（去除空格、统一大小写等）
-            def standardize_value(value):
-                if isinstance(value, str):
-                    return value.strip().lower()  # 统一大小写并去除空格
-                return value
-            
-            existing_data[hashable_columns] = existing_data[hashable_columns].applymap(standardize_value)
-            new_df[hashable_columns] = new_df[hashable_columns].applymap(standardize_value)
-            
-            # 3. 使用 merge 判断重复数据
-            merged_data = pd.merge(
-                existing_data[hashable_columns],
-                new_df[hashable_columns],
-                how="outer",
-                indicator=True
-            )
-            filtered_data = new_df[merged_data["_merge"] == "right_only"]
-        
-        # 如果过滤后的数据为空，则无需插入
-        if filtered_data.empty:
+            # 如果没有 unique_key，则基于所有非向量字段的内容hash去重
+            unique_key = hash_column
+            if unique_key not in new_df.columns:
+                new_df = add_content_hash(new_df, hash_column=unique_key, vector_column=vector_column)
+        if unique_key not in table.schema.names:
+            raise ValueError(f"表 '{table_name}' 中缺少去重字段：{unique_key}，请重建表")
+        new_df = new_df.drop_duplicates(subset=unique_key)
+        
+        # 如果新数据为空，则无需插入
+        if new_df.empty:
             print("没有新增数据，跳过插入。")
             return
         
-        # 插入过滤后的数据
-        table.add(filtered_data)
-        print(f"成功插入 {len(filtered_data)} 条新数据。")
+        # 只插入唯一键不存在的数据
+        self.ensure_scalar_index(table, unique_key)
+        before_count = table.count_rows()
+        table.merge_insert(unique_key).when_not_matched_insert_all().execute(new_df)
+        inserted_count = table.count_rows() - before_count
+        if inserted_count == 0:
+            print("没有新增数据，跳过插入。")
+        else:
+            print(f"成功插入 {inserted_count} 条新数据。")
 
     # def search_vectors(self, table_name: str, query_vector: List[float], limit: int = 5) -> pd.DataFrame:
     #     """
@@ -121,7 +279,9 @@ class LanceDBManager:
         filter_expression: str = None,
         metric: str = "L2",
         include_metadata: bool = True,
-        offset: int = 0
+        offset: int = 0,
+        nprobes: int = None,
+        refine_factor: int = None
     ) -> pd.DataFrame:
         """
         在表中执行向量搜索。
@@ -129,22 +289,18 @@ class LanceDBManager:
         :param query_vector: 查询向量。
         :param limit: 返回结果的数量限制。
         :param filter_expression: 过滤条件（SQL-like 表达式），例如 "category = 'A'" 或 "price > 100"。
-        :param metric: 搜索使用的距离度量方法，默认为 "cosine"（余弦相似度）。其他选项包括 "l2"（欧氏距离）。Valid values are "L2", "cosine", or "dot".
+        :param metric: 搜索使用的距离度量方法，默认为 "L2"（欧氏距离的平方）。其他选项包括 "cosine"（1 - 余弦相似度）与 "dot"（1 - 内积）。Valid values are "L2", "cosine", or "dot".
         :param include_metadata: 是否包含元数据（非向量字段）在结果中，默认为 True。
         :param offset: 分页偏移量，用于跳过前 N 条结果。
+        :param nprobes: 有向量索引时探查的分区数，None 使用默认值。
+        :param refine_factor: 用原始向量精排的候选倍数，None 不精排。
         :return: 包含搜索结果的 Pandas DataFrame。
         """
-        # 打开表
-        table = self.db.open_table(table_name)
-        # table.create_index(metric=metric, num_partitions=2, num_sub_vectors=2)
-        # table.create_index(metric=metric)
+        # 打开表，向量索引由 VectorIndexManager 管理
+        table = self.open_table(table_name)
         
         # 构建搜索查询
-        search_query = table.search(query_vector, vector_column_name="vector", query_type="vector").limit(limit).offset(offset)
-        
-        # 如果有过滤条件，添加到查询中
-        if filter_expression:
-            search_query = search_query.where(filter_expression)
+        search_query = self._build_query(table, query_vector, limit, filter_expression, nprobes, refine_factor, metric).offset(offset)
         
         # 执行搜索并获取结果
         results = search_query.to_pandas()
@@ -155,6 +311,84 @@ class LanceDBManager:
         
         return results
 
+    @staticmethod
+    def _build_query(table, query_vector, limit: int, filter_expression: str = None, nprobes: int = None, refine_factor: int = None,
+                     metric: str = None):
+        """
+        构建向量检索查询，query_vector 可以是一个向量，也可以是 (N, d) 的多个向量。
+        metric 为 "L2"、"cosine" 或 "dot"，有向量索引时需与建索引时一致。
+        """
+        search_query = table.search(query_vector, vector_column_name="vector", query_type="vector").limit(limit)
+        if metric is not None:
+            search_query = search_query.distance_type(metric.lower())
+        if nprobes is not None:
+            search_query = search_query.nprobes(nprobes)
+        if refine_factor is not None:
+            search_query = search_query.refine_factor(refine_factor)
+        
+        # 如果有过滤条件，添加到查询中：_distance 条件转为距离范围，其余条件预过滤
+        lower_bound, upper_bound, filter_expression = split_distance_filter(filter_expression)
+        if lower_bound is not None or upper_bound is not None:
+            search_query = search_query.distance_range(lower_bound=lower_bound, upper_bound=upper_bound)
+        if filter_expression:
+            search_query = search_query.where(filter_expression, prefilter=True)
+        return search_query
+
+    def batch_search_vectors(
+        self,
+        table_name: str,
+        query_vectors: np.ndarray,
+        limit: int = 5,
+        filter_expression: str = None,
+        columns: List[str] = ("id", "text"),
+        metric: str = "L2",
+        nprobes: int = None,
+        refine_factor: int = None,
+        batch_size: int = parameters.batch_search_size,
+        workers: int = parameters.batch_search_workers
+    ) -> pa.Table:
+        """
+        一次检索多个查询向量。每 batch_size 个向量组成一个多向量查询，只打开表、规划查询一次，
+        多个批次在有上限的线程池中并行执行。
+        :param table_name: 表名。
+        :param query_vectors: (N, d) 的查询向量。
+        :param limit: 每个查询返回的结果数量。
+        :param filter_expression: 过滤条件，对所有查询生效。
+        :param columns: 返回的列，不读取向量列可以减少数据拷贝。
+        :param metric: 距离度量："L2"、"cosine" 或 "dot"。
+        :param nprobes: 有向量索引时探查的分区数，None 使用默认值。
+        :param refine_factor: 用原始向量精排的候选倍数，None 不精排。
+        :param batch_size: 每个多向量查询包含的向量数。
+        :param workers: 并行执行的批次数上限。
+        :return: pyarrow.Table，列为 query_index、columns 与 _distance，按 (query_index, _distance) 排序。
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if query_vectors.ndim == 1:
+            query_vectors = query_vectors.reshape(1, -1)
+        table = self.open_table(table_name)
+        columns = list(columns)
+
+        def run(start):
+            batch = query_vectors[start:start + batch_size]
+            search_query = self._build_query(table, batch, limit, filter_expression, nprobes, refine_factor, metric)
+            result = search_query.select(columns + ["_distance"]).to_arrow()
+            if "query_index" not in result.column_names:  # 只有一个向量时不返回 query_index
+                result = result.add_column(0, "query_index", pa.array(np.zeros(result.num_rows, dtype=np.int32)))
+            index_position = result.column_names.index("query_index")
+            query_index = pc.add(result.column("query_index"), pa.scalar(start, pa.int32()))
+            return result.set_column(index_position, "query_index", query_index)
+
+        starts = range(0, len(query_vectors), batch_size)
+        if len(starts) > 1 and workers > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as executor:
+                results = list(executor.map(run, starts))
+        else:
+            results = [run(start) for start in starts]
+        if not results:
+            return pa.table({"query_index": pa.array([], pa.int32())})
+        results = pa.concat_tables(results)
+        return results.select(["query_index", *columns, "_distance"]).sort_by([("query_index", "ascending"), ("_distance", "ascending")])
+
     def get_all_data(self, table_name: str) -> pd.DataFrame:
         """
         获取表中的所有数据。
@@ -162,7 +396,7 @@ class LanceDBManager:
         :return: 包含所有数据的 Pandas DataFrame。
         """
         # 打开表
-        table = self.db.open_table(table_name)
+        table = self.open_table(table_name)
         
         # 获取所有数据
         return table.to_pandas()
@@ -173,10 +407,11 @@ class LanceDBManager:
         :param condition: 删除条件（SQL-like 表达式）。
         """
         # 打开表
-        table = self.db.open_table(table_name)
+        table = self.open_table(table_name)
         
-        # 执行删除操作
-        deleted_count = table.delete(condition)
+        # 执行删除操作，table.delete 不返回删除条数，先统计
+        deleted_count = table.count_rows(condition)
+        table.delete(condition)
         
         if deleted_count > 0:
             print(f"成功删除 {deleted_count} 条数据。")
@@ -190,6 +425,7 @@ class LanceDBManager:
         """
         # 删除表
         self.db.drop_table(table_name)
+        table_cache.invalidate(self.db_path, table_name)
 
 # 示例用法
 if __name__ == "__main__":
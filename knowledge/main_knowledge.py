@@ -1,35 +1,133 @@
 # 通过将知识数据库中的文本进行行量化，完成向量数据局的建立，第一个版本使用的faiss数据库，感觉不是很好，这个版本使用lancedb
 # lancedb也可以实现GPU的加速搜索，并且lancedb可以在同一行中存储文本、图片、向量等多种数据类型，非常方便，最主要的是开源
 # 这里主要实现：从关系型数据库中读出知识库中的文本，然后进行行量化，最后存储到lancedb中
+# 向量库中的id与关系型数据库中的chunk id一致，已有向量表时按变更日志增量同步
 from .lancedb import LanceDBManager
+from .vector_index import VectorIndexManager
+from .mmap_index import MmapVectorIndex
+from .quantization import QuantizedVectorIndex
+from .sharding import ShardedLanceDB
 from data_handle.text_dataset import DatabaseManager
+from data_handle.change_log import ChunkChangeLog
 from .embedding import EmbeddingSourceDate
 from config.config import parameters
 import pandas as pd
+import os
 
-def mainKnowledge():
-    # 读取数据库中的文本
-    textDB = DatabaseManager()
-    # all_texts = textDB.fetch_all(table_name=parameters.sql_table_name)
-    all_texts = textDB.fetch_column(table_name=parameters.sql_table_name, column_name="content")
-    textDB.close()
+def sync_table(textDB, change_log, db_manager, emManager, sql_table: str, lance_table: str, extra_columns=(), sharded=None):
+    """
+    把一张切分表同步到向量表：已有同步记录时按变更日志增量同步，否则全量构建。
+    :param textDB: DatabaseManager 实例
+    :param change_log: ChunkChangeLog 实例
+    :param db_manager: LanceDBManager 实例
+    :param emManager: EmbeddingSourceDate 实例，None 时在需要编码时创建
+    :param sql_table: 切分表名
+    :param lance_table: 向量表名
+    :param extra_columns: 除 id、content 外一并写入向量表的列，例如句子的 paragraph_id
+    :param sharded: ShardedLanceDB 实例，不为 None 时按分区器写入各分片表
+    :return: (本次写入的条数, emManager)
+    """
+    if sharded is not None:
+        consumer = sharded.consumer
+        table_exists = sharded.exists()
+        missing_columns = table_exists and not sharded.has_columns(extra_columns)
+    else:
+        consumer = f"{db_manager.db_path}/{lance_table}"
+        table_exists = lance_table in db_manager.db.table_names()
+        missing_columns = table_exists and any(col not in db_manager.open_table(lance_table).schema.names for col in extra_columns)
+    columns = ", ".join(["id", "content", *extra_columns])
 
-    # 将文本进行行量化
-    emManager = EmbeddingSourceDate(embedding_model=parameters.use_embedding_model)
-    embedding_list = emManager.embedding_single(all_texts)
+    if table_exists and not missing_columns and change_log.get_cursor(consumer) is not None:
+        # 增量同步：只处理变更日志中新增与删除的chunk
+        added_ids, deleted_ids, last_id = change_log.fetch_changes(sql_table, consumer)
+        print(f"{lance_table}：新增chunk {len(added_ids)}个，删除chunk {len(deleted_ids)}个")
+        for start in range(0, len(deleted_ids), 1000):
+            id_text = ", ".join(str(i) for i in deleted_ids[start:start + 1000])
+            if sharded is not None:
+                sharded.delete_data(f"id IN ({id_text})")
+            else:
+                db_manager.delete_data(lance_table, f"id IN ({id_text})")
+        rows = textDB.fetch_by_id(sql_table, added_ids, columns=columns) if added_ids else []
+    else:
+        # 全量构建：读取数据库中的所有文本，没有同步记录或缺少列的旧向量表直接重建
+        if table_exists:
+            print(f"向量表 '{lance_table}' 没有同步记录或缺少列{list(extra_columns)}，重新构建")
+            if sharded is not None:
+                sharded.drop()
+            else:
+                db_manager.delete_table(lance_table)
+        last_id = change_log.last_id()
+        rows = textDB.fetch_all(table_name=sql_table, columns=columns)
 
-    # 将行量化后的向量存储到lancedb中
-    db_manager = LanceDBManager(parameters.LanceDB_path)
-    id_list = [i for i in range(len(all_texts))]
-    print("text的长度：", len(all_texts))
-    print("embedding的长度：", len(embedding_list))
-    print("id的长度：", len(id_list))
-    # 数据存储{"id": 1, "text": "Hello world", "vector": [0.1, 0.2, 0.3, 0.9]},
-    data = pd.DataFrame({"id": id_list, "text": all_texts, "vector": embedding_list.tolist()})
-    print(data)
-    if db_manager.create_table(parameters.LanceDB_table_name, data):
-        db_manager.insert_data(parameters.LanceDB_table_name, data)
+    if rows:
+        id_list = [row[0] for row in rows]
+        all_texts = [row[1] for row in rows]
+
+        # 将文本进行行量化
+        if emManager is None:
+            emManager = EmbeddingSourceDate(embedding_model=parameters.use_embedding_model)
+        embedding_list = emManager.embedding(all_texts)
+
+        # 将行量化后的向量存储到lancedb中
+        print("text的长度：", len(all_texts))
+        print("embedding的长度：", len(embedding_list))
+        print("id的长度：", len(id_list))
+        # 数据存储{"id": 1, "text": "Hello world", "vector": [0.1, 0.2, 0.3, 0.9]},
+        data = pd.DataFrame({"id": id_list, "text": all_texts, "vector": embedding_list.tolist()})
+        for i, col in enumerate(extra_columns):
+            data[col] = pd.array([row[2 + i] for row in rows], dtype="Int64")
+        print(data)
+        if sharded is not None:
+            # 各分片表的标量索引在 write 中建立
+            sharded.write(data, unique_key="id", scalar_columns=extra_columns)
+        else:
+            if db_manager.create_table(lance_table, data):
+                db_manager.insert_data(lance_table, data, unique_key="id")
+            # 分层检索按父段落 id 预过滤，需要标量索引
+            for col in extra_columns:
+                db_manager.ensure_scalar_index(db_manager.open_table(lance_table), col)
 
+    change_log.set_cursor(consumer, last_id)
+    print(f"向量表 '{lance_table}' 同步完成✅，本次写入{len(rows)}条")
+    return len(rows), emManager
 
 
+def mainKnowledge():
+    textDB = DatabaseManager()
+    change_log = ChunkChangeLog(textDB)
+    db_manager = LanceDBManager(parameters.LanceDB_path)
+
+    # 句子表，分割段落时同时同步段落表，用于分层检索
+    tables = [(parameters.sql_table_name, parameters.LanceDB_table_name, ("paragraph_id",))]
+    if parameters.is_split_paragraph:
+        tables.append((parameters.sql_paragraph_table_name, parameters.LanceDB_paragraph_table_name, ()))
+    # 句子表分片时按分区器写入各分片，分区依据的列一并写入
+    sharded = ShardedLanceDB(parameters.LanceDB_table_name) if parameters.shard_num > 1 else None
+    emManager = None
+    for sql_table, lance_table, extra_columns in tables:
+        table_shards = sharded if sharded is not None and lance_table == sharded.table_name else None
+        if table_shards is not None:
+            extra_columns = tuple(col for col in dict.fromkeys([*extra_columns, sharded.partitioner.column]) if col != "id")
+        _, emManager = sync_table(textDB, change_log, db_manager, emManager, sql_table, lance_table, extra_columns, table_shards)
+    textDB.close()
+
+    # 分片表在各自的目录中建立向量索引，不导出 mmap
+    if sharded is not None:
+        tables = [table for table in tables if table[1] != sharded.table_name]
+        for shard_manager, shard_table in sharded.existing_shards():
+            index_status = VectorIndexManager(shard_manager).ensure_index(shard_table)
+            print(f"{shard_table} 向量索引状态：", index_status)
 
+    # 行数达到阈值后自动建立或重建向量索引
+    for _, lance_table, _ in tables:
+        index_status = VectorIndexManager(db_manager).ensure_index(lance_table)
+        print(f"{lance_table} 向量索引状态：", index_status)
+        # mmap 检索后端：在表的最终版本上导出内存映射矩阵
+        if parameters.search_backend == "mmap":
+            index_path = os.path.join(parameters.mmap_index_path, lance_table)
+            MmapVectorIndex.export(db_manager, lance_table, index_path)
+            # 量化编码：报告各种编码节省的内存与 recall@k
+            if parameters.quantization != "none":
+                QuantizedVectorIndex.build(index_path)
+                if parameters.quant_keep_full:
+                    QuantizedVectorIndex(index_path).report()
@@ -0,0 +1,175 @@
+# 内存映射的精确检索：把 LanceDB 表中的向量导出为 float32 矩阵文件，检索时用 BLAS 矩阵乘法 + argpartition 求 top-k
+# 适合几百万条以内的知识库，省去 LanceDB 每次查询的规划与 pandas 转换；mmap 加载只需毫秒级，多个进程共享页缓存
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from config.config import parameters
+
+METRICS = ("l2", "cosine", "dot")
+
+
+class MmapVectorIndex:
+    def __init__(self, index_path: str, block_rows: int = parameters.mmap_block_rows):
+        """
+        加载已导出的索引，文件以只读方式映射到内存。
+        文件：vectors.f32（N×d 原始向量）、norms.f32（向量模长）、ids.npy、texts.bin（utf-8 拼接的文本）、text_offsets.npy、meta.json
+        量化索引可以删除 vectors.f32 只保留编码，此时 self.vectors 为 None
+        :param index_path: 索引目录
+        :param block_rows: 每次参与矩阵乘法的行数，限制 (查询数 × block_rows) 的中间结果大小
+        """
+        start_time = time.time()
+        self.index_path = index_path
+        self.block_rows = block_rows
+        with open(os.path.join(index_path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        vectors_path = os.path.join(index_path, "vectors.f32")
+        if self.count:
+            self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)) if os.path.exists(vectors_path) else None
+            self.norms = np.memmap(os.path.join(index_path, "norms.f32"), dtype=np.float32, mode="r", shape=(self.count,))
+            self.texts = np.memmap(os.path.join(index_path, "texts.bin"), dtype=np.uint8, mode="r")
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.norms = np.zeros(0, dtype=np.float32)
+            self.texts = np.zeros(0, dtype=np.uint8)
+        self.ids = np.load(os.path.join(index_path, "ids.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(index_path, "text_offsets.npy"), mmap_mode="r")
+        self.load_time = time.time() - start_time
+
+    @staticmethod
+    def export(db_manager, table_name: str, index_path: str, vector_column: str = "vector", batch_size: int = 65536):
+        """
+        把 LanceDB 表导出为内存映射文件，分批读取，内存占用与表大小无关。
+        :param db_manager: LanceDBManager 实例
+        :param table_name: 表名
+        :param index_path: 索引目录，已存在的文件会被覆盖
+        :return: meta 字典
+        """
+        start_time = time.time()
+        os.makedirs(index_path, exist_ok=True)
+        table = db_manager.open_table(table_name)
+        version = table.version
+        count = table.count_rows()
+        dim = table.schema.field(vector_column).type.list_size
+
+        # 先写临时文件，全部完成后再替换，避免检索进程读到写了一半的文件
+        paths = {name: os.path.join(index_path, name + ".tmp") for name in ("vectors.f32", "norms.f32", "texts.bin", "ids.npy", "text_offsets.npy")}
+        vectors = np.memmap(paths["vectors.f32"], dtype=np.float32, mode="w+", shape=(max(count, 1), dim))
+        norms = np.memmap(paths["norms.f32"], dtype=np.float32, mode="w+", shape=(max(count, 1),))
+        ids = np.zeros(count, dtype=np.int64)
+        text_offsets = np.zeros(count + 1, dtype=np.int64)
+        row = 0
+        with open(paths["texts.bin"], "wb") as text_file:
+            batches = table.search().select(["id", "text", vector_column]).limit(max(count, 1)).to_batches(batch_size)
+            for batch in batches:
+                n = min(batch.num_rows, count - row)
+                if n <= 0:
+                    break
+                block = batch.column(vector_column).flatten().to_numpy(zero_copy_only=False).astype(np.float32).reshape(-1, dim)[:n]
+                vectors[row:row + n] = block
+                norms[row:row + n] = np.linalg.norm(block, axis=1)
+                ids[row:row + n] = batch.column("id").to_numpy(zero_copy_only=False)[:n]
+                for text in batch.column("text").to_pylist()[:n]:
+                    data = (text or "").encode("utf-8")
+                    text_file.write(data)
+                    row += 1
+                    text_offsets[row] = text_offsets[row - 1] + len(data)
+        vectors.flush()
+        norms.flush()
+        del vectors, norms
+        count = row
+        with open(paths["ids.npy"], "wb") as f:
+            np.save(f, ids[:count])
+        with open(paths["text_offsets.npy"], "wb") as f:
+            np.save(f, text_offsets[:count + 1])
+        for name, path in paths.items():
+            os.replace(path, os.path.join(index_path, name))
+
+        meta = {"table_name": table_name, "table_version": version, "count": count, "dim": dim,
+                "db_path": db_manager.db_path, "export_time": time.time()}
+        # meta.json 同样先写临时文件再替换，读取方不会看到写了一半的元数据
+        meta_tmp = os.path.join(index_path, "meta.json.tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_tmp, os.path.join(index_path, "meta.json"))
+        size_mb = count * dim * 4 / 1024 / 1024
+        print(f"表 '{table_name}' 导出为内存映射索引✅ {count}行，{dim}维，向量{size_mb:.1f}MB，耗时{time.time() - start_time:.2f}s")
+        return meta
+
+    def text(self, row: int) -> str:
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def _distances(self, queries, query_norms, start, end, metric):
+        """
+        一个行块上的距离，与 LanceDB 的约定一致：l2 为欧氏距离的平方，cosine 为 1 - 余弦相似度，dot 为 1 - 内积。
+        """
+        scores = queries @ self.vectors[start:end].T  # (n, block) 的内积，由 BLAS 计算
+        if metric == "l2":
+            return query_norms[:, None] ** 2 - 2 * scores + self.norms[start:end][None, :] ** 2
+        if metric == "cosine":
+            return 1 - scores / np.maximum(query_norms[:, None] * self.norms[start:end][None, :], 1e-12)
+        return 1 - scores
+
+    def search_rows(self, query_vectors, topk: int, metric: str = "l2"):
+        """
+        精确 top-k 检索，按行块计算距离，每块用 argpartition 只保留 topk 个候选再与之前的候选合并。
+        :param query_vectors: (n, d) 或 (d,) 的查询向量
+        :param topk: 每个查询返回的条数
+        :param metric: "l2"、"cosine" 或 "dot"
+        :return: (rows, distances)，形状均为 (n, k)，k = min(topk, 行数)，按距离从小到大排列
+        """
+        metric = metric.lower()
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric}. Please choose 'L2', 'cosine' or 'dot'.")
+        if self.vectors is None:
+            raise ValueError(f"索引 '{self.index_path}' 没有导出原始向量（quant_keep_full=False），只能以量化索引加载")
+        queries = np.ascontiguousarray(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        query_norms = np.linalg.norm(queries, axis=1)
+        k = min(topk, self.count)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, self.block_rows):
+            end = min(start + self.block_rows, self.count)
+            distances = self._distances(queries, query_norms, start, end, metric)
+            if end - start > k:
+                part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(end - start), (len(queries), end - start))
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+            best_distances = np.concatenate([best_distances, np.take_along_axis(distances, part, axis=1)], axis=1)
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(best_distances, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_distances = np.take_along_axis(best_distances, keep, axis=1)
+        order = np.argsort(best_distances, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+    def search(self, query_vector, topk: int, metric: str = "l2", lower_bound: float = None, upper_bound: float = None) -> pd.DataFrame:
+        """
+        单个查询，返回与 LanceDBManager.search_vectors 相同的 id、text、_distance 列。
+        :param lower_bound: 距离下限（含），对应过滤条件 _distance >= x
+        :param upper_bound: 距离上限（不含），对应过滤条件 _distance < x
+        """
+        results = self.batch_search(query_vector, topk, metric, lower_bound, upper_bound)
+        return results.drop(columns="query_index")
+
+    def batch_search(self, query_vectors, topk: int, metric: str = "l2", lower_bound: float = None, upper_bound: float = None) -> pd.DataFrame:
+        """
+        多个查询，返回 query_index、id、text、_distance 列，按 (query_index, _distance) 排序。
+        """
+        rows, distances = self.search_rows(query_vectors, topk, metric)
+        query_index = np.repeat(np.arange(rows.shape[0], dtype=np.int32), rows.shape[1])
+        rows, distances = rows.reshape(-1), distances.reshape(-1)
+        mask = np.ones(len(rows), dtype=bool)
+        if lower_bound is not None:
+            mask &= distances >= lower_bound
+        if upper_bound is not None:
+            mask &= distances < upper_bound
+        rows = rows[mask]
+        return pd.DataFrame({"query_index": query_index[mask],
+                             "id": np.asarray(self.ids[rows]),
+                             "text": [self.text(row) for row in rows],
+                             "_distance": distances[mask]})
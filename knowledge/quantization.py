@@ -0,0 +1,204 @@
+# 量化向量索引：在内存映射索引的目录中增加 int8 标量量化编码与 1 bit 二值编码
+# 检索时先在编码上快速筛选 topk*rescore_factor 个候选，再用原始向量（已删除时用 int8 编码）对候选精排
+import os
+import json
+import time
+import numpy as np
+from config.config import parameters
+from .mmap_index import MmapVectorIndex
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(codes: np.ndarray) -> np.ndarray:
+    """
+    逐字节统计 1 的个数，numpy 2.0 起使用 bitwise_count。
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+
+class QuantizedVectorIndex(MmapVectorIndex):
+    def __init__(self, index_path: str, mode: str = parameters.quantization,
+                 rescore_factor: int = parameters.quant_rescore_factor, block_rows: int = parameters.quant_block_rows):
+        """
+        :param index_path: 内存映射索引目录，需已执行 build
+        :param mode: 第一轮筛选使用的编码："int8" 或 "binary"
+        :param rescore_factor: 第一轮保留 topk*rescore_factor 个候选用于精排
+        :param block_rows: 每次计算的行数，int8 编码需转换为 float32 参与矩阵乘法，块比 mmap_block_rows 小
+        """
+        super().__init__(index_path, block_rows)
+        if mode not in ("int8", "binary"):
+            raise ValueError("Unsupported quantization. Please choose 'int8' or 'binary'.")
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        with open(os.path.join(index_path, "quant.json"), "r", encoding="utf-8") as f:
+            quant = json.load(f)
+        self.lower = np.asarray(quant["lower"], dtype=np.float32)
+        self.step = np.asarray(quant["step"], dtype=np.float32)
+        self.thresholds = np.asarray(quant["thresholds"], dtype=np.float32)
+        self.int8_codes = np.memmap(os.path.join(index_path, "int8.codes"), dtype=np.int8, mode="r", shape=(self.count, self.dim))
+        self.binary_codes = np.memmap(os.path.join(index_path, "binary.codes"), dtype=np.uint8, mode="r", shape=(self.count, (self.dim + 7) // 8))
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        return os.path.exists(os.path.join(index_path, "quant.json"))
+
+    @staticmethod
+    def build(index_path: str, keep_full: bool = parameters.quant_keep_full, block_rows: int = parameters.quant_block_rows):
+        """
+        由内存映射索引中的原始向量生成量化编码，分块处理。
+        int8：每个维度按最小值与最大值线性映射到 [-128, 127]；binary：每个维度大于该维均值记为 1，按位打包。
+        :param index_path: 内存映射索引目录
+        :param keep_full: 是否保留 float32 原始向量，不保留时精排使用 int8 编码，磁盘与内存只剩编码
+        :param block_rows: 每次处理的行数
+        :return: 各种表示占用的字节数
+        """
+        start_time = time.time()
+        index = MmapVectorIndex(index_path, block_rows)
+        if index.vectors is None:
+            raise ValueError(f"{index_path} 中没有原始向量，请重新导出")
+        count, dim = index.count, index.dim
+        lower = np.full(dim, np.inf, dtype=np.float32)
+        upper = np.full(dim, -np.inf, dtype=np.float32)
+        total = np.zeros(dim, dtype=np.float64)
+        for start in range(0, count, block_rows):
+            block = np.asarray(index.vectors[start:start + block_rows])
+            lower = np.minimum(lower, block.min(axis=0))
+            upper = np.maximum(upper, block.max(axis=0))
+            total += block.sum(axis=0)
+        if count == 0:
+            lower, upper = np.zeros(dim, dtype=np.float32), np.ones(dim, dtype=np.float32)
+        step = np.maximum(upper - lower, 1e-12) / 255
+        thresholds = (total / max(count, 1)).astype(np.float32)
+
+        int8_codes = np.memmap(os.path.join(index_path, "int8.codes.tmp"), dtype=np.int8, mode="w+", shape=(max(count, 1), dim))
+        binary_codes = np.memmap(os.path.join(index_path, "binary.codes.tmp"), dtype=np.uint8, mode="w+", shape=(max(count, 1), (dim + 7) // 8))
+        for start in range(0, count, block_rows):
+            block = np.asarray(index.vectors[start:start + block_rows])
+            int8_codes[start:start + len(block)] = (np.clip(np.rint((block - lower) / step), 0, 255) - 128).astype(np.int8)
+            binary_codes[start:start + len(block)] = np.packbits(block > thresholds, axis=1)
+        int8_codes.flush()
+        binary_codes.flush()
+        del int8_codes, binary_codes, index
+        os.replace(os.path.join(index_path, "int8.codes.tmp"), os.path.join(index_path, "int8.codes"))
+        os.replace(os.path.join(index_path, "binary.codes.tmp"), os.path.join(index_path, "binary.codes"))
+        with open(os.path.join(index_path, "quant.json"), "w", encoding="utf-8") as f:
+            json.dump({"lower": lower.tolist(), "step": step.tolist(), "thresholds": thresholds.tolist()}, f)
+        if not keep_full:
+            os.remove(os.path.join(index_path, "vectors.f32"))
+
+        sizes = {"float32": count * dim * 4, "int8": count * dim, "binary": count * ((dim + 7) // 8)}
+        print(f"量化编码生成完成✅ {count}行，float32 {sizes['float32'] / 1024 / 1024:.1f}MB，"
+              f"int8 {sizes['int8'] / 1024 / 1024:.1f}MB，binary {sizes['binary'] / 1024 / 1024:.1f}MB，"
+              f"{'保留' if keep_full else '删除'}原始向量，耗时{time.time() - start_time:.2f}s")
+        return sizes
+
+    def _int8_distances(self, queries, query_norms, rows_or_slice, metric):
+        """
+        非对称距离：查询保持 float32，库中向量用 int8 编码近似，x ≈ lower + (code + 128) * step。
+        q·x = q·lower + 128 * (q*step)·1 + (q*step)·code，只需一次 float32 × int8 的矩阵乘法。
+        """
+        scaled = queries * self.step
+        offset = queries @ self.lower + 128 * scaled.sum(axis=1)
+        codes = np.asarray(self.int8_codes[rows_or_slice], dtype=np.float32)
+        norms = np.asarray(self.norms[rows_or_slice])
+        scores = (scaled @ codes.T if codes.ndim == 2 else scaled[:, None, :] @ codes.transpose(0, 2, 1))
+        scores = scores.reshape(len(queries), -1) + offset[:, None]
+        norms = norms.reshape(len(queries), -1) if norms.ndim == 2 else norms[None, :]
+        return self._scores_to_distances(scores, query_norms, norms, metric)
+
+    @staticmethod
+    def _scores_to_distances(scores, query_norms, norms, metric):
+        if metric == "l2":
+            return query_norms[:, None] ** 2 - 2 * scores + norms ** 2
+        if metric == "cosine":
+            return 1 - scores / np.maximum(query_norms[:, None] * norms, 1e-12)
+        return 1 - scores
+
+    def _candidates(self, queries, query_norms, num_candidates, metric):
+        """
+        第一轮：在编码上分块计算距离，每个查询保留 num_candidates 个候选行。
+        """
+        query_bits = np.packbits(queries > self.thresholds, axis=1) if self.mode == "binary" else None
+        if query_bits is not None and query_bits.shape[1] % 8 == 0:
+            query_bits = query_bits.view(np.uint64)  # 按 64 位整数异或与计数，减少运算次数
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, self.block_rows):
+            end = min(start + self.block_rows, self.count)
+            if self.mode == "binary":
+                codes = np.asarray(self.binary_codes[start:end]).view(query_bits.dtype)
+                distances = np.empty((len(queries), end - start), dtype=np.float32)
+                for i, bits in enumerate(query_bits):
+                    distances[i] = popcount(codes ^ bits).sum(axis=1, dtype=np.int32)
+            else:
+                distances = self._int8_distances(queries, query_norms, slice(start, end), metric)
+            if end - start > num_candidates:
+                part = np.argpartition(distances, num_candidates - 1, axis=1)[:, :num_candidates]
+            else:
+                part = np.broadcast_to(np.arange(end - start), (len(queries), end - start))
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+            best_distances = np.concatenate([best_distances, np.take_along_axis(distances, part, axis=1)], axis=1)
+            if best_rows.shape[1] > num_candidates:
+                keep = np.argpartition(best_distances, num_candidates - 1, axis=1)[:, :num_candidates]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_distances = np.take_along_axis(best_distances, keep, axis=1)
+        return best_rows
+
+    def search_rows(self, query_vectors, topk: int, metric: str = "l2", rescore: bool = True):
+        """
+        两阶段检索：编码上筛选候选，再对候选精排。有原始向量时精排为精确距离，否则为 int8 近似距离。
+        :param rescore: 为 False 时不精排，直接按第一轮的距离返回，用于评估
+        :return: (rows, distances)，形状均为 (n, k)
+        """
+        metric = metric.lower()
+        if metric not in ("l2", "cosine", "dot"):
+            raise ValueError(f"Unsupported metric {metric}. Please choose 'L2', 'cosine' or 'dot'.")
+        queries = np.ascontiguousarray(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        query_norms = np.linalg.norm(queries, axis=1)
+        k = min(topk, self.count)
+        num_candidates = min(self.count, k * (self.rescore_factor if rescore else 1))
+        rows = self._candidates(queries, query_norms, num_candidates, metric)
+        rows.sort(axis=1)  # 按行号顺序读取，mmap 的访问更连续
+        if self.vectors is not None:
+            candidates = np.asarray(self.vectors[rows.reshape(-1)]).reshape(len(queries), rows.shape[1], self.dim)
+            scores = np.einsum("nd,nkd->nk", queries, candidates)
+            distances = self._scores_to_distances(scores, query_norms, np.asarray(self.norms[rows]), metric)
+        else:
+            distances = self._int8_distances(queries, query_norms, rows, metric)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+    def report(self, topk: int = parameters.search_topk, num_queries: int = parameters.quant_report_queries, metric: str = parameters.ann_index_metric) -> dict:
+        """
+        用库中随机抽取的向量作为查询，对比各种编码相对精确检索的 recall@k 与占用的内存。
+        需要保留原始向量作为精确检索的基准。
+        """
+        if self.vectors is None:
+            raise ValueError("没有原始向量，无法计算 recall")
+        rng = np.random.default_rng(0)
+        sample = rng.choice(self.count, size=min(num_queries, self.count), replace=False)
+        queries = np.asarray(self.vectors[np.sort(sample)])
+        exact_rows, _ = MmapVectorIndex.search_rows(self, queries, topk, metric)
+        sizes = {"float32": self.count * self.dim * 4, "int8": self.count * self.dim, "binary": self.count * self.binary_codes.shape[1]}
+        report = {"float32": {"bytes": sizes["float32"], "recall": 1.0}}
+        mode = self.mode
+        try:
+            for self.mode in ("int8", "binary"):
+                for rescore in (False, True):
+                    start_time = time.time()
+                    rows, _ = self.search_rows(queries, topk, metric, rescore=rescore)
+                    elapsed = time.time() - start_time
+                    recall = np.mean([len(np.intersect1d(a, b)) / exact_rows.shape[1] for a, b in zip(rows, exact_rows)])
+                    name = f"{self.mode}+rescore" if rescore else self.mode
+                    report[name] = {"bytes": sizes[self.mode], "recall": float(recall), "ms_per_query": elapsed * 1000 / len(queries)}
+        finally:
+            self.mode = mode
+        print(f"量化评估（{len(queries)}个查询，recall@{topk}，精排候选 topk*{self.rescore_factor}）：")
+        for name, item in report.items():
+            saved = 1 - item["bytes"] / sizes["float32"]
+            print(f"  {name:<16} 内存{item['bytes'] / 1024 / 1024:8.1f}MB  节省{saved:6.1%}  recall {item['recall']:.3f}"
+                  + (f"  {item['ms_per_query']:.2f}ms/查询" if "ms_per_query" in item else ""))
+        return report
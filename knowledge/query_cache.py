@@ -0,0 +1,77 @@
+# 进程内的 LRU 缓存，带过期时间与容量上限，用于缓存问题的查询向量等
+import re
+import time
+import threading
+from collections import OrderedDict
+from .embedding_cache import normalize_text
+
+
+def normalize_query(question: str) -> str:
+    """
+    问题归一化：在 normalize_text 的基础上统一小写，并去掉末尾的标点，让只差标点、大小写、空格的问题命中同一条缓存。
+    """
+    return re.sub(r"[\s?？!！。.,，~～]+$", "", normalize_text(question).lower())
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 10000, ttl: float = None):
+        """
+        :param max_size: 最多缓存的条数，超出后淘汰最久未使用的
+        :param ttl: 过期时间（秒），None 表示不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()  # key -> (写入时间, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        读取缓存，过期的条目视为未命中并删除。
+        """
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self.data[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目。
+        """
+        with self.lock:
+            self.data[key] = (time.time(), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self) -> dict:
+        """
+        缓存的命中统计。
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "size": len(self.data),
+                "max_size": self.max_size}
@@ -0,0 +1,242 @@
+# 分片向量库：一个逻辑表按分区器拆成多个 LanceDB 表（可以在不同的目录中），检索时并行查询所有分片再按距离合并全局 top-k
+# 每个分片有独立的超时，慢分片不会拖住整个查询，只是这次结果中缺少它的数据
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from config.config import parameters
+from .lancedb import LanceDBManager
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 混合函数，把连续的整数 id 均匀打散。
+    """
+    with np.errstate(over="ignore"):
+        x = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+class Partitioner:
+    """
+    分区器基类：决定每一行写入哪个分片，自定义分区器继承并实现 assign。
+    column 为分区依据的切分表列，同步时会一并从切分表读出。
+    """
+    column = "id"
+
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+
+    def assign(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        :param data: 待写入的数据
+        :return: 每行的分片编号，取值 [0, num_shards)
+        """
+        raise NotImplementedError
+
+
+class HashPartitioner(Partitioner):
+    def __init__(self, num_shards: int, column: str = "id"):
+        """
+        按 chunk id 的 hash 分片，各分片行数均匀，同一个 id 总是落在同一个分片。
+        """
+        super().__init__(num_shards)
+        self.column = column
+
+    def assign(self, data: pd.DataFrame) -> np.ndarray:
+        return (mix64(data[self.column].to_numpy()) % np.uint64(self.num_shards)).astype(np.int64)
+
+
+class ColumnPartitioner(Partitioner):
+    def __init__(self, num_shards: int, column: str = parameters.shard_partition_column, mapping: dict = None):
+        """
+        按某一列的取值分片，例如按来源集合或文档，同一集合的数据在同一个分片中，便于单独重建或下线。
+        :param column: 分片依据的列
+        :param mapping: 取值到分片编号的映射，未列出的取值按 hash 分配
+        """
+        super().__init__(num_shards)
+        self.column = column
+        self.mapping = mapping or {}
+
+    def assign(self, data: pd.DataFrame) -> np.ndarray:
+        values = data[self.column]
+        hashed = (pd.util.hash_pandas_object(values, index=False).to_numpy() % np.uint64(self.num_shards)).astype(np.int64)
+        mapped = values.map(self.mapping)
+        return np.where(mapped.notna(), mapped.fillna(0).astype(np.int64), hashed)
+
+
+PARTITIONERS = {"hash": HashPartitioner, "column": ColumnPartitioner}
+
+
+class ShardedLanceDB:
+    def __init__(self, table_name: str, num_shards: int = parameters.shard_num, shard_paths=None,
+                 partitioner: Partitioner = None, timeout: float = parameters.shard_timeout, workers: int = parameters.shard_workers):
+        """
+        :param table_name: 逻辑表名，第 i 个分片的表名为 {table_name}_shard{i}
+        :param num_shards: 分片数
+        :param shard_paths: 分片所在的 LanceDB 目录列表，第 i 个分片放在 shard_paths[i % len(shard_paths)]，为空时都在 LanceDB_path
+        :param partitioner: 分区器，None 时按 shard_partitioner 配置创建
+        :param timeout: 检索时每个分片的超时时间（秒）
+        :param workers: 每个分片的检索线程数
+        """
+        self.table_name = table_name
+        self.num_shards = num_shards
+        shard_paths = shard_paths if shard_paths is not None else parameters.shard_paths
+        shard_paths = shard_paths or [parameters.LanceDB_path]
+        managers = {path: LanceDBManager(path) for path in dict.fromkeys(shard_paths)}
+        self.shards = [(managers[shard_paths[i % len(shard_paths)]], f"{table_name}_shard{i}") for i in range(num_shards)]
+        self.partitioner = partitioner if partitioner is not None else PARTITIONERS[parameters.shard_partitioner](num_shards)
+        self.timeout = timeout
+        # 每个分片一个线程池：已经开始的检索无法取消，慢分片只占用自己的线程
+        self.executors = {table: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=table) for _, table in self.shards}
+        self.overdue = {table: 0 for _, table in self.shards}  # 超时后仍在运行的检索数
+        self.lock = threading.Lock()
+        self.last_search_stats = {}
+
+    @property
+    def consumer(self) -> str:
+        """
+        变更日志的消费者名称，分片数变化后视为新的消费者，触发全量重建。
+        """
+        return f"{parameters.LanceDB_path}/{self.table_name}#shards{self.num_shards}"
+
+    def existing_shards(self):
+        """
+        已创建的分片，按列分片时没有数据的分片不会被创建。
+        """
+        return [(manager, table) for manager, table in self.shards if table in manager.db.table_names()]
+
+    def exists(self) -> bool:
+        return bool(self.existing_shards())
+
+    def has_columns(self, columns) -> bool:
+        return all(col in manager.open_table(table).schema.names for manager, table in self.existing_shards() for col in columns)
+
+    def versions(self) -> tuple:
+        """
+        所有分片的版本号，任何一个分片写入后都会变化。
+        """
+        return tuple(manager.table_version(table) for manager, table in self.existing_shards())
+
+    def drop(self):
+        for manager, table in self.existing_shards():
+            manager.delete_table(table)
+
+    def delete_data(self, condition: str):
+        """
+        在所有分片中删除满足条件的数据（按列分片时无法只凭 id 找到分片）。
+        """
+        for manager, table in self.existing_shards():
+            manager.delete_data(table, condition)
+
+    def write(self, data: pd.DataFrame, unique_key: str = "id", scalar_columns=()):
+        """
+        按分区器把数据写入各分片，分片不存在时创建。
+        :param data: 数据，需包含分区器使用的列
+        :param unique_key: 去重的唯一键
+        :param scalar_columns: 需要建立标量索引的列
+        """
+        assignment = self.partitioner.assign(data)
+        for shard_no, (manager, table) in enumerate(self.shards):
+            part = data[assignment == shard_no]
+            if part.empty:
+                continue
+            if manager.create_table(table, part):
+                manager.insert_data(table, part, unique_key=unique_key)
+            for col in scalar_columns:
+                manager.ensure_scalar_index(manager.open_table(table), col)
+        counts = np.bincount(assignment, minlength=self.num_shards)
+        print(f"写入{len(data)}条，各分片：{counts.tolist()}")
+
+    def _gather(self, func, timeout):
+        """
+        在所有分片上并行执行 func(manager, table)，超时或出错的分片被跳过；
+        上一次超时的检索仍在运行的分片本次直接跳过，避免新的检索排在它后面。
+        :return: (结果列表, 统计)
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start_time = time.time()
+
+        def call(manager, table, state):
+            try:
+                return func(manager, table)
+            finally:
+                with self.lock:
+                    state["finished"] = True
+                    if state["overdue"]:
+                        self.overdue[table] -= 1
+
+        futures, busy = {}, []
+        for manager, table in self.existing_shards():
+            with self.lock:
+                if self.overdue[table]:
+                    busy.append(table)
+                    continue
+            state = {"finished": False, "overdue": False}
+            futures[self.executors[table].submit(call, manager, table, state)] = (table, state)
+        done, not_done = wait(futures, timeout=timeout) if futures else (set(), set())
+        results, failed = [], []
+        for future in done:
+            table = futures[future][0]
+            try:
+                results.append((table, future.result()))
+            except Exception as e:
+                failed.append(table)
+                print(f"分片 '{table}' 检索失败❌ {type(e).__name__}: {e}")
+        timed_out = []
+        for future in not_done:
+            table, state = futures[future]
+            timed_out.append(table)
+            with self.lock:
+                if not future.cancel() and not state["finished"]:
+                    state["overdue"] = True
+                    self.overdue[table] += 1
+        if timed_out:
+            print(f"分片检索超时❌ {timed_out}，超过{timeout}s，本次结果不包含这些分片")
+        if busy:
+            print(f"分片上次超时的检索仍在运行❌ {busy}，本次跳过")
+        stats = {"shards": len(self.shards), "searched": len(futures), "ok": len(results),
+                 "timed_out": timed_out, "busy": busy, "failed": failed, "elapsed": time.time() - start_time}
+        with self.lock:
+            self.last_search_stats = stats
+        return results, stats
+
+    def search(self, query_vector, limit: int = 5, filter_expression: str = None, metric: str = "L2",
+               nprobes: int = None, refine_factor: int = None, timeout: float = None) -> pd.DataFrame:
+        """
+        并行检索所有分片，每个分片取 limit 条，合并后按距离取全局 top-limit。
+        :return: 与 search_vectors 相同的列，另加 _shard 列记录来自哪个分片
+        """
+        def run(manager, table):
+            return manager.search_vectors(table_name=table, query_vector=query_vector, limit=limit,
+                                          filter_expression=filter_expression, metric=metric,
+                                          nprobes=nprobes, refine_factor=refine_factor)
+
+        results, _ = self._gather(run, timeout)
+        frames = [df.assign(_shard=table) for table, df in results if not df.empty]
+        if not frames:
+            return results[0][1].assign(_shard=None) if results else pd.DataFrame(columns=["id", "text", "_distance", "_shard"])
+        merged = pd.concat(frames, ignore_index=True)
+        return merged.sort_values("_distance", kind="stable").head(limit).reset_index(drop=True)
+
+    def batch_search(self, query_vectors, limit: int = 5, filter_expression: str = None, columns=("id", "text"),
+                     metric: str = "L2", nprobes: int = None, refine_factor: int = None, timeout: float = None):
+        """
+        批量检索：每个分片执行一次多向量查询，合并后每个查询按距离保留 limit 条。
+        :return: pyarrow.Table，列为 query_index、columns 与 _distance
+        """
+        def run(manager, table):
+            return manager.batch_search_vectors(table_name=table, query_vectors=query_vectors, limit=limit,
+                                                filter_expression=filter_expression, columns=columns, metric=metric,
+                                                nprobes=nprobes, refine_factor=refine_factor)
+
+        results, _ = self._gather(run, timeout)
+        if not results:
+            return pa.table({"query_index": pa.array([], pa.int32())})
+        merged = pa.concat_tables([table for _, table in results]).to_pandas()
+        merged = merged.sort_values(["query_index", "_distance"], kind="stable").groupby("query_index").head(limit)
+        return pa.Table.from_pandas(merged.reset_index(drop=True), preserve_index=False)
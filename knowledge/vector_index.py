@@ -0,0 +1,117 @@
+# 向量索引的生命周期管理：行数超过阈值后自动建立 IVF_PQ / IVF_HNSW_SQ 索引，新增数据过多时重建
+import math
+import threading
+import time
+from config.config import parameters
+
+
+def choose_index_params(num_rows: int, dim: int):
+    """
+    根据行数与向量维度选择索引参数。
+    分区数取行数的平方根，同时保证每个分区至少有256条用于训练；子向量数让每个子向量约 16 维，且必须整除维度。
+    :param num_rows: 行数
+    :param dim: 向量维度
+    :return: (num_partitions, num_sub_vectors)
+    """
+    num_partitions = max(1, min(4096, int(math.sqrt(num_rows)), num_rows // 256))
+    num_sub_vectors = 1
+    for sub_dim in (16, 8, 32, 4, 64, 2):
+        if dim % sub_dim == 0:
+            num_sub_vectors = dim // sub_dim
+            break
+    return num_partitions, num_sub_vectors
+
+
+class VectorIndexManager:
+    _building = {}   # (db_path, table_name) -> 开始重建的时间，同一进程内共享
+    _lock = threading.Lock()
+
+    def __init__(self, db_manager, vector_column: str = "vector"):
+        """
+        :param db_manager: LanceDBManager 实例
+        :param vector_column: 向量列名
+        """
+        self.db_manager = db_manager
+        self.vector_column = vector_column
+
+    def _vector_index(self, table):
+        """
+        查找向量列上的索引配置，没有时返回 None。
+        """
+        for index in table.list_indices():
+            if self.vector_column in index.columns and index.index_type.upper().startswith("IVF"):
+                return index
+        return None
+
+    def status(self, table_name: str) -> dict:
+        """
+        索引状态：absent（没有索引）、building（正在建立）、stale（未索引的行占比过高）、ready。
+        :param table_name: 表名
+        :return: 状态字典
+        """
+        table = self.db_manager.open_table(table_name)
+        num_rows = table.count_rows()
+        result = {"state": "absent", "rows": num_rows, "indexed_rows": 0, "unindexed_rows": num_rows, "index_type": None}
+        index = self._vector_index(table)
+        if index is not None:
+            stats = table.index_stats(index.name)
+            result.update(indexed_rows=stats.num_indexed_rows,
+                          unindexed_rows=stats.num_unindexed_rows,
+                          index_type=stats.index_type,
+                          distance_type=stats.distance_type)
+            stale = stats.num_unindexed_rows > parameters.ann_stale_ratio * max(num_rows, 1)
+            result["state"] = "stale" if stale else "ready"
+        with self._lock:
+            if (self.db_manager.db_path, table_name) in self._building:
+                result["state"] = "building"
+                result["building_seconds"] = time.time() - self._building[(self.db_manager.db_path, table_name)]
+        return result
+
+    def ensure_index(self, table_name: str, metric: str = parameters.ann_index_metric,
+                     index_type: str = parameters.ann_index_type, background: bool = False) -> dict:
+        """
+        行数达到 ann_index_min_rows 且没有索引、或索引过旧时建立索引，否则什么都不做。
+        :param table_name: 表名
+        :param metric: 距离度量："L2"、"cosine" 或 "dot"，需与检索时一致
+        :param index_type: "IVF_PQ" 或 "IVF_HNSW_SQ"
+        :param background: 是否在后台线程中建立，建立期间检索仍可使用旧索引或暴力搜索
+        :return: 调用后的索引状态
+        """
+        status = self.status(table_name)
+        if status["state"] in ("ready", "building") or status["rows"] < parameters.ann_index_min_rows:
+            return status
+
+        key = (self.db_manager.db_path, table_name)
+        with self._lock:
+            if key in self._building:
+                return status
+            self._building[key] = time.time()
+        if background:
+            threading.Thread(target=self._build, args=(table_name, metric, index_type), daemon=True).start()
+        else:
+            self._build(table_name, metric, index_type)
+        return self.status(table_name)
+
+    def _build(self, table_name: str, metric: str, index_type: str):
+        key = (self.db_manager.db_path, table_name)
+        try:
+            table = self.db_manager.open_table(table_name)
+            num_rows = table.count_rows()
+            dim = table.schema.field(self.vector_column).type.list_size
+            num_partitions, num_sub_vectors = choose_index_params(num_rows, dim)
+            start_time = time.time()
+            kwargs = {"metric": metric.lower(),
+                      "num_partitions": num_partitions,
+                      "vector_column_name": self.vector_column,
+                      "index_type": index_type,
+                      "replace": True}
+            if index_type.upper().endswith("PQ"):
+                kwargs["num_sub_vectors"] = num_sub_vectors
+            table.create_index(**kwargs)
+            print(f"表 '{table_name}' 向量索引建立完成✅ {index_type}，{num_rows}行，分区数{num_partitions}，"
+                  f"子向量数{num_sub_vectors}，耗时{time.time() - start_time:.1f}s")
+        except Exception as e:
+            print(f"表 '{table_name}' 向量索引建立失败❌ {type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
@@ -6,7 +6,10 @@ from config.config import parameters
 from data_handle.main_data import mainDataHandle
 from knowledge.main_knowledge import mainKnowledge
 from retrieval.searce_similar_text import SearchSimilarText
-from generation.LLM import generate_ollama
+from retrieval.rerank import CrossEncoderReranker
+from generation.stream_generator import OllamaGenerator
+from generation.answer_cache import SemanticAnswerCache
+from generation.context_builder import ContextBuilder
 
 from knowledge.embedding import EmbeddingSourceDate
 
@@ -21,6 +24,10 @@ if __name__ == '__main__':
 
     # 3\检索相似文本创建检索器
     search_similar_text = SearchSimilarText()
+    reranker = CrossEncoderReranker() if parameters.rerank_enable else None   # 重排序：多取候选，只把得分最高的几个交给 LLM
+    answer_cache = SemanticAnswerCache()
+    context_builder = ContextBuilder()   # 合并相邻 chunk、去掉近似重复，在 token 预算内挑选知识
+    generator = OllamaGenerator()
     while True:
         # 获取用户输入
         question = input("\n你：")
@@ -32,26 +39,43 @@ if __name__ == '__main__':
 
         # 生成查询向量
         start_time = time.time()
-        question_v = embedding.embedding_single(question)
+        question_v = embedding.embedding_query(question)
         embedding_time = time.time()
-        print("embedding time: ", embedding_time - start_time)
+        print("embedding time: ", embedding_time - start_time, "query cache: ", embedding.query_cache.stats())
 
         # 从知识库搜索相关内容
-        find_Knowedge = search_similar_text.simple_searce(query_vector=question_v, 
-                                                          table_name=parameters.search_table,
-                                                          filter_expression="_distance < 0.9")#"_distance > 10"
+        find_Knowedge = search_similar_text.search(query_vector=question_v,
+                                                   table_name=parameters.search_table,
+                                                   question=question,
+                                                   topk=parameters.rerank_candidates if reranker is not None else None,
+                                                   filter_expression=parameters.search_filter)#"_distance > 10"
+        if reranker is not None:
+            find_Knowedge = reranker.rerank(question, find_Knowedge)
+            print("rerank: ", reranker.last_stats)
         print("find_Knowedge: ",find_Knowedge["text"], find_Knowedge["_distance"])
-        find_text = find_Knowedge["text"].to_list()
-        find_text = "\n".join(find_text)
+        find_text = context_builder.build(find_Knowedge)
+        print("context: ", context_builder.last_stats)
         search_time = time.time()
         print("search time: ", search_time - embedding_time)
         # print("找到的文本：\n" , find_text)
-        # 生成回答
-        answer = generate_ollama(question, str(find_text))
+        # 生成回答，相近的问题检索到相同的知识时直接使用缓存的回答
+        chunk_ids = find_Knowedge["id"].to_list()
+        kb_version = (parameters.search_table, search_similar_text.table_version(parameters.search_table))
+        answer = answer_cache.get(question_v, chunk_ids, kb_version)
+        if answer is not None:
+            print("\nAI：" + answer)
+        else:
+            # 流式输出答案
+            print("\nAI：", end="", flush=True)
+            tokens = []
+            for token in generator.stream(question, find_text):
+                print(token, end="", flush=True)
+                tokens.append(token)
+            print()
+            answer = "".join(tokens)
+            answer_cache.put(question_v, chunk_ids, kb_version, answer)
+            print("time to first token: ", generator.last_stats["ttft"], "tokens/s: ", generator.last_stats["tokens_per_sec"])
         generate_time = time.time()
-        print("generate time: ", generate_time - search_time)
-
-        # 输出答案
-        print("\nAI：" + answer)
+        print("generate time: ", generate_time - search_time, "answer cache: ", answer_cache.stats())
 
 
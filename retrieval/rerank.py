@@ -0,0 +1,106 @@
+# 重排序：用本地 cross-encoder 对检索到的候选逐个与问题打分，只把得分最高的几个 chunk 交给 LLM
+# 候选在一次批量前向计算中打分；分数按 (问题, chunk id) 缓存；按时间预算限制需要打分的候选数
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from sentence_transformers import CrossEncoder
+from config.config import parameters
+from knowledge.query_cache import LRUCache, normalize_query
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_path: str = parameters.rerank_model_path,
+                       topn: int = parameters.rerank_topn,
+                       budget_ms: float = parameters.rerank_budget_ms,
+                       max_length: int = parameters.rerank_max_length,
+                       cache_size: int = parameters.rerank_cache_size):
+        """
+        :param model_path: cross-encoder 模型路径，例如 bge-reranker-base
+        :param topn: 重排序后保留的 chunk 数
+        :param budget_ms: 每次重排序的时间预算（毫秒），根据实测的单条打分耗时决定最多为多少个新候选打分，None 表示不限制
+        :param max_length: 问题与 chunk 拼接后的最大 token 数，超出部分截断
+        :param cache_size: 分数缓存的最大条数
+        """
+        self.model = CrossEncoder(model_path, max_length=max_length, device="cpu")
+        self.topn = topn
+        self.budget_ms = budget_ms
+        self.cache = LRUCache(max_size=cache_size)
+        self.pair_ms = None  # 单条候选打分耗时的滑动平均（毫秒）
+        self.lock = threading.Lock()
+        self.last_stats = {}
+
+    @staticmethod
+    def query_hash(question: str) -> str:
+        return hashlib.md5(normalize_query(question).encode("utf-8")).hexdigest()
+
+    def candidate_budget(self) -> int:
+        """
+        时间预算内最多可以打分的新候选数，还没有耗时数据时不限制。
+        """
+        if self.budget_ms is None or self.pair_ms is None:
+            return None
+        return max(self.topn, int(self.budget_ms / max(self.pair_ms, 1e-3)))
+
+    def score(self, question: str, texts) -> np.ndarray:
+        """
+        一次批量前向计算为所有 (问题, 文本) 对打分，并更新单条耗时的估计。
+        """
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        start_time = time.time()
+        scores = self.model.predict([(question, text) for text in texts], batch_size=len(texts), show_progress_bar=False)
+        pair_ms = (time.time() - start_time) * 1000 / len(texts)
+        with self.lock:
+            self.pair_ms = pair_ms if self.pair_ms is None else 0.8 * self.pair_ms + 0.2 * pair_ms
+        return np.asarray(scores, dtype=np.float32)
+
+    def rerank(self, question: str, results: pd.DataFrame, topn: int = None) -> pd.DataFrame:
+        """
+        对检索结果重排序。
+        候选按检索顺序处理：缓存中已有分数的直接使用，其余的在时间预算允许的数量内打分，超出预算的候选被丢弃。
+        分层检索的结果交给 LLM 的是句子所在的段落，此时对 paragraph_text 打分，同一段落只保留排名最靠前的句子。
+        :param question: 用户问题
+        :param results: 检索结果，需有 id 与 text 列，按检索相关度从高到低排列；分层检索另有 paragraph_id 与 paragraph_text 列
+        :param topn: 保留的条数，None 使用初始化时的 topn
+        :return: 增加 rerank_score 列、按其从高到低排列的前 topn 条结果
+        """
+        if topn is None:
+            topn = self.topn
+        start_time = time.time()
+        if results.empty:
+            return results.assign(rerank_score=pd.Series(dtype=np.float32))
+        query_hash = self.query_hash(question)
+        budget = self.candidate_budget()
+        layered = "paragraph_text" in results.columns and "paragraph_id" in results.columns
+        scores, keep, to_score, keys, texts, seen = {}, [], [], {}, {}, set()
+        for position, (chunk_id, text) in enumerate(zip(results["id"], results["text"])):
+            if layered and pd.notna(results["paragraph_id"].iloc[position]) and isinstance(results["paragraph_text"].iloc[position], str):
+                keys[position] = ("paragraph", int(results["paragraph_id"].iloc[position]))
+                texts[position] = results["paragraph_text"].iloc[position]
+            else:
+                keys[position], texts[position] = chunk_id, text
+            if keys[position] in seen:
+                continue
+            seen.add(keys[position])
+            cached = self.cache.get((query_hash, keys[position]))
+            if cached is not None:
+                scores[position] = cached
+            elif budget is None or len(to_score) < budget:
+                to_score.append(position)
+            else:
+                continue
+            keep.append(position)
+        new_scores = self.score(question, [texts[position] for position in to_score])
+        for position, value in zip(to_score, new_scores):
+            scores[position] = float(value)
+            self.cache.put((query_hash, keys[position]), float(value))
+
+        reranked = results.iloc[keep].copy()
+        reranked["rerank_score"] = [scores[position] for position in keep]
+        reranked = reranked.sort_values("rerank_score", ascending=False, kind="stable").head(topn).reset_index(drop=True)
+        self.last_stats = {"candidates": len(results), "scored": len(to_score), "cached": len(keep) - len(to_score),
+                           "dropped": len(results) - len(keep), "kept": len(reranked),
+                           "elapsed": time.time() - start_time}
+        return reranked
@@ -1,22 +1,296 @@
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 from config.config import parameters
 import os
 
-from knowledge.lancedb import LanceDBManager
+from knowledge.lancedb import LanceDBManager, split_distance_filter
+from knowledge.mmap_index import MmapVectorIndex
+from knowledge.quantization import QuantizedVectorIndex
+from knowledge.sharding import ShardedLanceDB
+from knowledge.vector_index import VectorIndexManager
+from data_handle.text_dataset import DatabaseManager
+from data_handle.fts_index import ChunkFTSIndex
+from data_handle.near_dedup import NearDuplicateIndex
+
+
+def reciprocal_rank_fusion(ranked_lists, topk: int, k: int = parameters.rrf_k) -> pd.DataFrame:
+    """
+    倒数排名融合：每条结果的得分为它在各个列表中 1/(k + 排名) 之和，不需要把不同检索方式的分数归一化到同一尺度。
+    :param ranked_lists: DataFrame 列表，每个都按相关度从高到低排列，且都有 id 与 text 列
+    :param topk: 返回的条数
+    :param k: 平滑常数，越大排名靠后的结果占比越高
+    :return: 按 rrf_score 从高到低排列的 DataFrame，保留各列表中除 id/text 外的分数列
+    """
+    scores = {}
+    rows = {}
+    for ranked in ranked_lists:
+        for rank, row in enumerate(ranked.to_dict("records"), start=1):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (k + rank)
+            rows.setdefault(row["id"], {}).update(row)
+    if not scores:
+        return pd.DataFrame(columns=["id", "text", "rrf_score"])
+    fused = pd.DataFrame([rows[chunk_id] for chunk_id in scores])
+    fused["rrf_score"] = list(scores.values())
+    return fused.sort_values("rrf_score", ascending=False).head(topk).reset_index(drop=True)
 
 
 class SearchSimilarText:
     def __init__(self, LanceDB_path: str = parameters.LanceDB_path,
-                       topk: int = parameters.search_topk):
+                       topk: int = parameters.search_topk,
+                       lexical_table: str = parameters.search_lexical_table,
+                       backend: str = parameters.search_backend,
+                       metric: str = parameters.ann_index_metric):
+        """
+        :param backend: 向量检索后端，"lancedb" 或 "mmap"；mmap 索引不存在、已过期或带有非距离的过滤条件时使用 LanceDB
+        :param metric: 距离度量："L2"、"cosine" 或 "dot"，有向量索引时需与建索引时一致
+        """
         self.LanceDB_path = LanceDB_path
         self.topk = topk
+        self.lexical_table = lexical_table
+        self.backend = backend
+        self.metric = metric
+        self.mmap_indexes = {}  # table_name -> (MmapVectorIndex, 加载时 meta.json 与 quant.json 的修改时间)
+        self.sharded = ShardedLanceDB(parameters.LanceDB_table_name) if parameters.shard_num > 1 else None
 
         self.LanceDBManager = LanceDBManager(self.LanceDB_path)
+        self.VectorIndexManager = VectorIndexManager(self.LanceDBManager)
+        self.lexical_index = None  # 第一次全文检索时打开
+        self.lexical_lock = threading.Lock()
+        self.dedup_index = None  # 分层检索第一次查询重复映射时打开
+        self.dedup_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search")
+        self.last_batch_stats = {}
+
+    def shards(self, table_name: str):
+        """
+        表是分片表时返回 ShardedLanceDB，否则返回 None。
+        """
+        if self.sharded is not None and table_name == self.sharded.table_name:
+            return self.sharded
+        return None
+
+    def table_version(self, table_name: str):
+        """
+        表的版本号，用于判断回答缓存是否过期；分片表为各分片版本号组成的元组。
+        """
+        sharded = self.shards(table_name)
+        if sharded is not None:
+            return sharded.versions()
+        return self.LanceDBManager.table_version(table_name)
+
+    def mmap_index(self, table_name: str):
+        """
+        获取表的内存映射索引，第一次使用时加载；配置了量化且已生成编码时加载量化索引。
+        meta.json 在导出的最后写入、quant.json 在量化编码的最后写入，它们的修改时间变化说明 mainKnowledge 重新导出了索引，此时重新加载。
+        导出后表又有写入（版本号变化）、或只保留了量化编码却没有按量化索引加载时返回 None，由 LanceDB 检索。
+        """
+        index_path = os.path.join(parameters.mmap_index_path, table_name)
+        try:
+            meta_mtime = os.stat(os.path.join(index_path, "meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            self.mmap_indexes.pop(table_name, None)
+            return None
+        quant_path = os.path.join(index_path, "quant.json")
+        meta_mtime = (meta_mtime, os.stat(quant_path).st_mtime_ns if os.path.exists(quant_path) else None)
+        index, loaded_mtime = self.mmap_indexes.get(table_name, (None, None))
+        if index is None or loaded_mtime != meta_mtime:
+            if parameters.quantization != "none" and QuantizedVectorIndex.exists(index_path):
+                index = QuantizedVectorIndex(index_path)
+            else:
+                index = MmapVectorIndex(index_path)
+            self.mmap_indexes[table_name] = (index, meta_mtime)
+            print(f"内存映射索引 '{table_name}' 加载完成✅ {index.count}行，耗时{index.load_time * 1000:.1f}ms")
+            if index.vectors is None and not isinstance(index, QuantizedVectorIndex):
+                print(f"内存映射索引 '{table_name}' 只保留了量化编码，没有原始向量❌ 请设置 quantization 或重新导出，当前使用 LanceDB 检索")
+        if index.vectors is None and not isinstance(index, QuantizedVectorIndex):
+            return None
+        if index.meta["table_version"] != self.LanceDBManager.table_version(table_name):
+            if not index.meta.get("stale_warned"):
+                print(f"内存映射索引 '{table_name}' 已过期❌ 请重新运行 mainKnowledge 导出，当前使用 LanceDB 检索")
+                index.meta["stale_warned"] = True
+            return None
+        return index
+
+    def _mmap_plan(self, table_name: str, filter_expression: str):
+        """
+        判断能否使用 mmap 后端：只支持 _distance 范围过滤。
+        :return: (index, lower_bound, upper_bound)，不能使用时 index 为 None
+        """
+        if self.backend != "mmap" or self.shards(table_name) is not None:
+            return None, None, None
+        lower_bound, upper_bound, remaining = split_distance_filter(filter_expression)
+        if remaining:
+            return None, None, None
+        return self.mmap_index(table_name), lower_bound, upper_bound
 
-    def simple_searce(self, query_vector: List[float], table_name: str, topk: int = None,  filter_expression: str = None):
+    def simple_searce(self, query_vector: List[float], table_name: str, topk: int = None,  filter_expression: str = None,
+                      nprobes: int = parameters.search_nprobes, refine_factor: int = parameters.search_refine_factor):
         if topk is None:
             topk = self.topk
+        index, lower_bound, upper_bound = self._mmap_plan(table_name, filter_expression)
+        if index is not None:
+            return index.search(query_vector, topk, self.metric, lower_bound, upper_bound)
+        sharded = self.shards(table_name)
+        if sharded is not None:
+            return sharded.search(query_vector, topk, filter_expression, self.metric, nprobes, refine_factor)
         return self.LanceDBManager.search_vectors(table_name=table_name,
                                            query_vector=query_vector,
                                            limit=topk,
-                                           filter_expression=filter_expression)
+                                           filter_expression=filter_expression,
+                                           metric=self.metric,
+                                           nprobes=nprobes,
+                                           refine_factor=refine_factor)
+
+    def batch_search(self, query_vectors: np.ndarray, table_name: str, topk: int = None, filter_expression: str = None,
+                     columns: List[str] = ("id", "text"), nprobes: int = parameters.search_nprobes,
+                     refine_factor: int = parameters.search_refine_factor):
+        """
+        批量检索，用于离线评测、查询扩展与批量问答，避免逐个查询重复打开表与规划查询。
+        :param query_vectors: (N, d) 的查询向量
+        :return: pyarrow.Table，列为 query_index、columns 与 _distance；按查询拆分可用 to_pandas().groupby("query_index")
+        """
+        if topk is None:
+            topk = self.topk
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        start_time = time.time()
+        index, lower_bound, upper_bound = self._mmap_plan(table_name, filter_expression)
+        if index is not None and set(columns) <= {"id", "text"}:
+            results = index.batch_search(query_vectors, topk, self.metric, lower_bound, upper_bound)
+            results = pa.Table.from_pandas(results[["query_index", *columns, "_distance"]], preserve_index=False)
+        elif self.shards(table_name) is not None:
+            results = self.shards(table_name).batch_search(query_vectors, topk, filter_expression, columns,
+                                                           self.metric, nprobes, refine_factor)
+        else:
+            results = self.LanceDBManager.batch_search_vectors(table_name=table_name,
+                                                               query_vectors=query_vectors,
+                                                               limit=topk,
+                                                               filter_expression=filter_expression,
+                                                               columns=columns,
+                                                               metric=self.metric,
+                                                               nprobes=nprobes,
+                                                               refine_factor=refine_factor)
+        elapsed = time.time() - start_time
+        num_queries = len(query_vectors) if query_vectors.ndim == 2 else 1
+        self.last_batch_stats = {"queries": num_queries,
+                                 "rows": results.num_rows,
+                                 "elapsed": elapsed,
+                                 "queries_per_sec": num_queries / elapsed if elapsed > 0 else 0.0}
+        print(f"批量检索{num_queries}个查询，返回{results.num_rows}条，耗时{elapsed:.3f}s，"
+              f"吞吐量{self.last_batch_stats['queries_per_sec']:.1f} 查询/s")
+        return results
+
+    def lexical_searce(self, question: str, topk: int = None) -> pd.DataFrame:
+        """
+        在切分表的 FTS5 全文索引上检索，连接只打开一次，多个线程通过锁轮流使用。
+        :return: 包含 id、text、bm25 列的 DataFrame，bm25 越小越相关
+        """
+        if topk is None:
+            topk = self.topk
+        with self.lexical_lock:
+            if self.lexical_index is None:
+                self.lexical_index = ChunkFTSIndex(DatabaseManager(check_same_thread=False), self.lexical_table)
+                self.lexical_index.install()
+            hits = self.lexical_index.search(question, limit=topk)
+        return pd.DataFrame(hits, columns=["id", "text", "bm25"])
+
+    def hybrid_searce(self, query_vector: List[float], question: str, table_name: str, topk: int = None,
+                      filter_expression: str = None, nprobes: int = parameters.search_nprobes,
+                      refine_factor: int = parameters.search_refine_factor):
+        """
+        向量检索与全文检索在两个线程中同时进行，各取 topk*hybrid_candidates 条候选，用倒数排名融合合并。
+        向量表的 id 与切分表的 chunk id 一致，两边命中同一个 chunk 时得分累加。
+        :return: 包含 id、text、_distance、bm25、rrf_score 列的 DataFrame，只被一种方式命中时另一种的分数为空
+        """
+        if topk is None:
+            topk = self.topk
+        candidates = topk * parameters.hybrid_candidates
+        vector_future = self.executor.submit(self.simple_searce, query_vector, table_name, candidates,
+                                             filter_expression, nprobes, refine_factor)
+        lexical_future = self.executor.submit(self.lexical_searce, question, candidates)
+        vector_hits = vector_future.result()[["id", "text", "_distance"]]
+        lexical_hits = lexical_future.result()
+        return reciprocal_rank_fusion([vector_hits, lexical_hits], topk)
+
+    def layering_searce(self, query_vector: List[float], table_name: str, topk: int = None, filter_expression: str = None,
+                        paragraph_topk: int = parameters.layering_paragraph_topk,
+                        nprobes: int = parameters.search_nprobes, refine_factor: int = parameters.search_refine_factor):
+        """
+        分层检索：先在段落向量表（{table_name}_paragraph）中取 paragraph_topk 个段落，
+        再只在这些段落的句子中检索（按 paragraph_id 预过滤），扫描的向量数从整个句子表降到几个段落的句子数。
+        :return: 句子结果，附带所在段落的 paragraph_text 与段落距离 paragraph_distance
+        """
+        if topk is None:
+            topk = self.topk
+        paragraphs = self.simple_searce(query_vector, f"{table_name}_paragraph", paragraph_topk,
+                                        nprobes=nprobes, refine_factor=refine_factor)
+        if paragraphs.empty:
+            return self.simple_searce(query_vector, table_name, topk, filter_expression, nprobes, refine_factor)
+        paragraph_filter = f"paragraph_id IN ({', '.join(str(int(i)) for i in paragraphs['id'])})"
+        # 近似重复消除后，段落中被映射掉的句子由代表句子（可能在其他段落中）代替
+        representatives = self._duplicate_representatives(table_name, paragraphs["id"])
+        if representatives:
+            paragraph_filter = f"({paragraph_filter} OR id IN ({', '.join(str(i) for i in representatives)}))"
+        if filter_expression:
+            paragraph_filter = f"{filter_expression} AND {paragraph_filter}"
+        sentences = self.simple_searce(query_vector, table_name, topk, paragraph_filter, nprobes, refine_factor)
+        if representatives and not sentences.empty:
+            # 代表句子归到检索到的段落下，交给 LLM 的是这些段落
+            retrieved = set(int(i) for i in paragraphs["id"])
+            sentences["paragraph_id"] = [paragraph_id if pd.notna(paragraph_id) and int(paragraph_id) in retrieved
+                                         else representatives.get(int(chunk_id), paragraph_id)
+                                         for chunk_id, paragraph_id in zip(sentences["id"], sentences["paragraph_id"])]
+        paragraphs = paragraphs[["id", "text", "_distance"]].rename(
+            columns={"id": "paragraph_id", "text": "paragraph_text", "_distance": "paragraph_distance"})
+        return sentences.merge(paragraphs, on="paragraph_id", how="left")
+
+    def _duplicate_representatives(self, table_name: str, paragraph_ids) -> dict:
+        """
+        段落中被近似重复消除映射掉的句子对应的代表句子。
+        :return: {代表句子 id: 段落 id}，一个代表对应多个段落时取排名最靠前的段落
+        """
+        if not parameters.near_dedup_enable or table_name != parameters.LanceDB_table_name:
+            return {}
+        paragraph_ids = [int(i) for i in paragraph_ids]
+        with self.dedup_lock:
+            if self.dedup_index is None:
+                self.dedup_index = NearDuplicateIndex(DatabaseManager(check_same_thread=False), parameters.sql_table_name)
+            if not self.dedup_index.ready():
+                return {}
+            pairs = self.dedup_index.representatives(paragraph_ids)
+        rank = {paragraph_id: position for position, paragraph_id in enumerate(paragraph_ids)}
+        representatives = {}
+        for representative_id, paragraph_id in sorted(pairs, key=lambda pair: rank.get(pair[1], len(rank))):
+            representatives.setdefault(int(representative_id), int(paragraph_id))
+        return representatives
+
+    @staticmethod
+    def knowledge_texts(results: pd.DataFrame) -> List[str]:
+        """
+        检索结果中提供给生成器的文本：分层检索返回句子所在的段落（去重），其他方式返回句子本身。
+        """
+        if "paragraph_text" in results.columns:
+            return results["paragraph_text"].dropna().drop_duplicates().to_list()
+        return results["text"].to_list()
+
+    def search(self, query_vector: List[float], table_name: str, question: str = None, topk: int = None,
+               filter_expression: str = None, seach_type: str = parameters.seach_type):
+        """
+        按 seach_type 选择检索方法，hybrid 需要同时传入问题文本。
+        """
+        if seach_type == "hybrid" and question:
+            return self.hybrid_searce(query_vector, question, table_name, topk, filter_expression)
+        if seach_type == "layering":
+            return self.layering_searce(query_vector, table_name, topk, filter_expression)
+        return self.simple_searce(query_vector, table_name, topk, filter_expression)
+
+    def index_status(self, table_name: str):
+        """向量索引状态：absent、building、stale 或 ready；分片表返回 {分片表名: 状态}。"""
+        sharded = self.shards(table_name)
+        if sharded is not None:
+            return {shard_table: VectorIndexManager(manager).status(shard_table) for manager, shard_table in sharded.existing_shards()}
+        return self.VectorIndexManager.status(table_name)
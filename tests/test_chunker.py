@@ -0,0 +1,73 @@
+import os
+import pytest
+from data_handle.chunker import OffsetChunker, chunk_text
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "母猪产后护理.txt")
+MODES = [("sentence", 100, 20), ("paragraph", 512, 30)]
+
+
+def _sample():
+    with open(SAMPLE_PATH, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _pages_by_lines(text, lines_per_page):
+    lines = text.split("\n")
+    return ["\n".join(lines[i:i + lines_per_page]) for i in range(0, len(lines), lines_per_page)]
+
+
+def _pages_by_chars(text, chars_per_page):
+    return [text[i:i + chars_per_page] for i in range(0, len(text), chars_per_page)]
+
+
+def _stream(pages, chunk_size, chunk_overlap, mode):
+    chunker = OffsetChunker(chunk_size, chunk_overlap, mode=mode)
+    chunks = []
+    for page_no, page in enumerate(pages, start=1):
+        chunks += chunker.feed(page_no, page)
+    return chunks + chunker.flush()
+
+
+@pytest.mark.parametrize("mode, chunk_size, chunk_overlap", MODES)
+@pytest.mark.parametrize("pages", [
+    lambda text: [text],
+    lambda text: _pages_by_lines(text, 1),
+    lambda text: _pages_by_lines(text, 7),
+    lambda text: _pages_by_chars(text, 100),
+    lambda text: _pages_by_chars(text, 333),
+], ids=["whole", "line", "7-lines", "100-chars", "333-chars"])
+def test_streamed_chunks_match_whole_text(pages, mode, chunk_size, chunk_overlap):
+    pages = pages(_sample())
+    document = "\n".join(pages)
+    chunks = _stream(pages, chunk_size, chunk_overlap, mode)
+    assert [(start, end) for start, end, _, _ in chunks] == list(chunk_text(document, chunk_size, chunk_overlap, mode=mode))
+    assert all(document[start:end] == content for start, end, _, content in chunks)
+    assert max(end - start for start, end, _, _ in chunks) <= chunk_size
+
+
+def test_chunk_records_start_page():
+    pages = ["第一页第一句。第一页第二句。", "第二页第一句。", "第三页第一句。"]
+    document = "\n".join(pages)
+    for start, end, page, _ in _stream(pages, 10, 0, "sentence"):
+        assert page == document.count("\n", 0, start) + 1
+
+
+def test_oversized_paragraph_is_split_with_overlap():
+    text = "短段落。\n\n" + "长" * 1200 + "\n\n结尾。"
+    spans = list(chunk_text(text, 512, 30, mode="paragraph"))
+    assert max(end - start for start, end in spans) <= 512
+    for (_, previous_end), (start, _) in zip(spans[1:-2], spans[2:-1]):
+        assert previous_end - start == 30
+
+
+@pytest.mark.parametrize("mode, chunk_size, chunk_overlap", MODES)
+def test_buffer_stays_bounded_without_blank_lines(mode, chunk_size, chunk_overlap):
+    # PDF 提取的文本通常没有空行，整篇文档在段落模式下是一个超长片段
+    pages = [("母猪产后要注意保暖和饮水，饲料要逐渐增加。\n" * 24).rstrip()] * 400
+    chunker = OffsetChunker(chunk_size, chunk_overlap, mode=mode)
+    chunks = []
+    for page_no, page in enumerate(pages, start=1):
+        chunks += chunker.feed(page_no, page)
+        assert len(chunker.buffer) <= len(page) + 3 * chunk_size
+    chunks += chunker.flush()
+    assert [(start, end) for start, end, _, _ in chunks] == list(chunk_text("\n".join(pages), chunk_size, chunk_overlap, mode=mode))
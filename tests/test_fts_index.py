@@ -0,0 +1,43 @@
+import pytest
+from data_handle.fts_index import ChunkFTSIndex, build_match_query, split_terms
+from data_handle.text_dataset import DatabaseManager
+
+CHUNKS = ["仔猪出生后要及时吃初乳。",
+          "母猪产后要注意保暖和饮水。",
+          "仔猪断奶后容易腹泻，饲料中可以添加维生素B1。",
+          "猪舍要定期消毒。"]
+
+
+@pytest.fixture
+def fts(tmp_path):
+    db = DatabaseManager(db_path=str(tmp_path))
+    db.create_table("chunks", {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "content": "TEXT NOT NULL"})
+    index = ChunkFTSIndex(db, "chunks")
+    index.install()
+    db.insert_many("chunks", [{"content": text} for text in CHUNKS])
+    yield index
+    db.close()
+
+
+def test_split_terms_keeps_short_chinese_and_model_terms():
+    terms, short_terms = split_terms("仔猪 B1 is the 母猪产后保健？")
+    assert terms == ["the", "母猪产", "猪产后", "产后保", "后保健"]
+    assert short_terms == ["仔猪", "b1"]
+    assert build_match_query("仔猪") is None
+
+
+def test_two_character_chinese_query(fts):
+    hits = fts.search("仔猪", limit=10)
+    assert [hit[0] for hit in hits] == [1, 3]
+    assert all(hit[2] == 0.0 for hit in hits)
+
+
+def test_short_terms_fill_after_trigram_hits(fts):
+    hits = fts.search("母猪产后 仔猪", limit=10)
+    assert [hit[0] for hit in hits] == [2, 1, 3]
+    assert hits[0][2] < 0
+    assert len(fts.search("母猪产后 仔猪", limit=1)) == 1
+
+
+def test_short_terms_rank_by_matched_count(fts):
+    assert [hit[0] for hit in fts.search("仔猪 B1", limit=10)] == [3, 1]
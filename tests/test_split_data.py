@@ -0,0 +1,38 @@
+import spacy
+import pytest
+from data_handle import split_data
+
+
+def _model_with_disabled_senter(name, **kwargs):
+    # 与 en_core_web_sm / zh_core_web_sm 相同的组件布局：senter 存在但默认禁用
+    nlp = spacy.blank("en")
+    for component in ("tok2vec", "parser", "senter", "ner"):
+        nlp.add_pipe("senter" if component == "senter" else "sentencizer", name=component)
+    nlp.initialize()
+    nlp.disable_pipe("senter")
+    return nlp
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(split_data, "_nlp_cache", {})
+
+
+def test_load_nlp_enables_disabled_senter(monkeypatch, fresh_cache):
+    monkeypatch.setattr(spacy, "load", _model_with_disabled_senter)
+    nlp = split_data.load_nlp("en")
+    assert nlp.pipe_names == ["senter"]
+    assert split_data.segment_sentences(["The sow should be kept warm. Feed must be increased gradually!"])[0]
+
+
+def test_load_nlp_without_senter_uses_sentencizer(monkeypatch, fresh_cache):
+    monkeypatch.setattr(spacy, "load", lambda name, **kwargs: spacy.blank("en"))
+    assert split_data.load_nlp("en").pipe_names == ["sentencizer"]
+    sentences = split_data.segment_sentences(["The sow should be kept warm. Feed must be increased gradually!"])[0]
+    assert sentences == ["The sow should be kept warm.", "Feed must be increased gradually!"]
+
+
+@pytest.mark.skipif(not spacy.util.is_package("en_core_web_sm"), reason="en_core_web_sm 未安装")
+def test_split_english_with_installed_model(fresh_cache):
+    sentences = split_data.segment_sentences(["The sow should be kept warm. Feed must be increased gradually!"])[0]
+    assert sentences == ["The sow should be kept warm.", "Feed must be increased gradually!"]
@@ -0,0 +1,60 @@
+import sqlite3
+import pytest
+from data_handle.text_dataset import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(db_path=str(tmp_path))
+    db.create_table("chunks", {"id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                               "content": "TEXT NOT NULL UNIQUE",
+                               "doc_id": "INTEGER"})
+    yield db
+    db.close()
+
+
+def test_bulk_insert_ignore_counts_skipped_duplicates(db):
+    assert db.bulk_insert("chunks", [{"content": "a", "doc_id": 1}, {"content": "b", "doc_id": 1}]) == (2, 0)
+    rows = [{"content": "b", "doc_id": 2}, {"content": "c", "doc_id": 2}, {"content": "c", "doc_id": 3}]
+    assert db.bulk_insert("chunks", rows, on_conflict="ignore") == (1, 2)
+    assert sorted(db.fetch_all("chunks", "content, doc_id")) == [("a", 1), ("b", 1), ("c", 2)]
+    assert db.bulk_insert("chunks", []) == (0, 0)
+
+
+def test_bulk_insert_replace_overwrites_existing_rows(db):
+    db.bulk_insert("chunks", [{"content": "a", "doc_id": 1}, {"content": "b", "doc_id": 1}])
+    assert db.bulk_insert("chunks", [{"content": "b", "doc_id": 2}], on_conflict="replace") == (1, 0)
+    assert sorted(db.fetch_all("chunks", "content, doc_id")) == [("a", 1), ("b", 2)]
+    # 被替换的行重新分配 id
+    assert sorted(db.fetch_column("chunks", "id")) == [1, 3]
+
+
+def test_bulk_insert_fail_rolls_back_whole_batch(db):
+    db.bulk_insert("chunks", [{"content": "a", "doc_id": 1}])
+    with pytest.raises(sqlite3.IntegrityError):
+        db.bulk_insert("chunks", [{"content": "b", "doc_id": 2}, {"content": "a", "doc_id": 2}], on_conflict="fail")
+    assert db.fetch_column("chunks", "content") == ["a"]
+    with pytest.raises(ValueError):
+        db.bulk_insert("chunks", [{"content": "c", "doc_id": 2}], on_conflict="update")
+
+
+def test_delete_where_in_across_batches(db):
+    db.bulk_insert("chunks", [{"content": str(i), "doc_id": i % 3} for i in range(1, 12)])
+    assert db.delete_where_in("chunks", "id", [1, 2, 3, 4, 5, 99], batch_size=2) == 5
+    assert db.delete_where_in("chunks", "doc_id", [0], batch_size=2) == 2
+    assert db.delete_where_in("chunks", "id", []) == 0
+    assert sorted(db.fetch_column("chunks", "id")) == [7, 8, 10, 11]
+
+
+@pytest.mark.parametrize("count", [0, 1, 499, 500, 501, 1000, 1001])
+def test_fetch_by_id_batch_boundaries(db, count):
+    db.bulk_insert("chunks", [{"content": str(i), "doc_id": i} for i in range(1, 1202)])
+    ids = list(range(1, count + 1))
+    rows = db.fetch_by_id("chunks", ids, columns="id, content")
+    assert sorted(rows) == [(i, str(i)) for i in ids]
+
+
+def test_fetch_by_id_single_id_and_missing_ids(db):
+    db.bulk_insert("chunks", [{"content": "a", "doc_id": 1}, {"content": "b", "doc_id": 1}])
+    assert db.fetch_by_id("chunks", 2, columns="content") == [("b",)]
+    assert db.fetch_by_id("chunks", iter([1, 5, 2]), columns="id", batch_size=1) == [(1,), (2,)]
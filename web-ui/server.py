@@ -0,0 +1,211 @@
+# 本地 HTTP 查询服务：/query 以 server-sent events 逐个推送 token，/health 返回服务状态
+# 启动：python web-ui/server.py
+# 查询：curl -N "http://127.0.0.1:8000/query?q=顺产母猪的保健有哪些方法"
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # web-ui 不是合法的包名，以脚本方式运行
+from config.config import parameters
+from engine.async_engine import AsyncQueryEngine
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               429: "Too Many Requests", 500: "Internal Server Error", 504: "Gateway Timeout"}
+
+
+class QueryServer:
+    def __init__(self, engine: AsyncQueryEngine = None, host: str = parameters.server_host,
+                 port: int = parameters.server_port, queue_size: int = parameters.server_queue_size):
+        """
+        :param engine: AsyncQueryEngine 实例，None 时在启动时创建，向量化模型与 LanceDB 连接只加载一次
+        :param host: 监听地址
+        :param port: 监听端口
+        :param queue_size: 同时接纳的查询数（正在生成的与排队等待 LLM 的合计），超出时直接返回 429
+        """
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.pending = 0
+        self.rejected = 0
+        self.start_time = time.time()
+
+    async def read_request(self, reader):
+        """
+        解析 HTTP 请求。
+        :return: (method, path, query 参数字典, body)，连接已关闭时返回 None
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        if int(headers.get("content-length", 0)) > 0:
+            body = await reader.readexactly(int(headers["content-length"]))
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return method.upper(), url.path, query, body
+
+    @staticmethod
+    def response_head(status: int, headers: dict) -> bytes:
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+    async def send_json(self, writer, status: int, data: dict, headers: dict = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        head = {"Content-Type": "application/json; charset=utf-8",
+                "Content-Length": len(body),
+                "Connection": "close"}
+        head.update(headers or {})
+        writer.write(self.response_head(status, head) + body)
+        await writer.drain()
+
+    @staticmethod
+    def timing_headers(timings: dict) -> dict:
+        """
+        各阶段耗时（毫秒）放入响应头，例如 X-Latency-Embedding: 12.3。
+        """
+        return {f"X-Latency-{stage.replace('_', '-').title()}": f"{value * 1000:.1f}"
+                for stage, value in timings.items() if value is not None and stage != "tokens_per_sec"}
+
+    @staticmethod
+    def sse(event: str, data) -> bytes:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    async def handle_health(self, writer):
+        await self.send_json(writer, 200, {"status": "ok",
+                                           "uptime": time.time() - self.start_time,
+                                           "pending": self.pending,
+                                           "queue_size": self.queue_size,
+                                           "rejected": self.rejected,
+                                           "engine": self.engine.stats()})
+
+    async def handle_query(self, writer, question: str, streaming: bool):
+        """
+        流式响应在第一个 token 就绪后才发送响应头，此时向量化、检索、排队与首 token 的耗时都已确定并写入响应头；
+        生成与总耗时在最后的 done 事件中返回。
+        """
+        info = {}
+        token_stream = self.engine.stream(question, info)
+        if not streaming:
+            try:
+                tokens = [token async for token in token_stream]
+            except (TimeoutError, asyncio.TimeoutError):
+                await self.send_json(writer, 504, {"error": "query timeout"}, self.timing_headers(info.get("timings", {})))
+                return
+            finally:
+                await token_stream.aclose()
+            await self.send_json(writer, 200, {"question": question,
+                                               "answer": "".join(tokens),
+                                               "chunk_ids": info.get("chunk_ids", []),
+                                               "cached": info.get("cached", False),
+                                               "timings": info["timings"]},
+                                 self.timing_headers(info["timings"]))
+            return
+
+        head_sent = False
+        try:
+            async for token in token_stream:
+                if not head_sent:
+                    head = {"Content-Type": "text/event-stream; charset=utf-8",
+                            "Cache-Control": "no-cache",
+                            "Connection": "close",
+                            "X-Answer-Cached": str(info.get("cached", False)).lower()}
+                    head.update(self.timing_headers(info["timings"]))
+                    writer.write(self.response_head(200, head))
+                    writer.write(self.sse("meta", {"chunk_ids": info.get("chunk_ids", [])}))
+                    head_sent = True
+                writer.write(self.sse("token", token))
+                await writer.drain()  # 客户端断开时抛出异常，结束生成
+            if not head_sent:
+                writer.write(self.response_head(200, {"Content-Type": "text/event-stream; charset=utf-8",
+                                                      "Connection": "close"}))
+            writer.write(self.sse("done", {"timings": info["timings"]}))
+            await writer.drain()
+        except (TimeoutError, asyncio.TimeoutError):
+            if head_sent:
+                writer.write(self.sse("error", {"error": "query timeout", "timings": info.get("timings", {})}))
+                await writer.drain()
+            else:
+                await self.send_json(writer, 504, {"error": "query timeout"}, self.timing_headers(info.get("timings", {})))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise  # 客户端断开，不再写入
+        except Exception as e:
+            # 响应头已经发出时只能在事件流中报告错误
+            print(f"查询处理失败❌ {type(e).__name__}: {e}")
+            if head_sent:
+                writer.write(self.sse("error", {"error": f"{type(e).__name__}: {e}", "timings": info.get("timings", {})}))
+                await writer.drain()
+            else:
+                await self.send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            await token_stream.aclose()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+            method, path, query, body = request
+            if path == "/health":
+                await self.handle_health(writer)
+            elif path == "/query":
+                if method == "POST" and body:
+                    query.update(json.loads(body.decode("utf-8")))
+                elif method not in ("GET", "POST"):
+                    await self.send_json(writer, 405, {"error": "use GET or POST"})
+                    return
+                question = str(query.get("q") or query.get("question") or "").strip()
+                if not question:
+                    await self.send_json(writer, 400, {"error": "missing question, use ?q=..."})
+                    return
+                # 准入控制：接纳的查询已满时直接拒绝，避免请求无限排队
+                if self.pending >= self.queue_size:
+                    self.rejected += 1
+                    await self.send_json(writer, 429, {"error": "server busy", "pending": self.pending},
+                                         {"Retry-After": 1})
+                    return
+                self.pending += 1
+                try:
+                    streaming = str(query.get("stream", "1")).lower() not in ("0", "false", "no")
+                    await self.handle_query(writer, question, streaming)
+                finally:
+                    self.pending -= 1
+            else:
+                await self.send_json(writer, 404, {"error": f"unknown path {path}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # 客户端提前断开
+        except Exception as e:
+            print(f"请求处理失败❌ {type(e).__name__}: {e}")
+            try:
+                await self.send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if self.engine is None:
+            self.engine = AsyncQueryEngine()
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"查询服务已启动✅ http://{self.host}:{self.port}  /query?q=...  /health")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(QueryServer().serve())
+    except KeyboardInterrupt:
+        print("服务已停止。")